@@ -1,8 +1,20 @@
 # Copyright 2025, Ryan P. Kelly.
 
-from .cli import run
 from .version import __version__
 
+
+# the cli (and sqlalchemy with it) is imported on first use, so a client of
+# the daemon can import xsql.client without it. importing it binds the run
+# submodule here, which the function replaces as it did when imported eagerly
+def __getattr__(name):
+    if name == "run":
+        from .cli import run as cli_run
+        globals()["run"] = cli_run
+        return cli_run
+
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
 __all__ = [
     "__version__",
     "run",
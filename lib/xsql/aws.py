@@ -1,11 +1,79 @@
+import datetime
+import functools
+import os
+import threading
+
 from sqlalchemy.engine.url import make_url
 
+from .cache import open_store, TTLCache
+
+# how long resolved ssm and secrets manager values are reused, overridden with
+# XSQL_AWS_CACHE_TTL
+default_ttl = 300
+
+# rds auth tokens are valid for 15 minutes, they're treated as expiring a
+# little early so a connection is never attempted with a stale one
+rds_token_ttl = 15 * 60 - 60
+
+# and the same margin for the expiration redshift returns with credentials
+expiration_margin = 60
+
+clients = {}
+clients_lock = threading.Lock()
+
+
+@functools.cache
+def get_session():
+    import botocore.session
+
+    # one session per process, so credentials, config files and endpoint data
+    # are only loaded once
+    return botocore.session.get_session()
+
+
+def get_client(service_name, region_name):
+
+    # creating clients isn't thread safe, using them is, and they're used from
+    # the cache's refresh threads
+    with clients_lock:
+        key = (service_name, region_name)
+        if key not in clients:
+            clients[key] = get_session().create_client(
+                service_name=service_name,
+                region_name=region_name,
+            )
+
+        return clients[key]
+
+
+@functools.cache
+def get_cache():
+
+    # XSQL_AWS_CACHE is one of memory (the default), disk, which also keeps
+    # values in an encrypted file under ~/.xsql/cache so separate runs share
+    # them, or off
+    mode = os.environ.get("XSQL_AWS_CACHE", "memory").lower()
+
+    store = None
+    if mode == "disk":
+        store = open_store("aws")
+
+    return TTLCache(store=store, enabled=(mode != "off"))
+
+
+def get_ttl():
+    ttl = os.environ.get("XSQL_AWS_CACHE_TTL")
+    if ttl:
+        return float(ttl)
+
+    return default_ttl
+
 
 def resolve_arn(arn):
     if arn.startswith("arn:aws:ssm:"):
-        return resolve_ssm(arn)
+        return get_cache().get(arn, lambda: (resolve_ssm(arn), get_ttl()))
     elif arn.startswith("arn:aws:secretsmanager:"):
-        return resolve_secretsmanager(arn)
+        return get_cache().get(arn, lambda: (resolve_secretsmanager(arn), get_ttl()))
     else:
         raise ValueError("unable to handle {}".format(arn))
 
@@ -37,14 +105,8 @@ def get_name(arn):
 
 
 def resolve_ssm(arn):
-    import botocore.session
-
-    bs = botocore.session.get_session()
     region_name = get_region(arn)
-    ssm_client = bs.create_client(
-        "ssm",
-        region_name=region_name,
-    )
+    ssm_client = get_client("ssm", region_name)
 
     name = get_name(arn)
 
@@ -57,14 +119,8 @@ def resolve_ssm(arn):
 
 
 def resolve_secretsmanager(arn):
-    import botocore.session
-
-    bs = botocore.session.get_session()
     region_name = get_region(arn)
-    secretsmanager_client = bs.create_client(
-        "secretsmanager",
-        region_name=region_name,
-    )
+    secretsmanager_client = get_client("secretsmanager", region_name)
 
     resp = secretsmanager_client.get_secret_value(SecretId=arn)
 
@@ -72,18 +128,16 @@ def resolve_secretsmanager(arn):
 
 
 def rds_auth(url):
-    import botocore.session
+    return get_cache().get("rds:" + url, lambda: (_rds_auth(url), rds_token_ttl))
+
 
+def _rds_auth(url):
     url = make_url(url)
 
     host_parts = url.host.split(".")
     cluster_region = host_parts[2]
 
-    bs = botocore.session.get_session()
-    rds_client = bs.create_client(
-        service_name="rds",
-        region_name=cluster_region,
-    )
+    rds_client = get_client("rds", cluster_region)
 
     password = rds_client.generate_db_auth_token(
         DBHostname=url.host,
@@ -98,19 +152,17 @@ def rds_auth(url):
 
 
 def redshift_auth(url):
-    import botocore.session
+    return get_cache().get("redshift:" + url, lambda: _redshift_auth(url))
 
+
+def _redshift_auth(url):
     url = make_url(url)
 
     host_parts = url.host.split(".")
     cluster_region = host_parts[2]
     cluster_identifier = host_parts[0]
 
-    bs = botocore.session.get_session()
-    redshift_client = bs.create_client(
-        service_name="redshift",
-        region_name=cluster_region,
-    )
+    redshift_client = get_client("redshift", cluster_region)
 
     redshift_response = redshift_client.get_cluster_credentials(
         DbUser=url.username,
@@ -124,4 +176,7 @@ def redshift_auth(url):
 
     url = url.update_query_dict({"password": redshift_response["DbPassword"]})
 
-    return url.render_as_string(hide_password=False)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    ttl = (redshift_response["Expiration"] - now).total_seconds() - expiration_margin
+
+    return url.render_as_string(hide_password=False), ttl
@@ -0,0 +1,248 @@
+import json
+import os
+import sys
+import threading
+import time
+
+# entries are refreshed in the background once this much of their lifetime
+# has passed, so callers keep getting a valid value without waiting on it.
+# one nobody has read since it was last loaded is left to expire instead
+refresh_fraction = 0.7
+
+# where the on-disk cache's key is kept when XSQL_CACHE_KEY isn't set
+keyring_service = "xsql"
+keyring_username = "cache-key"
+
+
+class CacheKeyError(Exception):
+    pass
+
+
+class Entry:
+
+    def __init__(self, value, expires_at, refresh_at):
+        self.value = value
+        self.expires_at = expires_at
+        self.refresh_at = refresh_at
+        self.read = False
+
+
+class TTLCache:
+
+    def __init__(self, store=None, enabled=True):
+        self.store = store
+        self.enabled = enabled
+        self.entries = {}
+        self.timers = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, loader):
+
+        # loader returns a (value, ttl in seconds) pair
+        if not self.enabled:
+            value, _ = loader()
+            return value
+
+        now = time.time()
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+        if entry is None and self.store is not None:
+            entry = self.store.get(key)
+            if entry is not None and entry.expires_at > now:
+                with self.lock:
+                    self.entries[key] = entry
+                self._schedule(key, loader, entry.refresh_at - now)
+
+        if entry is not None and entry.expires_at > now:
+            entry.read = True
+            return entry.value
+
+        return self._load(key, loader)
+
+    def _load(self, key, loader):
+
+        value, ttl = loader()
+
+        # already expired (or about to), nothing worth keeping or refreshing
+        if ttl <= 0:
+            return value
+
+        now = time.time()
+        entry = Entry(value, now + ttl, now + ttl * refresh_fraction)
+
+        with self.lock:
+            self.entries[key] = entry
+
+        if self.store is not None:
+            self.store.set(key, entry)
+
+        self._schedule(key, loader, ttl * refresh_fraction)
+
+        return value
+
+    def _schedule(self, key, loader, delay):
+
+        timer = threading.Timer(max(delay, 0), self._refresh, args=(key, loader))
+        timer.daemon = True
+
+        with self.lock:
+            previous = self.timers.pop(key, None)
+            self.timers[key] = timer
+
+        if previous is not None:
+            previous.cancel()
+
+        timer.start()
+
+    def _refresh(self, key, loader):
+
+        with self.lock:
+            entry = self.entries.get(key)
+
+        if entry is None or not entry.read:
+            return
+
+        try:
+            self._load(key, loader)
+        except Exception:
+            # keep handing out the current value until it expires, the next
+            # caller after that loads it again (and sees the error)
+            pass
+
+
+def get_cache_key():
+
+    key = os.environ.get("XSQL_CACHE_KEY")
+    if key:
+        return key.encode("utf-8")
+
+    from cryptography.fernet import Fernet
+
+    try:
+        import keyring
+        import keyring.errors
+    except ImportError:
+        raise CacheKeyError("set XSQL_CACHE_KEY or install keyring")
+
+    try:
+        key = keyring.get_password(keyring_service, keyring_username)
+        if key:
+            return key.encode("utf-8")
+
+        key = Fernet.generate_key()
+        keyring.set_password(keyring_service, keyring_username, key.decode("utf-8"))
+    except keyring.errors.KeyringError as ex:
+        raise CacheKeyError("unable to use the keyring ({}), set XSQL_CACHE_KEY instead".format(ex))
+
+    return key
+
+
+class FileStore:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def encode(self, data):
+        return json.dumps(data).encode("utf-8")
+
+    def decode(self, data):
+        return json.loads(data)
+
+    def _read(self):
+
+        try:
+            with open(self.path, "rb") as fp:
+                data = fp.read()
+        except FileNotFoundError:
+            return {}
+
+        try:
+            return self.decode(data)
+        except ValueError:
+            return {}
+
+    def get(self, key):
+
+        with self.lock:
+            data = self._read()
+
+        if key not in data:
+            return None
+
+        value, expires_at, refresh_at = data[key]
+
+        return Entry(value, expires_at, refresh_at)
+
+    def set(self, key, entry):
+
+        with self.lock:
+            data = self._read()
+
+            now = time.time()
+            data = {
+                name: item
+                for name, item in data.items()
+                if item[1] > now
+            }
+
+            data[key] = [entry.value, entry.expires_at, entry.refresh_at]
+
+            # written next to the cache and renamed over it, so concurrent
+            # readers never see a partial file
+            temporary = "{}.{}".format(self.path, os.getpid())
+
+            fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(self.encode(data))
+
+            os.replace(temporary, self.path)
+
+
+class EncryptedStore(FileStore):
+
+    def __init__(self, path, key):
+        from cryptography.fernet import Fernet
+
+        super().__init__(path)
+        self.fernet = Fernet(key)
+
+    def encode(self, data):
+        return self.fernet.encrypt(super().encode(data))
+
+    def decode(self, data):
+        from cryptography.fernet import InvalidToken
+
+        try:
+            return super().decode(self.fernet.decrypt(data))
+        except InvalidToken:
+            raise ValueError("unable to decrypt {}".format(self.path))
+
+
+def get_cache_directory():
+    return os.path.expanduser("~/.xsql/cache")
+
+
+def open_store(name, encrypted=True):
+
+    directory = get_cache_directory()
+
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+        if not encrypted:
+            return FileStore(os.path.join(directory, name))
+
+        return EncryptedStore(os.path.join(directory, name), get_cache_key())
+    except ImportError:
+        sys.stderr.write("WARNING:  the on-disk cache requires the cryptography package, caching in memory only\n")
+    except CacheKeyError as ex:
+        sys.stderr.write("WARNING:  no key for the on-disk cache: {}, caching in memory only\n".format(ex))
+    except (OSError, ValueError) as ex:
+        sys.stderr.write("WARNING:  unable to open the on-disk cache: {}\n".format(ex))
+
+    sys.stderr.flush()
+
+    return None
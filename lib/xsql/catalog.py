@@ -0,0 +1,836 @@
+import collections
+
+from sqlalchemy import bindparam, text
+
+# where completion and \d read the catalog from, a source per dialect. each
+# only goes through conn.execute, so a stub connection returning rows is
+# enough to exercise one
+
+
+def quote_identifier(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+# an object \d describes, found without asking the server
+DescribeObject = collections.namedtuple(
+    "DescribeObject",
+    ["object_type", "object_schema", "object_name", "object_oid"],
+)
+
+
+class DescribeRows:
+
+    # rows already fetched, in the shape output.write reads a result in
+
+    def __init__(self, keys, rows):
+        self._keys = keys
+        self.rows = rows
+
+    def keys(self):
+        return self._keys
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+class CatalogSource:
+
+    # information_schema, which most databases have some version of. the
+    # sources below override whatever their dialect has something quicker for
+
+    schemas_query = """
+        select
+            schema_name as schema_name
+        from
+            information_schema.schemata
+        """
+
+    # table names, with a null column name (their columns are read on
+    # demand), and function names. tables also come with what \dt and \d
+    # show of them, so they can be answered from the completion catalog
+    names_query = """
+        select
+            table_name as table_name,
+            null as column_name,
+            null as function_name,
+            case
+                when table_type = 'BASE TABLE' then 'table'
+                when table_type = 'VIEW' then 'view'
+                else 'other'
+            end as relation_type,
+            null as relation_owner,
+            null as relation_oid
+        from
+            information_schema.tables
+        where
+            table_schema = :schema_name
+        union
+        select
+            null as table_name,
+            null as column_name,
+            routine_name || '(' as function_name,
+            null as relation_type,
+            null as relation_owner,
+            null as relation_oid
+        from
+            information_schema.routines
+        where
+            routine_schema = :schema_name
+        """
+
+    # the columns of several tables in a schema, read in one go
+    columns_query = """
+        select
+            table_name as table_name,
+            column_name as column_name
+        from
+            information_schema.columns
+        where
+            table_schema = :schema_name
+            and table_name in :table_names
+        order by
+            table_name,
+            ordinal_position
+        """
+
+    # a cheap query whose result changes whenever the catalog does, checked
+    # against the one saved with a completion snapshot to tell whether it's
+    # still current. without one a snapshot is shown while the catalog is
+    # always read again
+    marker_query = None
+
+    # whether \dt and \d patterns may be matched against the completion
+    # catalog rather than sent here
+    snapshot_lookups = True
+
+    # \dt
+    relations_query = """
+        select
+            information_schema.tables.table_schema as "Schema",
+            information_schema.tables.table_name as "Name",
+            case
+                when information_schema.tables.table_type = 'BASE TABLE' then 'table'
+                when information_schema.tables.table_type = 'VIEW' then 'view'
+                else 'other'
+            end as "Type",
+            null::text as "Owner"
+        from
+            information_schema.tables
+        where
+            :target is null
+            or (information_schema.tables.table_schema || '.' || information_schema.tables.table_name) ilike :target
+            or information_schema.tables.table_name ilike :target
+        order by
+            information_schema.tables.table_schema,
+            information_schema.tables.table_name
+        """
+
+    # the objects \d describes
+    objects_query = """
+        select
+            't' as object_type,
+            information_schema.tables.table_schema as object_schema,
+            information_schema.tables.table_name as object_name
+        from
+            information_schema.tables
+        where
+            :filter_target is null
+            or (information_schema.tables.table_schema || '.' || information_schema.tables.table_name) ilike :filter_target
+            or information_schema.tables.table_name ilike :filter_target
+        order by
+            information_schema.tables.table_schema,
+            information_schema.tables.table_name
+        """
+
+    # the columns \d shows, for all of them at once. the leading object_
+    # columns say which object a row belongs to and aren't shown
+    describe_query = """
+        select
+            information_schema.columns.table_schema as object_schema,
+            information_schema.columns.table_name as object_name,
+            information_schema.columns.column_name as "Column",
+            information_schema.columns.data_type as "Type",
+            coalesce(information_schema.columns.collation_name, '') as "Collation",
+            case
+                when information_schema.columns.is_nullable = 'NO' then 'not null'
+                else ''
+            end as "Nullable",
+            coalesce(information_schema.columns.column_default, '') as "Default"
+        from
+            information_schema.columns
+        where
+            information_schema.columns.table_schema in :object_schemas
+            and information_schema.columns.table_name in :object_names
+        order by
+            information_schema.columns.table_schema,
+            information_schema.columns.table_name,
+            information_schema.columns.ordinal_position
+        """
+
+    def get_schema_names(self, conn):
+        return [r.schema_name for r in conn.execute(text(self.schemas_query))]
+
+    def get_names(self, conn, schema_name):
+
+        tables = {}
+        functions = []
+        relations = {}
+
+        name_results = conn.execute(text(self.names_query), {"schema_name": schema_name})
+        for name_result in name_results:
+            if name_result.function_name:
+                functions.append(name_result.function_name)
+                continue
+
+            relations[name_result.table_name] = (
+                name_result.relation_type,
+                name_result.relation_owner,
+                name_result.relation_oid,
+            )
+
+            if name_result.column_name is None:
+                tables[name_result.table_name] = None
+            else:
+                tables.setdefault(name_result.table_name, [])
+                tables[name_result.table_name].append(name_result.column_name)
+
+        return tables, functions, relations
+
+    def get_columns(self, conn, schema_name, table_names):
+
+        columns_query = text(self.columns_query).bindparams(bindparam("table_names", expanding=True))
+
+        columns = {}
+
+        column_results = conn.execute(columns_query, {"schema_name": schema_name, "table_names": table_names})
+        for column_result in column_results:
+            columns.setdefault(column_result.table_name, [])
+            columns[column_result.table_name].append(column_result.column_name)
+
+        return columns
+
+    def get_marker(self, conn):
+
+        if self.marker_query is None:
+            return None
+
+        row = conn.execute(text(self.marker_query)).fetchone()
+
+        return [str(value) for value in row]
+
+    def get_relations_query(self, conn, target):
+        return text(self.relations_query).bindparams(target=target)
+
+    def get_objects(self, conn, target):
+        return list(conn.execute(text(self.objects_query).bindparams(filter_target=target)))
+
+    def get_object_key(self, object_result):
+        return (object_result.object_schema, object_result.object_name)
+
+    def get_describe_params(self, objects):
+
+        # every schema against every name can match a few objects that
+        # weren't asked for, they're never looked up
+        return {
+            "object_schemas": sorted({o.object_schema for o in objects}),
+            "object_names": sorted({o.object_name for o in objects}),
+        }
+
+    def get_describe_columns(self, conn, objects):
+
+        params = self.get_describe_params(objects)
+
+        describe_query = text(self.describe_query).bindparams(
+            *[bindparam(name, expanding=True) for name in params]
+        )
+
+        describe_results = conn.execute(describe_query, params)
+
+        key_size = len(self.get_object_key(objects[0]))
+
+        keys = list(describe_results.keys())[key_size:]
+
+        columns = {}
+        for describe_result in describe_results:
+            columns.setdefault(tuple(describe_result[:key_size]), [])
+            columns[tuple(describe_result[:key_size])].append(tuple(describe_result[key_size:]))
+
+        return keys, columns
+
+
+class PostgresCatalogSource(CatalogSource):
+
+    # pg_catalog, looking relations up by namespace oid and columns by
+    # relation oid, so every lookup is an index scan
+
+    schemas_query = """
+        select
+            pg_catalog.pg_namespace.nspname as schema_name
+        from
+            pg_catalog.pg_namespace
+        """
+
+    names_query = """
+        select
+            pg_catalog.pg_class.relname as table_name,
+            null as column_name,
+            null as function_name,
+            case pg_catalog.pg_class.relkind
+                when 'r' then 'table'
+                when 'v' then 'view'
+                when 'm' then 'materialized view'
+                when 'f' then 'foreign table'
+                when 'p' then 'partitioned table'
+            end as relation_type,
+            pg_catalog.pg_get_userbyid(pg_catalog.pg_class.relowner) as relation_owner,
+            pg_catalog.pg_class.oid as relation_oid
+        from
+            pg_catalog.pg_class
+        where
+            pg_catalog.pg_class.relnamespace = (
+                select
+                    pg_catalog.pg_namespace.oid
+                from
+                    pg_catalog.pg_namespace
+                where
+                    pg_catalog.pg_namespace.nspname = :schema_name
+            )
+            and pg_catalog.pg_class.relkind in ('r', 'v', 'm', 'f', 'p')
+        union
+        select
+            null as table_name,
+            null as column_name,
+            pg_catalog.pg_proc.proname || '(' as function_name,
+            null as relation_type,
+            null as relation_owner,
+            null as relation_oid
+        from
+            pg_catalog.pg_proc
+        where
+            pg_catalog.pg_proc.pronamespace = (
+                select
+                    pg_catalog.pg_namespace.oid
+                from
+                    pg_catalog.pg_namespace
+                where
+                    pg_catalog.pg_namespace.nspname = :schema_name
+            )
+        """
+
+    columns_query = """
+        select
+            pg_catalog.pg_class.relname as table_name,
+            pg_catalog.pg_attribute.attname as column_name
+        from
+            pg_catalog.pg_class
+        join
+            pg_catalog.pg_attribute
+        on
+            pg_catalog.pg_class.oid = pg_catalog.pg_attribute.attrelid
+        where
+            pg_catalog.pg_class.relnamespace = (
+                select
+                    pg_catalog.pg_namespace.oid
+                from
+                    pg_catalog.pg_namespace
+                where
+                    pg_catalog.pg_namespace.nspname = :schema_name
+            )
+            and pg_catalog.pg_class.relname in :table_names
+            and pg_catalog.pg_attribute.attnum > 0
+            and not pg_catalog.pg_attribute.attisdropped
+        order by
+            pg_catalog.pg_class.relname,
+            pg_catalog.pg_attribute.attnum
+        """
+
+    marker_query = """
+        select
+            (select count(*) from pg_catalog.pg_class) as classes,
+            (select max(xmin::text::bigint) from pg_catalog.pg_class) as class_xmin,
+            (select max(xmin::text::bigint) from pg_catalog.pg_attribute) as attribute_xmin,
+            (select count(*) from pg_catalog.pg_proc) as procs,
+            (select max(xmin::text::bigint) from pg_catalog.pg_proc) as proc_xmin
+        """
+
+    relations_query = """
+        select
+            pg_catalog.pg_namespace.nspname as "Schema",
+            pg_catalog.pg_class.relname as "Name",
+            case pg_catalog.pg_class.relkind
+                when 'r' then 'table'
+                when 'v' then 'view'
+                when 'm' then 'materialized view'
+                when 'f' then 'foreign table'
+                when 'p' then 'partitioned table'
+            end as "Type",
+            pg_catalog.pg_get_userbyid(pg_catalog.pg_class.relowner) as "Owner"
+        from
+            pg_catalog.pg_class
+        join
+            pg_catalog.pg_namespace
+        on
+            pg_catalog.pg_class.relnamespace = pg_catalog.pg_namespace.oid
+        where
+            pg_catalog.pg_class.relkind in ('r', 'v', 'm', 'f', 'p')
+            and (
+                :target is null
+                or (pg_catalog.pg_namespace.nspname || '.' || pg_catalog.pg_class.relname) ilike :target
+                or pg_catalog.pg_class.relname ilike :target
+            )
+        order by
+            pg_catalog.pg_namespace.nspname,
+            pg_catalog.pg_class.relname
+        """
+
+    objects_query = """
+        select
+            't' as object_type,
+            pg_catalog.pg_namespace.nspname as object_schema,
+            pg_catalog.pg_class.relname as object_name,
+            pg_catalog.pg_class.oid as object_oid
+        from
+            pg_catalog.pg_class
+        join
+            pg_catalog.pg_namespace
+        on
+            pg_catalog.pg_class.relnamespace = pg_catalog.pg_namespace.oid
+        where
+            pg_catalog.pg_class.relkind in ('r', 'v', 'm', 'f', 'p')
+            and (
+                :filter_target is null
+                or (pg_catalog.pg_namespace.nspname || '.' || pg_catalog.pg_class.relname) ilike :filter_target
+                or pg_catalog.pg_class.relname ilike :filter_target
+            )
+        order by
+            pg_catalog.pg_namespace.nspname,
+            pg_catalog.pg_class.relname
+        """
+
+    # collations are only shown where they differ from the type's, as psql
+    # does
+    describe_query = """
+        select
+            pg_catalog.pg_attribute.attrelid as object_oid,
+            pg_catalog.pg_attribute.attname as "Column",
+            pg_catalog.format_type(pg_catalog.pg_attribute.atttypid, pg_catalog.pg_attribute.atttypmod) as "Type",
+            case
+                when pg_catalog.pg_attribute.attcollation <> pg_catalog.pg_type.typcollation then pg_catalog.pg_collation.collname
+                else ''
+            end as "Collation",
+            case
+                when pg_catalog.pg_attribute.attnotnull then 'not null'
+                else ''
+            end as "Nullable",
+            coalesce(pg_catalog.pg_get_expr(pg_catalog.pg_attrdef.adbin, pg_catalog.pg_attrdef.adrelid), '') as "Default"
+        from
+            pg_catalog.pg_attribute
+        join
+            pg_catalog.pg_type
+        on
+            pg_catalog.pg_attribute.atttypid = pg_catalog.pg_type.oid
+        left join
+            pg_catalog.pg_collation
+        on
+            pg_catalog.pg_attribute.attcollation = pg_catalog.pg_collation.oid
+        left join
+            pg_catalog.pg_attrdef
+        on
+            pg_catalog.pg_attribute.attrelid = pg_catalog.pg_attrdef.adrelid
+            and pg_catalog.pg_attribute.attnum = pg_catalog.pg_attrdef.adnum
+        where
+            pg_catalog.pg_attribute.attrelid in :object_oids
+            and pg_catalog.pg_attribute.attnum > 0
+            and not pg_catalog.pg_attribute.attisdropped
+        order by
+            pg_catalog.pg_attribute.attrelid,
+            pg_catalog.pg_attribute.attnum
+        """
+
+    def get_object_key(self, object_result):
+        return (object_result.object_oid,)
+
+    def get_describe_params(self, objects):
+        return {"object_oids": [o.object_oid for o in objects]}
+
+
+class RedshiftCatalogSource(CatalogSource):
+
+    # svv_tables and svv_columns, which unlike information_schema and
+    # pg_table_def cover external tables and late binding views, in every
+    # schema rather than just those on the search_path. they can't be
+    # combined with the leader node only pg_catalog tables in one query, so
+    # functions are read separately
+
+    schemas_query = PostgresCatalogSource.schemas_query
+
+    tables_query = """
+        select
+            svv_tables.table_name as table_name,
+            case
+                when svv_tables.table_type = 'BASE TABLE' then 'table'
+                when svv_tables.table_type = 'VIEW' then 'view'
+                when svv_tables.table_type = 'EXTERNAL TABLE' then 'external table'
+                else 'other'
+            end as relation_type
+        from
+            svv_tables
+        where
+            svv_tables.table_schema = :schema_name
+        """
+
+    functions_query = """
+        select
+            pg_catalog.pg_proc.proname || '(' as function_name
+        from
+            pg_catalog.pg_proc
+        join
+            pg_catalog.pg_namespace
+        on
+            pg_catalog.pg_proc.pronamespace = pg_catalog.pg_namespace.oid
+        where
+            pg_catalog.pg_namespace.nspname = :schema_name
+        """
+
+    columns_query = """
+        select
+            svv_columns.table_name as table_name,
+            svv_columns.column_name as column_name
+        from
+            svv_columns
+        where
+            svv_columns.table_schema = :schema_name
+            and svv_columns.table_name in :table_names
+        order by
+            svv_columns.table_name,
+            svv_columns.ordinal_position
+        """
+
+    relations_query = """
+        select
+            svv_tables.table_schema as "Schema",
+            svv_tables.table_name as "Name",
+            case
+                when svv_tables.table_type = 'BASE TABLE' then 'table'
+                when svv_tables.table_type = 'VIEW' then 'view'
+                when svv_tables.table_type = 'EXTERNAL TABLE' then 'external table'
+                else 'other'
+            end as "Type",
+            null::text as "Owner"
+        from
+            svv_tables
+        where
+            :target is null
+            or (svv_tables.table_schema || '.' || svv_tables.table_name) ilike :target
+            or svv_tables.table_name ilike :target
+        order by
+            svv_tables.table_schema,
+            svv_tables.table_name
+        """
+
+    objects_query = """
+        select
+            't' as object_type,
+            svv_tables.table_schema as object_schema,
+            svv_tables.table_name as object_name
+        from
+            svv_tables
+        where
+            :filter_target is null
+            or (svv_tables.table_schema || '.' || svv_tables.table_name) ilike :filter_target
+            or svv_tables.table_name ilike :filter_target
+        order by
+            svv_tables.table_schema,
+            svv_tables.table_name
+        """
+
+    describe_query = """
+        select
+            svv_columns.table_schema as object_schema,
+            svv_columns.table_name as object_name,
+            svv_columns.column_name as "Column",
+            svv_columns.data_type as "Type",
+            coalesce(svv_columns.collation_name, '') as "Collation",
+            case
+                when svv_columns.is_nullable = 'NO' then 'not null'
+                else ''
+            end as "Nullable",
+            coalesce(svv_columns.column_default, '') as "Default"
+        from
+            svv_columns
+        where
+            svv_columns.table_schema in :object_schemas
+            and svv_columns.table_name in :object_names
+        order by
+            svv_columns.table_schema,
+            svv_columns.table_name,
+            svv_columns.ordinal_position
+        """
+
+    def get_names(self, conn, schema_name):
+
+        tables = {}
+        relations = {}
+
+        for r in conn.execute(text(self.tables_query), {"schema_name": schema_name}):
+            tables[r.table_name] = None
+            relations[r.table_name] = (r.relation_type, None, None)
+
+        functions = [
+            r.function_name
+            for r in conn.execute(text(self.functions_query), {"schema_name": schema_name})
+        ]
+
+        return tables, functions, relations
+
+
+class SnowflakeCatalogSource(CatalogSource):
+
+    # SHOW commands, which are answered from metadata without a warehouse and
+    # without scanning information_schema. where their output is shown it's
+    # reshaped with result_scan, run straight after them on the same
+    # connection
+
+    marker_query = """
+        select
+            (select count(*) from information_schema.tables) as tables,
+            (select max(last_ddl) from information_schema.tables) as last_ddl,
+            (select count(*) from information_schema.procedures) as procedures,
+            (select max(last_altered) from information_schema.procedures) as last_altered
+        """
+
+    relations_query = """
+        select
+            "schema_name" as "Schema",
+            "name" as "Name",
+            lower(replace("kind", '_', ' ')) as "Type",
+            null as "Owner"
+        from
+            table(result_scan(last_query_id()))
+        where
+            :target is null
+            or ("schema_name" || '.' || "name") ilike :target
+            or "name" ilike :target
+        order by
+            "schema_name",
+            "name"
+        """
+
+    objects_query = """
+        select
+            't' as object_type,
+            "schema_name" as object_schema,
+            "name" as object_name
+        from
+            table(result_scan(last_query_id()))
+        where
+            :filter_target is null
+            or ("schema_name" || '.' || "name") ilike :filter_target
+            or "name" ilike :filter_target
+        order by
+            "schema_name",
+            "name"
+        """
+
+    # data_type is json, with FIXED and REAL for what information_schema
+    # calls NUMBER and FLOAT
+    describe_query = """
+        select
+            "schema_name" as object_schema,
+            "table_name" as object_name,
+            "column_name" as "Column",
+            decode(
+                parse_json("data_type"):type::string,
+                'FIXED', 'NUMBER',
+                'REAL', 'FLOAT',
+                parse_json("data_type"):type::string
+            ) as "Type",
+            coalesce(parse_json("data_type"):collation::string, '') as "Collation",
+            case
+                when "null?" = 'false' then 'not null'
+                else ''
+            end as "Nullable",
+            coalesce("default", '') as "Default"
+        from
+            table(result_scan(last_query_id()))
+        where
+            "schema_name" in :object_schemas
+            and "table_name" in :object_names
+        """
+
+    def get_schema_names(self, conn):
+        return [r.name for r in conn.execute(text("show terse schemas in database"))]
+
+    def get_names(self, conn, schema_name):
+
+        schema = quote_identifier(schema_name)
+
+        tables = {}
+        relations = {}
+
+        for r in conn.execute(text("show terse objects in schema {}".format(schema))):
+            tables[r.name] = None
+            relations[r.name] = (r.kind.lower().replace("_", " "), None, None)
+
+        # built in procedures are listed as well, without a schema
+        functions = [
+            r.name + "("
+            for r in conn.execute(text("show procedures in schema {}".format(schema)))
+            if r.schema_name == schema_name
+        ]
+
+        return tables, functions, relations
+
+    def get_columns(self, conn, schema_name, table_names):
+
+        # the whole schema in one round trip, views included, rather than a
+        # show per table
+        wanted = set(table_names)
+
+        columns = {}
+
+        column_results = conn.execute(text("show columns in schema {}".format(quote_identifier(schema_name))))
+        for column_result in column_results:
+            if column_result.table_name in wanted:
+                columns.setdefault(column_result.table_name, [])
+                columns[column_result.table_name].append(column_result.column_name)
+
+        return columns
+
+    def show_objects(self, conn, target):
+
+        # a pattern without a schema narrows what's listed, anything else is
+        # matched against everything in the database
+        if target and "." not in target:
+            conn.execute(text("show terse objects like :target in database").bindparams(target=target))
+        else:
+            conn.execute(text("show terse objects in database"))
+
+    def get_relations_query(self, conn, target):
+        self.show_objects(conn, target)
+        return super().get_relations_query(conn, target)
+
+    def get_objects(self, conn, target):
+        self.show_objects(conn, target)
+        return super().get_objects(conn, target)
+
+    def get_describe_columns(self, conn, objects):
+
+        # tables and views alike, in one show rather than one per object
+        schema_names = {o.object_schema for o in objects}
+        if len(schema_names) == 1:
+            conn.execute(text("show columns in schema {}".format(quote_identifier(schema_names.pop()))))
+        else:
+            conn.execute(text("show columns in database"))
+
+        return super().get_describe_columns(conn, objects)
+
+
+class SQLiteCatalogSource(CatalogSource):
+
+    # the catalog is local, so columns are read up front along with the
+    # table names, and \dt and \d always ask it (\dt lists indexes too,
+    # which completion doesn't keep)
+
+    snapshot_lookups = False
+
+    names_query = """
+        select
+            sqlite_master.tbl_name as table_name,
+            info.name as column_name,
+            null as function_name,
+            sqlite_master.type as relation_type,
+            null as relation_owner,
+            null as relation_oid
+        from
+            sqlite_master,
+            pragma_table_info(sqlite_master.tbl_name) as info
+        where
+            sqlite_master.type in ('table', 'view')
+        """
+
+    columns_query = """
+        select
+            sqlite_master.tbl_name as table_name,
+            info.name as column_name
+        from
+            sqlite_master,
+            pragma_table_info(sqlite_master.tbl_name) as info
+        where
+            sqlite_master.type in ('table', 'view')
+            and sqlite_master.tbl_name in :table_names
+        order by
+            sqlite_master.tbl_name,
+            info.cid
+        """
+
+    relations_query = """
+        select
+            'sqlite' as "Schema",
+            tbl_name as "Name",
+            "type" as "Type",
+            null as "Owner"
+        from
+            sqlite_master
+        where
+            :target is null
+            or ('sqlite.' || tbl_name) like :target
+            or tbl_name like :target
+        order by
+            tbl_name
+        """
+
+    objects_query = """
+        select
+            't' as object_type,
+            null as object_schema,
+            sqlite_master.tbl_name as object_name
+        from
+            sqlite_master
+        where
+            sqlite_master.type in ('table', 'view')
+            and sqlite_master.tbl_name like :filter_target
+        order by
+            sqlite_master.tbl_name
+        """
+
+    describe_query = """
+        select
+            null as object_schema,
+            sqlite_master.tbl_name as object_name,
+            info.name as "Column",
+            info."type" as "Type",
+            '' as "Collation",
+            case
+                when info."notnull" is distinct from 0 then 'not null'
+                else ''
+            end as "Nullable",
+            info.dflt_value as "Default"
+        from
+            sqlite_master,
+            pragma_table_info(sqlite_master.tbl_name) as info
+        where
+            sqlite_master.type in ('table', 'view')
+            and sqlite_master.tbl_name in :object_names
+        order by
+            sqlite_master.tbl_name,
+            info.cid
+        """
+
+    def get_schema_names(self, conn):
+        return [None]
+
+    def get_describe_params(self, objects):
+        return {"object_names": sorted({o.object_name for o in objects})}
+
+
+catalog_sources = {
+    "postgresql": PostgresCatalogSource,
+    "redshift": RedshiftCatalogSource,
+    "snowflake": SnowflakeCatalogSource,
+    "sqlite": SQLiteCatalogSource,
+}
+
+
+def get_catalog_source(conn):
+    return catalog_sources.get(conn.dialect.name, CatalogSource)()
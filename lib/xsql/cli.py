@@ -1,3 +1,4 @@
+import atexit
 import logging
 import re
 import signal
@@ -12,14 +13,9 @@ except ImportError:
     pass
 
 import sqlalchemy
-import sqlglot
-from prompt_toolkit import PromptSession
-from prompt_toolkit.key_binding import KeyBindings
-from prompt_toolkit.keys import Keys
-from prompt_toolkit.output.color_depth import ColorDepth
-
-from .completion import completer, get_complete_style, refresh_completions
-from .config import config
+
+from .compression import CompressionError, open_compressed
+from .config import close_output, config
 from .db import (
     connect,
     display_ssl_info,
@@ -36,9 +32,6 @@ from .exc import (
     SnowflakeProgrammingError,
     SnowflakeReauthenticationRequest,
 )
-from .history import history
-from .lexer import lexer
-from .prompt import render_prompt
 from .run import (
     is_maybe_metacommand,
     metacommand_conninfo,
@@ -52,34 +45,98 @@ sqlglot_logger = logging.getLogger("sqlglot")
 sqlglot_logger.setLevel(logging.ERROR)
 
 
-bindings = KeyBindings()
+# prompt_toolkit, sqlglot and everything else only the interactive prompt
+# needs are imported when the prompt starts, so -c and -f runs don't pay for
+# them at startup
+def get_key_bindings():
+    import sqlglot
+    from prompt_toolkit.key_binding import KeyBindings
+    from prompt_toolkit.keys import Keys
 
+    bindings = KeyBindings()
 
-@bindings.add(Keys.Enter)
-def _(event):
+    @bindings.add(Keys.Enter)
+    def _(event):
 
-    if not event.current_buffer.text.strip():
-        event.current_buffer.validate_and_handle()
-        return
+        if not event.current_buffer.text.strip():
+            event.current_buffer.validate_and_handle()
+            return
+
+        if is_maybe_metacommand(event.current_buffer.text):
+            event.current_buffer.validate_and_handle()
+            return
+
+        if not re.search(r";\s*$", event.current_buffer.text):
+            event.current_buffer.insert_text("\n")
+            return
+
+        try:
+            sqlglot.transpile(event.current_buffer.text)
+        except sqlglot.errors.ParseError:
+            if re.search(r";\s*$", event.current_buffer.text):
+                event.current_buffer.validate_and_handle()
+            else:
+                event.current_buffer.insert_text("\n")
+            return
 
-    if is_maybe_metacommand(event.current_buffer.text):
         event.current_buffer.validate_and_handle()
-        return
 
-    if not re.search(r";\s*$", event.current_buffer.text):
-        event.current_buffer.insert_text("\n")
-        return
+    return bindings
+
+
+def apply_args(args):
+
+    if args.tuples_only:
+        config.tuples_only = args.tuples_only
+
+    if args.csv:
+        config.format_ = "csv"
+
+    if args.no_align:
+        config.format_ = "unaligned"
+
+    if args.expanded:
+        config.extended_display = args.expanded
+
+    if args.field_separator:
+        config.field_separator = args.field_separator
+
+    if args.field_separator_zero:
+        config.field_separator = "\0"
+
+    if args.record_separator_zero:
+        config.record_separator = "\0"
+
+    if args.translate:
+        from_, to = args.translate.split(":")
+        config.translate_from = from_
+        config.translate_to = to
+
+    if args.set:
+        for entry in args.set:
+            name, value = entry.split("=")
+            config.variables[name] = value
 
-    try:
-        sqlglot.transpile(event.current_buffer.text)
-    except sqlglot.errors.ParseError:
-        if re.search(r";\s*$", event.current_buffer.text):
-            event.current_buffer.validate_and_handle()
-        else:
-            event.current_buffer.insert_text("\n")
-        return
 
-    event.current_buffer.validate_and_handle()
+def write_connect_error(exc):
+    is_postgres = False
+    if hasattr(exc, "orig") and hasattr(exc.orig, "pgerror"):
+        is_postgres = True
+        pgexc = exc.orig
+    if hasattr(exc, "pgerror"):
+        is_postgres = True
+        pgexc = exc
+
+    sys.stdout.write("xsql: error: ")
+    if not is_postgres:
+        sys.stdout.write("connection to server failed: ")
+        sys.stdout.write(exc.orig.args[0])
+        if not exc.orig.args[0].endswith("\n"):
+            sys.stdout.write("\n")
+    else:
+        sys.stdout.write(pgexc.args[0])
+
+    sys.stdout.flush()
 
 
 def try_close(conn):
@@ -90,6 +147,23 @@ def try_close(conn):
 
 
 def run(args):
+
+    if args.daemon:
+        from .daemon import default_idle_timeout, serve
+
+        idle_timeout = args.daemon_idle_timeout
+        if idle_timeout is None:
+            idle_timeout = default_idle_timeout
+
+        sys.exit(serve(idle_timeout))
+
+    if args.daemon_stop:
+        from .client import stop_daemon
+        sys.exit(stop_daemon())
+
+    # runs through a daemon are handed off by the xsql script, before any of
+    # this module is imported
+
     try:
         _run(args)
     except (SnowflakeError, SnowflakeProgrammingError, SnowflakeReauthenticationRequest) as _:
@@ -122,24 +196,7 @@ def _run(args):
     try:
         conn = connect(url)
     except (sqlalchemy.exc.SQLAlchemyError, PGError) as exc:
-        is_postgres = False
-        if hasattr(exc, "orig") and hasattr(exc.orig, "pgerror"):
-            is_postgres = True
-            pgexc = exc.orig
-        if hasattr(exc, "pgerror"):
-            is_postgres = True
-            pgexc = exc
-
-        sys.stdout.write("xsql: error: ")
-        if not is_postgres:
-            sys.stdout.write("connection to server failed: ")
-            sys.stdout.write(exc.orig.args[0])
-            if not exc.orig.args[0].endswith("\n"):
-                sys.stdout.write("\n")
-        else:
-            sys.stdout.write(pgexc.args[0])
-
-        sys.stdout.flush()
+        write_connect_error(exc)
         sys.exit(2)
 
     def sigint_handler(*_):
@@ -154,39 +211,22 @@ def _run(args):
     if not args.no_xsqlrc:
         config.load(conn)
 
-    if args.tuples_only:
-        config.tuples_only = args.tuples_only
-
-    if args.csv:
-        config.format_ = "csv"
-
-    if args.no_align:
-        config.format_ = "unaligned"
-
-    if args.expanded:
-        config.extended_display = args.expanded
+    apply_args(args)
 
-    if args.field_separator:
-        config.field_separator = args.field_separator
-
-    if args.field_separator_zero:
-        config.field_separator = "\0"
-
-    if args.record_separator_zero:
-        config.record_separator = "\0"
+    # whichever way this exits, -o (or a \o left open) is closed properly
+    atexit.register(close_output)
 
     if args.output:
-        config.output = open(args.output, "wt")
-
-    if args.translate:
-        from_, to = args.translate.split(":")
-        config.translate_from = from_
-        config.translate_to = to
-
-    if args.set:
-        for entry in args.set:
-            name, value = entry.split("=")
-            config.variables[name] = value
+        try:
+            config.output = open_compressed(
+                args.output,
+                "wt",
+                level=config.compression_level,
+            )
+        except CompressionError as cex:
+            sys.stderr.write("xsql: error: {}\n".format(cex))
+            sys.stderr.flush()
+            sys.exit(1)
 
     command = None
 
@@ -217,6 +257,18 @@ def _run(args):
 
         clean_exit(conn)
 
+    run_interactive(conn)
+
+
+def run_interactive(conn):
+    from prompt_toolkit import PromptSession
+    from prompt_toolkit.output.color_depth import ColorDepth
+
+    from .completion import completer, get_complete_style, refresh_completions
+    from .history import history
+    from .lexer import lexer
+    from .prompt import record_duration, render_prompt
+
     if not config.quiet:
         sys.stdout.write("xsql ({}".format(__version__))
 
@@ -242,7 +294,7 @@ def _run(args):
         "vi_mode": True,
         "enable_open_in_editor": True,
         "tempfile_suffix": ".sql",
-        "key_bindings": bindings,
+        "key_bindings": get_key_bindings(),
         "lexer": lexer,
         "completer": completer,
         "complete_style": get_complete_style(),
@@ -268,8 +320,13 @@ def _run(args):
             def prompt_continuation(width, line_number, wrap_count):
                 return render_prompt(conn, config.prompt2, wrap_count)
 
+            # rendered on every redraw, as the continuation is, so command
+            # output read in the background shows up as soon as it's there
+            def prompt_message():
+                return render_prompt(conn, config.prompt1, 0)
+
             text = session.prompt(
-                render_prompt(conn, config.prompt1, 0),
+                prompt_message,
                 multiline=True,
                 prompt_continuation=prompt_continuation,
             )
@@ -320,6 +377,8 @@ def _run(args):
                             write_time(total_time)
 
                         sys.stdout.flush()
+                finally:
+                    record_duration(time.monotonic_ns() - start_time)
 
         except EOFError:
             if not config.quiet:
@@ -374,5 +433,6 @@ def _run(args):
 
 
 def clean_exit(conn=None):
+    close_output()
     try_close(conn)
     sys.exit(0)
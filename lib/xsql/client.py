@@ -0,0 +1,157 @@
+import json
+import os
+import socket
+import struct
+import sys
+
+# the client half of the daemon, which only forwards a run's command and
+# copies back what it writes. it's imported before anything else so runs
+# going through a daemon don't pay for sqlalchemy (or a driver) at all
+
+# frames sent back to the client are a channel byte and a length, followed by
+# that many bytes of payload
+frame_header = struct.Struct("!cI")
+
+stdout_channel = b"o"
+stderr_channel = b"e"
+exit_channel = b"x"
+busy_channel = b"b"
+
+
+def get_socket_path():
+    path = os.environ.get("XSQL_DAEMON_SOCKET")
+    if path:
+        return path
+
+    return os.path.expanduser("~/.xsql/daemon.sock")
+
+
+def use_daemon(args):
+
+    # one-shot runs go through a running daemon when asked to, falling back
+    # to connecting directly when there isn't one
+    return (
+        (args.use_daemon or os.environ.get("XSQL_USE_DAEMON"))
+        and not args.version
+        and (args.command or args.file or not sys.stdin.isatty())
+    )
+
+
+def connect_client():
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+    try:
+        client.connect(get_socket_path())
+    except OSError:
+        client.close()
+        return None
+
+    return client
+
+
+def read_frames(client):
+
+    reader = client.makefile("rb")
+
+    while True:
+        header = reader.read(frame_header.size)
+        if len(header) < frame_header.size:
+            return
+
+        channel, length = frame_header.unpack(header)
+        yield channel, reader.read(length)
+
+
+def run_client(args):
+
+    command = None
+
+    if not sys.stdin.isatty():
+        command = sys.stdin.read()
+
+    if not command:
+        command = args.command
+
+    # stdin is read before connecting, the daemon doesn't wait on a slow
+    # writer, and from here on a direct run takes the command from args
+    args.command = command
+
+    client = connect_client()
+    if client is None:
+        return None
+
+    request = {
+        "args": vars(args),
+        "command": command,
+        "cwd": os.getcwd(),
+    }
+
+    output = None
+    returncode = 1
+
+    with client:
+        client.sendall(json.dumps(request).encode("utf-8") + b"\n")
+
+        frames = read_frames(client)
+
+        while True:
+            try:
+                frame = next(frames, None)
+            except KeyboardInterrupt:
+                # the daemon cancels the query and finishes the request
+                try:
+                    client.sendall(b"c")
+                except OSError:
+                    pass
+                continue
+
+            if frame is None:
+                break
+
+            channel, data = frame
+
+            if channel == busy_channel:
+                return None
+
+            if output is None:
+                if args.output:
+                    from .compression import CompressionError, open_compressed
+
+                    try:
+                        output = open_compressed(args.output, "wb")
+                    except CompressionError as cex:
+                        # hanging up cancels the request in the daemon
+                        sys.stderr.write("xsql: error: {}\n".format(cex))
+                        sys.stderr.flush()
+                        return 1
+                else:
+                    output = sys.stdout.buffer
+
+            if channel == stdout_channel:
+                output.write(data)
+                output.flush()
+            elif channel == stderr_channel:
+                sys.stderr.buffer.write(data)
+                sys.stderr.buffer.flush()
+            elif channel == exit_channel:
+                returncode = data[0]
+
+    if args.output and output is not None:
+        output.close()
+
+    return returncode
+
+
+def stop_daemon():
+
+    client = connect_client()
+    if client is None:
+        sys.stderr.write("xsql: error: no daemon is listening on {}\n".format(get_socket_path()))
+        return 1
+
+    with client:
+        client.sendall(json.dumps({"shutdown": True}).encode("utf-8") + b"\n")
+        for _ in read_frames(client):
+            pass
+
+    return 0
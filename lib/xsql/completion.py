@@ -1,25 +1,332 @@
+import bisect
+import collections
+import gzip
+import hashlib
+import json
 import os
 import re
 import sys
+import threading
+import time
 
 import sqlglot
 import sqlglot.expressions
-from prompt_toolkit.application.current import get_app
 from prompt_toolkit.completion import (
     Completer,
     Completion,
-    DynamicCompleter,
+    ThreadedCompleter,
 )
 from prompt_toolkit.shortcuts import CompleteStyle
-from sqlalchemy import text
-
+from .catalog import get_catalog_source
 from .config import config
+from .split import get_statement_start
 
+# schema name to a SchemaCatalog, filled in from a background thread a
+# schema at a time, so readers iterate over a snapshot of the schemas
 completion_cache = {}
 
+# every refresh gets a generation, a newer refresh (or clearing the cache)
+# makes an older one still running in the background stop and discard what
+# it has left
+refresh_lock = threading.Lock()
+refresh_generation = 0
+
+# where the catalog was last read from, kept so changed objects can be read
+# again later without the session's connection
+catalog_engine = None
+catalog_default_schema_name = None
+catalog_dialect_name = None
+catalog_url = None
+
+# when the catalog was last read in full, or found unchanged since it was,
+# by time.monotonic(), and the server's marker (see CatalogSource.get_marker)
+# as of then. until catalog_ttl seconds after that, while no ddl is waiting
+# to be read again and the marker is still the same, \dt and \d patterns are
+# matched against it rather than sent to the server
+catalog_read_at = None
+catalog_marker = None
+catalog_ttl = 300
+
+# objects changed by ddl since they were read, as (schema name, table name)
+# pairs where a table name of None stands for the whole schema. they're read
+# again the next time something is completed
+dirty = set()
+dirty_refresh_running = False
+
+# schema and table names are read up front, columns a table at a time the
+# first time a statement refers to it. only the most recently used tables'
+# columns are kept
+column_cache_size = 1000
+
+# how long completing waits on columns being read, past that it goes ahead
+# without them and they're there the next time
+column_load_timeout = 0.25
+
+# (schema name, table name) to an event set once its columns have been read
+columns_loading = {}
+
+# a completion request stops once a newer one has started, or once it has
+# taken this long, and shows what it has found by then
+completion_budget = 0.5
+
+# directory to a DirectoryListing, read again once the directory's mtime
+# changes
+directory_cache = {}
+directory_lock = threading.Lock()
+
+# the text before the statement being completed, as of the last completion
+statement_head = ""
+
+# the most recently completed statements' contexts, by their text
+parse_cache = collections.OrderedDict()
+parse_cache_size = 64
+parse_lock = threading.Lock()
+
+# create, drop and alter, capturing the statement, whether it's temporary,
+# the kind of object and its (possibly qualified) names. drop takes several
+identifier_pattern = r'(?:"[^"]+"|\w+)'
+
+qualified_pattern = identifier_pattern + r"(?:\s*\.\s*" + identifier_pattern + r"){0,2}"
+
+ddl_pattern = re.compile(
+    r"^\s*(create|drop|alter)\s+"
+    r"(?:or\s+replace\s+)?"
+    r"((?:(?:local|global|temporary|temp|transient|volatile|secure|materialized|external|unlogged|recursive|dynamic)\s+)*)"
+    r"(\w+)\s+"
+    r"(?:if\s+(?:not\s+)?exists\s+)?"
+    r"(" + qualified_pattern + r"(?:\s*,\s*" + qualified_pattern + r")*)",
+    flags=re.I,
+)
+
+# what may follow the names of a drop, anything else isn't understood
+drop_tail_pattern = re.compile(r"^\s*(?:cascade|restrict)?\s*;?\s*$", flags=re.I)
+
+rename_pattern = re.compile(r"\brename\s+to\s+(" + identifier_pattern + r")", flags=re.I)
+
+set_schema_pattern = re.compile(r"\bset\s+schema\s+(" + identifier_pattern + r")", flags=re.I)
+
+
+class NameIndex:
+
+    # names sorted case insensitively, next to their lowercase keys, so
+    # finding the ones starting with a prefix is a binary search rather than
+    # a walk over all of them
+    __slots__ = ("names", "keys")
+
+    def __init__(self, names):
+        self.names = sorted(set(names), key=str.lower)
+
+        keys = []
+        for name in self.names:
+            key = name.lower()
+            if key == name:
+                # the same string, rather than an equal copy of it
+                key = name
+            keys.append(key)
+
+        self.keys = keys
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def find(self, prefix, ignore_case=False):
+        key = prefix.lower()
+
+        for i in range(bisect.bisect_left(self.keys, key), len(self.keys)):
+            if not self.keys[i].startswith(key):
+                break
+
+            name = self.names[i]
+            if ignore_case or name.startswith(prefix):
+                yield name
+
+
+class SchemaCatalog:
+
+    # never changed once built, a refresh replaces it as a whole, so it's
+    # safe to read while the background thread works. tables whose columns
+    # are read on demand have None in place of them. relations are what \dt
+    # and \d show of a table, its type, owner and oid, where known
+    __slots__ = ("tables", "functions", "relations", "table_index", "column_index", "function_index")
+
+    def __init__(self, tables, functions, relations=None):
+
+        # names repeat a lot (id, created_at, ...) across tables, interning
+        # keeps a single copy of each
+        self.tables = {
+            sys.intern(table_name): intern_names(column_names)
+            for table_name, column_names in tables.items()
+        }
+        self.functions = intern_names(functions)
+        self.relations = {
+            sys.intern(table_name): tuple(relation)
+            for table_name, relation in (relations or {}).items()
+        }
+
+        self.table_index = NameIndex(self.tables.keys())
+        self.column_index = NameIndex(
+            c
+            for column_names in self.tables.values()
+            if column_names is not None
+            for c in column_names
+        )
+        self.function_index = NameIndex(self.functions)
+
+    @classmethod
+    def from_values(cls, values):
+        return cls(values.get("tables", {}), values.get("functions", []), values.get("relations", {}))
+
+    def to_values(self):
+        return {
+            "tables": {
+                table_name: None if column_names is None else list(column_names)
+                for table_name, column_names in self.tables.items()
+            },
+            "functions": list(self.functions),
+            "relations": {
+                table_name: list(relation)
+                for table_name, relation in self.relations.items()
+            },
+        }
+
+
+def intern_names(names):
+    if names is None:
+        return None
+
+    return tuple(sys.intern(name) for name in names)
+
+
+class ColumnCache:
+
+    # the columns of tables read on demand, least recently used first, so
+    # the ones dropped to make room are those not completed in a while
+    def __init__(self, size):
+        self.size = size
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            column_names = self.entries.get(key)
+            if column_names is not None:
+                self.entries.move_to_end(key)
+
+        return column_names
+
+    def set(self, key, column_names):
+        with self.lock:
+            self.entries[key] = intern_names(column_names)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def discard(self, schema_name, table_name=None):
+        with self.lock:
+            for key in list(self.entries.keys()):
+                if key[0] == schema_name and table_name in (None, key[1]):
+                    del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+column_cache = ColumnCache(column_cache_size)
+
+
+def fuzzy_score(key, candidate):
+
+    # the characters of key have to appear in candidate in order, the fewer
+    # characters skipped in between (and the earlier the match starts) the
+    # better
+    position = candidate.find(key[:1])
+    if position < 0:
+        return None
+
+    start = position
+    gaps = 0
+
+    for character in key[1:]:
+        found = candidate.find(character, position + 1)
+        if found < 0:
+            return None
+
+        gaps += found - position - 1
+        position = found
+
+    return (gaps, start, len(candidate))
+
+
+def match_names(indexes, prefix):
+
+    # prefix matches come first, alphabetically, then with completion_match
+    # set to fuzzy anything that contains the typed characters in order, best
+    # matches first. either way no more than completion_limit are returned
+    limit = config.completion_limit
+    ignore_case = config.completion_match in ("ignore_case", "fuzzy")
+
+    seen = set()
+    matched = []
+
+    for index in indexes:
+        count = 0
+        for name in index.find(prefix, ignore_case):
+            if name not in seen:
+                seen.add(name)
+                matched.append(name)
+
+                count += 1
+                if limit and count >= limit:
+                    break
+
+    matched.sort(key=str.lower)
+
+    if limit:
+        matched = matched[:limit]
+
+    if config.completion_match == "fuzzy" and prefix and (not limit or len(matched) < limit):
+        key = prefix.lower()
+        scored = []
+
+        for index in indexes:
+            for name, candidate in zip(index.names, index.keys):
+                if name in seen:
+                    continue
+
+                score = fuzzy_score(key, candidate)
+                if score is not None:
+                    seen.add(name)
+                    scored.append((score, name))
+
+        scored.sort()
+
+        matched.extend(name for _, name in scored)
+
+        if limit:
+            matched = matched[:limit]
+
+    return matched
+
+
+def name_completion(name, prefix):
+    return Completion(
+        text=name,
+        start_position=-len(prefix),
+        display=name,
+    )
+
 
 def clear_completions():
-    completion_cache.clear()
+    global catalog_read_at, refresh_generation
+
+    with refresh_lock:
+        refresh_generation += 1
+        catalog_read_at = None
+        completion_cache.clear()
+        column_cache.clear()
+        dirty.clear()
 
 
 def maybe_refresh_completions(conn):
@@ -27,112 +334,588 @@ def maybe_refresh_completions(conn):
         refresh_completions(conn)
 
 
-def refresh_completions(conn):
-
-    if conn.dialect.name == "postgresql":
-        names_query = """
-        select
-            pg_catalog.pg_namespace.nspname as schema_name,
-            pg_catalog.pg_class.relname as table_name,
-            pg_catalog.pg_attribute.attname as column_name,
-            null as function_name
-        from
-            pg_catalog.pg_namespace
-        join
-            pg_catalog.pg_class
-        on
-            pg_catalog.pg_namespace.oid = pg_catalog.pg_class.relnamespace
-        join
-            pg_catalog.pg_attribute
-        on
-            pg_catalog.pg_class.oid = pg_catalog.pg_attribute.attrelid
-        where
-            pg_catalog.pg_class.relkind in ('r', 'v')
-        union
-        select
-            pg_catalog.pg_namespace.nspname as schema_name,
-            null as table_name,
-            null as column_name,
-            pg_catalog.pg_proc.proname || '(' as function_name
-        from
-            pg_catalog.pg_namespace
-        join
-            pg_catalog.pg_proc
-        on
-            pg_catalog.pg_namespace.oid = pg_catalog.pg_proc.pronamespace
-        """
-
-    elif conn.dialect.name == "sqlite":
-        names_query = """
-        select
-            null as schema_name,
-            sqlite_master.tbl_name as table_name,
-            info.name as column_name,
-            null as function_name
-        from
-            sqlite_master,
-            pragma_table_info(sqlite_master.tbl_name) as info
-        """
-    elif conn.dialect.name == "snowflake":
+def refresh_completions(conn, force=False):
+    from .db import make_engine, replay_sets
+
+    global catalog_default_schema_name, catalog_dialect_name, catalog_engine, catalog_read_at, catalog_url, refresh_generation
+
+    catalog_dialect_name = conn.dialect.name
+    catalog_url = conn.engine.url
+
+    with refresh_lock:
+        refresh_generation += 1
+        generation = refresh_generation
+        catalog_read_at = None
+
+        # everything is read again, changed objects included
+        column_cache.clear()
+        dirty.clear()
+
+        # the previous engine's pooled connections would otherwise stay open
+        # for as long as the session does, one set per refresh. anything
+        # still reading through it finishes on the connection it has
+        previous_engine = catalog_engine
+        catalog_engine = None
+
+    if previous_engine is not None:
+        previous_engine.dispose()
+
+    # sqlite's catalog is local (and an in-memory database can't be opened a
+    # second time), so it's read right away
+    if conn.dialect.name == "sqlite":
+        if load_catalog(conn, generation, None):
+            mark_catalog_read(generation, None)
+        return
+
+    if conn.dialect.name in ("snowflake", "redshift"):
         if config.verbosity:
             sys.stdout.write("refreshing autocomplete cache\n")
             sys.stdout.flush()
 
-        names_query = """
-        select
-            table_schema as schema_name,
-            table_name as table_name,
-            column_name as column_name,
-            null as function_name
-        from
-            information_schema.columns
-        union
-        select
-            procedure_schema as schema_name,
-            null as table_name,
-            null as column_name,
-            procedure_name || '(' as function_name
-        from
-            information_schema.procedures
-        """
+    # pooled, unlike other background work, so reading columns on demand
+    # doesn't wait on logging in every time. each connection gets the
+    # session's .xsqlrc statements, so search_path (say) matches the prompt
+    catalog_engine = make_engine(conn.engine.url)
+    replay_sets(catalog_engine)
+    catalog_default_schema_name = conn.dialect.default_schema_name
+
+    # everywhere else it's read in the background on a connection of its
+    # own, a schema at a time, so the prompt is usable right away and
+    # completions fill in as schemas arrive
+    thread = threading.Thread(
+        target=run_refresh,
+        args=(catalog_engine, generation, catalog_default_schema_name, force),
+        daemon=True,
+    )
+    thread.start()
+
+
+def normalize_name(dialect_name, name):
+
+    if name.startswith('"'):
+        return name[1:-1]
+
+    # unquoted names are folded the way the server folds them
+    if dialect_name in ("postgresql", "redshift"):
+        return name.lower()
+    elif dialect_name == "snowflake":
+        return name.upper()
+
+    return name
+
+
+def get_ddl_targets(dialect_name, default_schema_name, query):
+
+    # argument lists (of functions dropped, say) aren't names, a level of
+    # nesting is plenty for types like numeric(10, 2)
+    query = re.sub(r"\((?:[^()]|\([^()]*\))*\)", "", query)
+
+    match = ddl_pattern.search(query)
+    if not match:
+        return None
+
+    statement = match.group(1).lower()
+    modifiers = match.group(2).lower().split()
+    kind = match.group(3).lower()
+
+    # indexes, sequences, types and the like don't change what's completed
+    if kind not in ("table", "view", "schema", "function", "procedure"):
+        return []
+
+    # postgres puts temporary objects in a schema of the session's own, which
+    # isn't known here
+    if dialect_name in ("postgresql", "redshift") and ("temp" in modifiers or "temporary" in modifiers):
+        return None
+
+    names = [
+        [normalize_name(dialect_name, name.strip()) for name in re.findall(identifier_pattern, qualified)]
+        for qualified in re.split(r"\s*,\s*", match.group(4))
+    ]
+
+    rest = query[match.end():]
+
+    # only drop takes a list, and a partial one is no better than none
+    if statement == "drop":
+        if not drop_tail_pattern.match(rest):
+            return None
+    elif len(names) > 1:
+        return None
+
+    targets = []
+
+    for parts in names:
+
+        if kind == "schema":
+            targets.append((parts[-1], None))
+            continue
+
+        schema_name = default_schema_name
+        if len(parts) > 1:
+            schema_name = parts[-2]
+
+        # functions and procedures are kept per schema
+        if kind in ("function", "procedure"):
+            targets.append((schema_name, None))
+            continue
+
+        targets.append((schema_name, parts[-1]))
+
+        if statement != "alter":
+            continue
+
+        if rename := rename_pattern.search(rest):
+            targets.append((schema_name, normalize_name(dialect_name, rename.group(1))))
+
+        if moved := set_schema_pattern.search(rest):
+            targets.append((normalize_name(dialect_name, moved.group(1)), parts[-1]))
+
+    if kind == "schema" and statement == "alter":
+        if rename := rename_pattern.search(rest):
+            targets.append((normalize_name(dialect_name, rename.group(1)), None))
+
+    return targets
+
+
+def invalidate_completions(conn, query):
+
+    default_schema_name = conn.dialect.default_schema_name
+    if conn.dialect.name == "sqlite":
+        default_schema_name = None
+
+    targets = None
+    if isinstance(query, str):
+        targets = get_ddl_targets(conn.dialect.name, default_schema_name, query)
+
+    # something that changes the catalog but isn't recognized (or whose
+    # targets can't all be told), so it's all read again
+    if targets is None:
+        refresh_completions(conn)
+        return
+
+    with refresh_lock:
+        dirty.update(targets)
+
+    # sqlite has nothing to wait on, its catalog is read again right away
+    if conn.dialect.name == "sqlite":
+        refresh_dirty(conn)
+
+
+def maybe_refresh_dirty():
+    global dirty_refresh_running
+
+    with refresh_lock:
+        if not dirty or dirty_refresh_running or catalog_engine is None:
+            return
+
+        dirty_refresh_running = True
+        generation = refresh_generation
+
+    thread = threading.Thread(
+        target=run_dirty_refresh,
+        args=(catalog_engine, generation),
+        daemon=True,
+    )
+    thread.start()
+
+
+def run_dirty_refresh(engine, generation):
+    global dirty_refresh_running
+
+    try:
+        with engine.connect() as conn:
+
+            # read before what changed is, so anything changed meanwhile
+            # (elsewhere, say) still shows up as a different marker
+            marker = get_catalog_source(conn).get_marker(conn)
+
+            refresh_dirty(conn, generation)
+
+            with refresh_lock:
+                current = catalog_read_at is not None and not dirty
+
+            if current:
+                mark_catalog_read(generation, marker)
+    except Exception as ex:
+        if config.verbosity:
+            sys.stderr.write("WARNING:  unable to refresh autocomplete cache: {}\n".format(ex))
+            sys.stderr.flush()
+    finally:
+        with refresh_lock:
+            dirty_refresh_running = False
+
+
+def refresh_dirty(conn, generation=None):
+
+    while True:
+        with refresh_lock:
+            if not dirty:
+                return
+
+            if generation is None:
+                generation = refresh_generation
+
+            schema_name, table_name = dirty.pop()
+
+        if table_name is None:
+            schema = load_schema(conn, schema_name)
+        else:
+            schema = load_table(conn, schema_name, table_name)
+
+        with refresh_lock:
+            # a full refresh has started since, it reads this as well
+            if generation != refresh_generation:
+                return
+
+            if schema is None:
+                completion_cache.pop(schema_name, None)
+            else:
+                completion_cache[schema_name] = schema
+
+            column_cache.discard(schema_name, table_name)
+
+
+def load_table(conn, schema_name, table_name):
+
+    # the table's columns are read along with it, it's likely to be used next
+    column_names = get_catalog_source(conn).get_columns(conn, schema_name, [table_name]).get(table_name)
+
+    # the rest of the schema stays as it is, a table that's gone is dropped
+    # from it
+    schema = completion_cache.get(schema_name)
+
+    tables = {}
+    functions = ()
+    relations = {}
+    if schema is not None:
+        tables = dict(schema.tables)
+        functions = schema.functions
+        relations = dict(schema.relations)
+
+    if column_names:
+        tables[table_name] = column_names
     else:
-        if conn.dialect.name == "redshift":
-            if config.verbosity:
-                sys.stdout.write("refreshing autocomplete cache\n")
-                sys.stdout.flush()
-
-        names_query = """
-        select
-            table_schema as schema_name,
-            table_name as table_name,
-            column_name as column_name,
-            null as function_name
-        from
-            information_schema.columns
-        union
-        select
-            routine_schema as schema_name,
-            null as table_name,
-            null as column_name,
-            routine_name || '(' as function_name
-        from
-            information_schema.routines
-        """
-
-    new_values = {}
-    name_results = conn.execute(text(names_query))
-    for name_result in name_results:
-        new_values.setdefault(name_result.schema_name, {})
-        if name_result.function_name:
-            new_values[name_result.schema_name].setdefault("functions", [])
-            new_values[name_result.schema_name]["functions"].append(name_result.function_name)
+        tables.pop(table_name, None)
+
+    # what's known of it may have changed, \dt and \d ask the server about
+    # it until the schema is read again
+    relations.pop(table_name, None)
+
+    if not tables and not functions:
+        return None
+
+    return SchemaCatalog(tables, functions, relations)
+
+
+def get_columns(schema_name, schema, table_name):
+
+    column_names = schema.tables[table_name]
+    if column_names is None:
+        column_names = column_cache.get((schema_name, table_name))
+
+    return column_names or ()
+
+
+def load_columns(schemas, available_tables):
+
+    if not available_tables:
+        return
+
+    # the tables the statement refers to whose columns haven't been read
+    wanted = [
+        (schema_name, table_name)
+        for schema_name, schema in schemas
+        for table_name in get_available_table_names(schema_name, schema, available_tables)
+        if schema.tables[table_name] is None
+    ]
+
+    if not wanted:
+        return
+
+    events = []
+    missing = []
+
+    with refresh_lock:
+        if catalog_engine is None:
+            return
+
+        engine = catalog_engine
+        generation = refresh_generation
+
+        for key in wanted:
+            if key in columns_loading:
+                events.append(columns_loading[key])
+            elif column_cache.get(key) is None:
+                columns_loading[key] = threading.Event()
+                events.append(columns_loading[key])
+                missing.append(key)
+
+    # everything missing is read together, on a thread of its own so a slow
+    # server only holds completing up for column_load_timeout
+    if missing:
+        thread = threading.Thread(
+            target=run_load_columns,
+            args=(engine, generation, missing),
+            daemon=True,
+        )
+        thread.start()
+
+    deadline = time.monotonic() + column_load_timeout
+    for event in events:
+        if not event.wait(max(deadline - time.monotonic(), 0)):
+            break
+
+
+def run_load_columns(engine, generation, keys):
+
+    table_names = {}
+    for schema_name, table_name in keys:
+        table_names.setdefault(schema_name, [])
+        table_names[schema_name].append(table_name)
+
+    try:
+        with engine.connect() as conn:
+            source = get_catalog_source(conn)
+
+            for schema_name, schema_table_names in table_names.items():
+
+                columns = source.get_columns(conn, schema_name, schema_table_names)
+
+                with refresh_lock:
+                    # read before a refresh, which starts over
+                    if generation != refresh_generation:
+                        return
+
+                    # tables that are gone are kept without columns, rather
+                    # than being looked for again on every completion
+                    for table_name in schema_table_names:
+                        column_cache.set((schema_name, table_name), columns.get(table_name, ()))
+    except Exception as ex:
+        if config.verbosity:
+            sys.stderr.write("WARNING:  unable to read columns for autocomplete: {}\n".format(ex))
+            sys.stderr.flush()
+    finally:
+        with refresh_lock:
+            for key in keys:
+                columns_loading.pop(key).set()
+
+
+def mark_catalog_read(generation, marker):
+    global catalog_marker, catalog_read_at
+
+    with refresh_lock:
+        if generation == refresh_generation:
+            catalog_read_at = time.monotonic()
+            catalog_marker = marker
+
+
+def run_refresh(engine, generation, default_schema_name, force=False):
+
+    path = get_snapshot_path(engine.url)
+
+    # the last snapshot of this database is shown first, while it's checked
+    snapshot = read_snapshot(path)
+    if snapshot is not None:
+        with refresh_lock:
+            if generation != refresh_generation:
+                return
+
+            if not completion_cache:
+                completion_cache.update(snapshot["schemas"])
+
+    try:
+        with engine.connect() as conn:
+
+            marker = get_catalog_source(conn).get_marker(conn)
+
+            if not force and snapshot is not None and marker is not None and marker == snapshot["marker"]:
+                mark_catalog_read(generation, marker)
+                return
+
+            if load_catalog(conn, generation, default_schema_name):
+                mark_catalog_read(generation, marker)
+
+                with refresh_lock:
+                    schemas = list(completion_cache.items())
+
+                schemas = [[schema_name, schema.to_values()] for schema_name, schema in schemas]
+
+                write_snapshot(path, marker, schemas)
+    except Exception as ex:
+        if config.verbosity:
+            sys.stderr.write("WARNING:  unable to refresh autocomplete cache: {}\n".format(ex))
+            sys.stderr.flush()
+    finally:
+        engine.dispose()
+
+
+def get_snapshot_path(url):
+    from .cache import get_cache_directory
+    from .db import get_url_key
+
+    # one file per server and database, named without anything secret in it
+    digest = hashlib.sha1(get_url_key(url).encode("utf-8")).hexdigest()[:16]
+
+    return os.path.join(get_cache_directory(), "catalog-{}.json.gz".format(digest))
+
+
+def read_snapshot(path):
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as fp:
+            snapshot = json.load(fp)
+    except (OSError, ValueError, EOFError):
+        return None
+
+    snapshot["schemas"] = {
+        schema_name: SchemaCatalog.from_values(values)
+        for schema_name, values in snapshot["schemas"]
+    }
+
+    return snapshot
+
+
+def write_snapshot(path, marker, schemas):
+
+    directory = os.path.dirname(path)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    # written next to the snapshot and renamed over it, so a session starting
+    # at the same time never reads half of one
+    temporary = "{}.{}".format(path, os.getpid())
+
+    with gzip.open(temporary, "wt", encoding="utf-8", compresslevel=1) as fp:
+        json.dump({"marker": marker, "schemas": schemas}, fp, separators=(",", ":"))
+
+    os.replace(temporary, path)
+
+
+def get_schema_names(conn, default_schema_name):
+
+    schema_names = get_catalog_source(conn).get_schema_names(conn)
+
+    # the schema most things are in comes first
+    schema_names.sort(key=lambda schema_name: schema_name != default_schema_name)
+
+    return schema_names
+
+
+def load_schema(conn, schema_name):
+
+    tables, functions, relations = get_catalog_source(conn).get_names(conn, schema_name)
+
+    if not tables and not functions:
+        return None
+
+    return SchemaCatalog(tables, functions, relations)
+
+
+def load_catalog(conn, generation, default_schema_name):
+
+    loaded = set()
+
+    for schema_name in get_schema_names(conn, default_schema_name):
+
+        schema = load_schema(conn, schema_name)
+
+        with refresh_lock:
+            if generation != refresh_generation:
+                return False
+
+            if schema is not None:
+                completion_cache[schema_name] = schema
+                loaded.add(schema_name)
+
+    # whatever is left over is from schemas that have since been dropped
+    with refresh_lock:
+        if generation != refresh_generation:
+            return False
+
+        for schema_name in list(completion_cache.keys()):
+            if schema_name not in loaded:
+                del completion_cache[schema_name]
+
+    return True
+
+
+def find_relations(conn, target):
+
+    # None unless the catalog is known to be current, and everything the
+    # pattern matches is known, then the server is asked instead
+    with refresh_lock:
+        if catalog_read_at is None or catalog_url != conn.engine.url or dirty:
+            return None
+
+        if time.monotonic() - catalog_read_at > catalog_ttl:
+            return None
+
+        marker = catalog_marker
+        schemas = sorted(completion_cache.items(), key=lambda item: item[0] or "")
+
+    # ddl from other sessions (or anything not recognized as ddl here) only
+    # shows in the marker, so without one to compare there's no telling
+    if marker is None or get_catalog_source(conn).get_marker(conn) != marker:
+        return None
+
+    pattern = None
+    prefix = ""
+    if target:
+        pattern = like_to_pattern(target)
+
+        # only names starting with what comes before the first wildcard are
+        # looked at
+        prefix = re.split(r"[%_\\]", target, maxsplit=1)[0].lower()
+
+    relations = []
+
+    for schema_name, schema in schemas:
+
+        qualifier = "{}.".format(schema_name or "").lower()
+
+        # the pattern is matched against the name and against the name
+        # qualified with the schema's
+        if qualifier.startswith(prefix):
+            table_names = schema.table_index
+        elif prefix.startswith(qualifier):
+            table_names = set(schema.table_index.find(prefix[len(qualifier):], ignore_case=True))
+            table_names.update(schema.table_index.find(prefix, ignore_case=True))
+            table_names = sorted(table_names, key=str.lower)
+        else:
+            table_names = schema.table_index.find(prefix, ignore_case=True)
+
+        for table_name in table_names:
+            if pattern is not None:
+                if not pattern.fullmatch(table_name) and not pattern.fullmatch(qualifier + table_name):
+                    continue
+
+            relation = schema.relations.get(table_name)
+            if relation is None:
+                return None
+
+            relations.append((schema_name, table_name) + relation)
+
+    return relations
+
+
+def like_to_pattern(target):
+
+    # % and _ as like has them, with a backslash taking the next character
+    # as it is, ignoring case as ilike does
+    parts = []
+
+    escaped = False
+    for c in target:
+        if escaped:
+            parts.append(re.escape(c))
+            escaped = False
+        elif c == "\\":
+            escaped = True
+        elif c == "%":
+            parts.append(".*")
+        elif c == "_":
+            parts.append(".")
         else:
-            new_values[name_result.schema_name].setdefault("tables", {})
-            new_values[name_result.schema_name]["tables"].setdefault(name_result.table_name, [])
-            new_values[name_result.schema_name]["tables"][name_result.table_name].append(name_result.column_name)
+            parts.append(re.escape(c))
 
-    completion_cache.clear()
-    completion_cache.update(new_values)
+    return re.compile("".join(parts), flags=re.I | re.S)
 
 
 sql_keywords = [
@@ -980,6 +1763,8 @@ sql_keywords = [
     "zone",
 ]
 
+sql_keyword_set = frozenset(sql_keywords)
+
 
 def generator():
 
@@ -993,23 +1778,23 @@ def generator():
             yielded.add(sql_keyword)
             yield sql_keyword
 
-    for schema_name in completion_cache.keys():
+    for schema_name, schema in list(completion_cache.items()):
         if schema_name is not None:
             if schema_name not in yielded:
                 yielded.add(schema_name)
                 yield schema_name
 
-        for function_name in completion_cache[schema_name].get("functions") or []:
+        for function_name in schema.functions:
             if function_name not in yielded:
                 yielded.add(function_name)
                 yield function_name
 
-        for table_name in completion_cache[schema_name].get("tables", {}).keys():
+        for table_name in schema.tables:
             if table_name not in yielded:
                 yielded.add(table_name)
                 yield table_name
 
-            for column_name in completion_cache[schema_name]["tables"][table_name]:
+            for column_name in get_columns(schema_name, schema, table_name):
                 if column_name not in yielded:
                     yielded.add(column_name)
                     yield column_name
@@ -1025,6 +1810,62 @@ def is_exec_completion(text):
     return match
 
 
+class DirectoryListing:
+
+    __slots__ = ("mtime", "entries", "executables")
+
+    def __init__(self, mtime, entries):
+        self.mtime = mtime
+
+        # (filename, is a directory) pairs
+        self.entries = entries
+
+        # filename to whether it's executable, filled in as they're asked about
+        self.executables = {}
+
+    def is_executable(self, filename, path):
+        executable = self.executables.get(filename)
+        if executable is None:
+            executable = self.executables[filename] = os.access(path, os.X_OK)
+
+        return executable
+
+
+def list_directory(directory):
+
+    # a stat per directory per keystroke rather than reading it again, which
+    # for every directory on $PATH adds up
+    try:
+        mtime = os.stat(directory).st_mtime_ns
+    except OSError:
+        return None
+
+    with directory_lock:
+        listing = directory_cache.get(directory)
+
+    if listing is not None and listing.mtime == mtime:
+        return listing
+
+    entries = []
+
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    entries.append((entry.name, entry.is_dir()))
+                except OSError:
+                    entries.append((entry.name, False))
+    except OSError:
+        return None
+
+    listing = DirectoryListing(mtime, entries)
+
+    with directory_lock:
+        directory_cache[directory] = listing
+
+    return listing
+
+
 class PathCompleter(Completer):
 
     get_paths = None
@@ -1040,52 +1881,51 @@ class PathCompleter(Completer):
         return self.get_completions_for_text(text)
 
     def get_completions_for_text(self, text):
-        try:
 
-            dirname = os.path.dirname(text)
-            if dirname:
-                directories = [dirname]
-            elif self.get_paths:
-                directories = self.get_paths()
-            else:
+        dirname = os.path.dirname(text)
+        if dirname:
+            directories = [dirname]
+        elif self.get_paths:
+            directories = self.get_paths()
+        else:
+            try:
                 directories = [os.getcwd()]
+            except OSError:
+                return
 
-            prefix = os.path.basename(text)
+        prefix = os.path.basename(text)
 
-            filenames = []
+        filenames = []
 
-            for directory in directories:
+        for directory in directories:
 
-                try:
-                    to_search = os.listdir(os.path.expanduser(directory))
-                except OSError:
-                    continue
+            listing = list_directory(os.path.expanduser(directory))
+            if listing is None:
+                continue
 
-                for filename in to_search:
-                    if filename.startswith(prefix):
-                        filenames.append((directory, filename))
+            for filename, is_dir in listing.entries:
+                if filename.startswith(prefix):
+                    filenames.append((directory, filename, is_dir, listing))
 
-            filenames.sort(key=lambda e: e[1])
+        filenames.sort(key=lambda e: e[1])
 
-            for directory, filename in filenames:
+        for directory, filename, is_dir, listing in filenames:
 
-                completion = filename[len(prefix):]
-                file_path = os.path.join(directory, filename)
+            completion = filename[len(prefix):]
+            file_path = os.path.join(directory, filename)
 
-                if os.path.isdir(os.path.expanduser(file_path)):
-                    file_path += "/"
+            if is_dir:
+                file_path += "/"
 
-                if self.file_filter:
-                    if not self.file_filter(file_path):
-                        continue
+            if self.file_filter:
+                if not self.file_filter(listing, filename, file_path):
+                    continue
 
-                yield Completion(
-                    text=completion,
-                    start_position=0,
-                    display=filename,
-                )
-        except OSError:
-            pass
+            yield Completion(
+                text=completion,
+                start_position=0,
+                display=filename,
+            )
 
 
 class ExecutableCompleter(PathCompleter):
@@ -1093,8 +1933,8 @@ class ExecutableCompleter(PathCompleter):
     def get_paths(self):
         return os.environ.get("PATH", "").split(os.pathsep)
 
-    def file_filter(self, path):
-        return os.access(os.path.expanduser(path), os.X_OK)
+    def file_filter(self, listing, filename, path):
+        return listing.is_executable(filename, os.path.expanduser(path))
 
     def get_completions(self, document, complete_event):
 
@@ -1106,16 +1946,14 @@ class ExecutableCompleter(PathCompleter):
         return self.get_completions_for_text(text)
 
 
-def get_completer():
-
-    app = get_app()
+def get_completer(text):
 
-    if is_file_completion(app.current_buffer.text.strip()):
-        return PathCompleter()
-    elif is_exec_completion(app.current_buffer.text.strip()):
-        return ExecutableCompleter()
+    if is_file_completion(text.strip()):
+        return path_completer
+    elif is_exec_completion(text.strip()):
+        return executable_completer
     else:
-        return SQLCompleter()
+        return sql_completer
 
 
 context_free_keywords = [
@@ -1181,11 +2019,174 @@ def basic_completion(text):
     )
 
 
+class StatementContext:
+
+    # what completing needs from the parsed statement: the kind of thing
+    # being typed (table, where, identifier or None), the name typed so far,
+    # and the tables in scope
+    __slots__ = ("text", "kind", "prefix", "is_column", "available_tables")
+
+    def __init__(self, text, kind, prefix=None, is_column=False, available_tables=None):
+        self.text = text
+        self.kind = kind
+        self.prefix = prefix
+        self.is_column = is_column
+        self.available_tables = available_tables
+
+
+def get_current_statement(text):
+    global statement_head
+
+    # the statements before the one being typed don't change while it is,
+    # so splitting picks up from the end of them
+    start = 0
+    if statement_head and text.startswith(statement_head):
+        start = len(statement_head)
+
+    start += get_statement_start(text[start:], catalog_dialect_name)
+
+    statement_head = text[:start]
+
+    return text[start:]
+
+
+def get_statement_context(text):
+
+    with parse_lock:
+        context = parse_cache.get(text)
+        if context is not None:
+            parse_cache.move_to_end(text)
+            return context
+
+        previous = None
+        if parse_cache:
+            previous = parse_cache[next(reversed(parse_cache))]
+
+    context = extend_statement_context(previous, text)
+    if context is None:
+        context = parse_statement_context(text)
+
+    with parse_lock:
+        parse_cache[text] = context
+
+        while len(parse_cache) > parse_cache_size:
+            parse_cache.popitem(last=False)
+
+    return context
+
+
+def extend_statement_context(previous, text):
+
+    # typing more of a name leaves everything but the name as it was, so the
+    # last statement's tables are reused rather than parsing it again. a
+    # keyword could change what the statement means, those are parsed
+    if previous is None or previous.kind != "identifier" or not previous.prefix:
+        return None
+
+    if not text.startswith(previous.text) or not previous.text.endswith(previous.prefix):
+        return None
+
+    extra = text[len(previous.text):]
+    if not re.search(r"^\w+$", extra):
+        return None
+
+    prefix = previous.prefix + extra
+    if prefix.lower() in sql_keyword_set:
+        return None
+
+    return StatementContext(
+        text,
+        "identifier",
+        prefix=prefix,
+        is_column=previous.is_column,
+        available_tables=previous.available_tables,
+    )
+
+
+def parse_statement_context(text):
+
+    statements = sqlglot.parse(text, error_level=sqlglot.ErrorLevel.IGNORE)
+
+    if not statements or statements[-1] is None:
+        return StatementContext(text, None)
+
+    statement = statements[-1]
+
+    expressions = list(statement.walk(bfs=False))
+    last_expression = expressions[-1]
+
+    select = None
+
+    parent = last_expression
+
+    while parent:
+        if select is None and isinstance(parent, sqlglot.expressions.Select):
+            select = parent
+
+        parent = parent.parent
+
+    available_tables = None
+    if select is not None:
+        available_tables = {}
+        for table in select.find_all(sqlglot.expressions.Table):
+
+            # the table still being typed, after a from with nothing yet
+            if table.this is None:
+                continue
+
+            schema = None
+            if table.db:
+                if isinstance(table.db, str):
+                    schema = table.db
+                else:
+                    schema = table.db.this
+
+            available_tables.setdefault(schema, {})
+
+            available_tables[schema][table.this.this] = True
+
+    if isinstance(last_expression, sqlglot.expressions.Table):
+        return StatementContext(text, "table", available_tables=available_tables)
+
+    elif isinstance(last_expression, sqlglot.expressions.Where):
+        return StatementContext(text, "where", available_tables=available_tables)
+
+    elif isinstance(last_expression, sqlglot.expressions.Identifier):
+
+        is_column = False
+
+        checked_expressions = [last_expression]
+        try:
+            checked_expressions.append(expressions[-2])
+        except IndexError:
+            pass
+
+        for checked_expression in checked_expressions:
+            if isinstance(checked_expression, sqlglot.expressions.Column):
+                is_column = True
+            elif isinstance(checked_expression.parent, sqlglot.expressions.Column):
+                is_column = True
+
+        return StatementContext(
+            text,
+            "identifier",
+            prefix=last_expression.this,
+            is_column=is_column,
+            available_tables=available_tables,
+        )
+
+    return StatementContext(text, None, available_tables=available_tables)
+
+
 class SQLCompleter(Completer):
 
     def get_completions(self, document, complete_event):
 
-        text = document.text_before_cursor.strip()
+        maybe_refresh_dirty()
+
+        # only the statement being typed is looked at, however much came
+        # before it
+        text = get_current_statement(document.text_before_cursor).strip()
 
         if not text:
             for keyword in context_free_keywords:
@@ -1223,62 +2224,26 @@ class SQLCompleter(Completer):
 
             yield basic_completion(keyword)
         else:
-            statements = sqlglot.parse(
-                document.text_before_cursor.strip(),
-                error_level=sqlglot.ErrorLevel.IGNORE,
-            )
-
-            if not statements:
-                return []
-
-            statement = statements[-1]
+            context = get_statement_context(text)
 
-            expressions = list(statement.walk(bfs=False))
-            last_expression = expressions[-1]
+            available_tables = context.available_tables
 
             yielded = set()
 
-            select = None
-
-            parent = last_expression
-
-            while parent:
-                if select is None and isinstance(parent, sqlglot.expressions.Select):
-                    select = parent
-
-                parent = parent.parent
-
-            available_tables = None
-            if select is not None:
-                available_tables = {}
-                for table in select.find_all(sqlglot.expressions.Table):
-                    schema = None
-                    if table.db:
-                        if isinstance(table.db, str):
-                            schema = table.db
-                        else:
-                            schema = table.db.this
+            schemas = list(completion_cache.items())
 
-                    available_tables.setdefault(schema, {})
+            if context.kind == "table":
+                indexes = [NameIndex(n for n, _ in schemas if n is not None)]
+                indexes.extend(schema.table_index for _, schema in schemas)
 
-                    available_tables[schema][table.this.this] = True
+                for name in match_names(indexes, ""):
+                    yield basic_completion(name)
 
-            if isinstance(last_expression, sqlglot.expressions.Table):
-                for schema_name in completion_cache.keys():
-                    if schema_name is not None:
-                        if schema_name not in yielded:
-                            yielded.add(schema_name)
-                            yield basic_completion(schema_name)
+            elif context.kind == "where":
 
-                    for table_name in completion_cache[schema_name].get("tables", {}).keys():
-                        if table_name not in yielded:
-                            yielded.add(table_name)
-                            yield basic_completion(table_name)
-
-            elif isinstance(last_expression, sqlglot.expressions.Where):
-
-                for schema_name in completion_cache.keys():
+                load_columns(schemas, available_tables)
 
+                for schema_name, schema in schemas:
                     if schema_name not in available_tables and None not in available_tables:
                         continue
 
@@ -1286,114 +2251,108 @@ class SQLCompleter(Completer):
                         yielded.add(schema_name)
                         yield basic_completion(schema_name)
 
-                    for table_name in completion_cache[schema_name].get("tables", {}).keys():
-
-                        is_matching_table = False
-                        if available_tables.get(schema_name) and table_name in available_tables[schema_name]:
-                            is_matching_table = True
-                        elif available_tables.get(None) and table_name in available_tables[None]:
-                            is_matching_table = True
-
-                        if not is_matching_table:
-                            continue
+                    for table_name, column_names in get_available_tables(schema_name, schema, available_tables):
 
                         yielded.add(table_name)
                         yield basic_completion(table_name)
 
-                        for column_name in completion_cache[schema_name]["tables"][table_name]:
+                        for column_name in column_names:
                             if column_name not in yielded:
                                 yielded.add(column_name)
                                 yield basic_completion(column_name)
 
                 return []
 
-            elif isinstance(last_expression, sqlglot.expressions.Identifier):
+            elif context.kind == "identifier":
 
-                is_column = False
+                prefix = context.prefix
 
-                checked_expressions = [last_expression]
-                try:
-                    checked_expressions.append(expressions[-2])
-                except IndexError:
-                    pass
-
-                for checked_expression in checked_expressions:
-                    if isinstance(checked_expression, sqlglot.expressions.Column):
-                        is_column = True
-                    elif isinstance(checked_expression.parent, sqlglot.expressions.Column):
-                        is_column = True
+                load_columns(schemas, available_tables)
 
-                if is_column:
-                    for schema_name in completion_cache.keys():
+                if context.is_column:
+                    column_names = []
 
+                    for schema_name, schema in schemas:
                         if schema_name not in available_tables and None not in available_tables:
                             continue
 
-                        for table_name in completion_cache[schema_name].get("tables", {}).keys():
+                        for _, table_column_names in get_available_tables(schema_name, schema, available_tables):
+                            column_names.extend(table_column_names)
 
-                            is_matching_table = False
-                            if available_tables.get(schema_name) and table_name in available_tables[schema_name]:
-                                is_matching_table = True
-                            elif available_tables.get(None) and table_name in available_tables[None]:
-                                is_matching_table = True
+                    for name in match_names([NameIndex(column_names)], prefix):
+                        yield name_completion(name, prefix)
 
-                            if not is_matching_table:
-                                continue
+                    return []
 
-                            for column_name in completion_cache[schema_name]["tables"][table_name]:
+                indexes = [NameIndex(n for n, _ in schemas if n is not None)]
+                indexes.extend(schema.table_index for _, schema in schemas)
+                indexes.extend(schema.column_index for _, schema in schemas)
 
-                                if not column_name.startswith(last_expression.this):
-                                    continue
+                # columns read on demand are only offered for the tables the
+                # statement refers to
+                if available_tables:
+                    column_names = []
 
-                                if column_name not in yielded:
-                                    yielded.add(column_name)
-                                    yield Completion(
-                                        text=column_name[len(last_expression.this):],
-                                        start_position=0,
-                                        display=column_name,
-                                    )
+                    for schema_name, schema in schemas:
+                        for _, table_column_names in get_available_tables(schema_name, schema, available_tables):
+                            column_names.extend(table_column_names)
 
-                    return []
+                    indexes.append(NameIndex(column_names))
 
-                for schema_name in completion_cache.keys():
-                    if schema_name is not None:
-
-                        if schema_name not in yielded:
-                            if schema_name.startswith(last_expression.this):
-                                yielded.add(schema_name)
-                                yield Completion(
-                                    text=schema_name[len(last_expression.this):],
-                                    start_position=0,
-                                    display=schema_name,
-                                )
-
-                    for table_name in completion_cache[schema_name].get("tables", {}).keys():
-
-                        if table_name not in yielded:
-                            if table_name.startswith(last_expression.this):
-                                yielded.add(table_name)
-                                yield Completion(
-                                    text=table_name[len(last_expression.this):],
-                                    start_position=0,
-                                    display=table_name,
-                                )
-
-                            for column_name in completion_cache[schema_name]["tables"][table_name]:
-                                if not column_name.startswith(last_expression.this):
-                                    continue
-
-                                if column_name not in yielded:
-                                    yielded.add(column_name)
-                                    yield Completion(
-                                        text=column_name[len(last_expression.this):],
-                                        start_position=0,
-                                        display=column_name,
-                                    )
+                for name in match_names(indexes, prefix):
+                    yield name_completion(name, prefix)
 
             return []
 
 
-completer = DynamicCompleter(get_completer)
+def get_available_table_names(schema_name, schema, available_tables):
+
+    # the tables in schema that the statement refers to, either qualified
+    # with the schema or without one
+    table_names = {}
+    table_names.update(available_tables.get(schema_name) or {})
+    table_names.update(available_tables.get(None) or {})
+
+    return [table_name for table_name in table_names if table_name in schema.tables]
+
+
+def get_available_tables(schema_name, schema, available_tables):
+    for table_name in get_available_table_names(schema_name, schema, available_tables):
+        yield table_name, get_columns(schema_name, schema, table_name)
+
+
+class SessionCompleter(Completer):
+
+    # picks the completer for what's being typed. requests run on a thread
+    # of their own (see ThreadedCompleter below), so one that's slow doesn't
+    # hold up typing, and one that's been superseded by a newer request
+    # stops at its next completion rather than running to the end
+    def __init__(self):
+        self.request = 0
+        self.lock = threading.Lock()
+
+    def get_completions(self, document, complete_event):
+
+        with self.lock:
+            self.request += 1
+            request = self.request
+
+        deadline = time.monotonic() + completion_budget
+
+        completions = get_completer(document.text).get_completions(document, complete_event)
+
+        for completion in completions:
+            if request != self.request or time.monotonic() > deadline:
+                return
+
+            yield completion
+
+
+sql_completer = SQLCompleter()
+path_completer = PathCompleter()
+executable_completer = ExecutableCompleter()
+
+completer = ThreadedCompleter(SessionCompleter())
 
 
 def get_complete_style():
@@ -0,0 +1,353 @@
+import io
+import mmap
+import os
+import queue
+import threading
+
+extensions = {
+    ".gz": "gzip",
+    ".gzip": "gzip",
+    ".bz2": "bzip2",
+    ".xz": "xz",
+    ".zst": "zstd",
+    ".zstd": "zstd",
+}
+
+suffixes = {
+    "gzip": ".gz",
+    "bzip2": ".bz2",
+    "xz": ".xz",
+    "zstd": ".zst",
+}
+
+default_levels = {
+    "gzip": 6,
+    "bzip2": 9,
+    "xz": 6,
+    "zstd": 3,
+}
+
+level_ranges = {
+    "gzip": (0, 9),
+    "bzip2": (1, 9),
+    "xz": (0, 9),
+    "zstd": (1, 22),
+}
+
+aliases = {
+    "gz": "gzip",
+    "bz2": "bzip2",
+    "lzma": "xz",
+    "zst": "zstd",
+}
+
+# chunks handed to the background thread are coalesced up to this size so a
+# queue handoff is not paid for every small write from csv/TextIOWrapper
+chunk_size = 1024 * 1024
+
+# number of chunks allowed in flight between the caller and the background
+# thread, once full the caller blocks until the compressor catches up
+queue_size = 8
+
+
+class CompressionError(Exception):
+    pass
+
+
+def detect_compression(filename):
+    _, extension = os.path.splitext(filename)
+    return extensions.get(extension.lower())
+
+
+def resolve_compression(filename, compression=None):
+
+    if compression is None:
+        return detect_compression(filename)
+
+    compression = compression.lower()
+    compression = aliases.get(compression, compression)
+
+    if compression in ("none", "off"):
+        return None
+
+    if compression not in default_levels:
+        raise CompressionError(
+            'unrecognized compression "{}", expected one of gzip, bzip2, xz, zstd, or none'
+            .format(compression)
+        )
+
+    return compression
+
+
+def parse_level(value, compression=None):
+
+    try:
+        level = int(value)
+    except (TypeError, ValueError):
+        raise CompressionError('invalid compression level "{}", expected an integer'.format(value))
+
+    check_level(level, compression)
+
+    return level
+
+
+def check_level(level, compression=None):
+
+    if level is None:
+        return
+
+    # a level set before there's a compression to go with it (\set
+    # compression_level, say) only has to suit one of them, it's checked
+    # again once the file being opened says which
+    if compression is None:
+        low = min(low for low, _ in level_ranges.values())
+        high = max(high for _, high in level_ranges.values())
+        name = "compression"
+    else:
+        low, high = level_ranges[compression]
+        name = compression
+
+    if not low <= level <= high:
+        raise CompressionError(
+            "{} level {} is out of range, expected {} to {}"
+            .format(name, level, low, high)
+        )
+
+
+def open_binary(filename, mode, compression, level=None):
+
+    if level is None:
+        level = default_levels[compression]
+
+    if compression == "gzip":
+        import gzip
+
+        if mode == "wb":
+            return gzip.open(filename, mode, compresslevel=level)
+        return gzip.open(filename, mode)
+
+    elif compression == "bzip2":
+        import bz2
+
+        if mode == "wb":
+            return bz2.open(filename, mode, compresslevel=level)
+        return bz2.open(filename, mode)
+
+    elif compression == "xz":
+        import lzma
+
+        if mode == "wb":
+            return lzma.open(filename, mode, preset=level)
+        return lzma.open(filename, mode)
+
+    elif compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise CompressionError("zstd compression requires the zstandard package")
+
+        if mode == "wb":
+            return zstandard.open(filename, mode, cctx=zstandard.ZstdCompressor(level=level))
+        return zstandard.open(filename, mode)
+
+
+def open_mapped(filename):
+
+    fp = open(filename, "rb", buffering=chunk_size)
+
+    try:
+        mapped = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):
+        # empty files and things like fifos can't be mapped, read those
+        # through a large buffer instead
+        return fp
+
+    fp.close()
+
+    return mapped
+
+
+def open_compressed(filename, mode, compression=None, level=None):
+
+    compression = resolve_compression(filename, compression)
+
+    if compression is None:
+        if mode == "rb":
+            return open_mapped(filename)
+        elif "b" in mode:
+            return open(filename, mode, buffering=chunk_size)
+        return open(filename, mode)
+
+    # (de)compression runs on a background thread so it overlaps with
+    # fetching from, or sending to, the server
+    if mode.startswith("w"):
+        check_level(level, compression)
+        fp = BackgroundWriter(open_binary(filename, "wb", compression, level))
+    else:
+        fp = BackgroundReader(open_binary(filename, "rb", compression, level))
+
+    if "b" in mode:
+        return fp
+
+    return io.TextIOWrapper(fp, encoding="utf-8")
+
+
+class BackgroundWriter(io.BufferedIOBase):
+
+    def __init__(self, fp):
+        self.fp = fp
+        self._buffer = bytearray()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is None:
+                break
+
+            if self._error is not None:
+                continue
+
+            try:
+                self.fp.write(chunk)
+            except Exception as ex:
+                self._error = ex
+
+    def _check_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._check_error()
+
+        self._buffer += data
+
+        if len(self._buffer) >= chunk_size:
+            self._queue.put(bytes(self._buffer))
+            self._buffer.clear()
+
+        return len(data)
+
+    def flush(self):
+        self._check_error()
+
+    def close(self):
+        if self.closed:
+            return
+
+        try:
+            if self._buffer:
+                self._queue.put(bytes(self._buffer))
+                self._buffer.clear()
+
+            self._queue.put(None)
+            self._thread.join()
+
+            self._check_error()
+        finally:
+            self.fp.close()
+            super().close()
+
+
+class BackgroundReader(io.BufferedIOBase):
+
+    def __init__(self, fp):
+        self.fp = fp
+        self._buffer = b""
+        self._position = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._eof = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                chunk = self.fp.read(chunk_size)
+                if not chunk:
+                    break
+
+                self._put(chunk)
+        except Exception as ex:
+            self._error = ex
+        finally:
+            self._put(None)
+
+    def _put(self, chunk):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _fill(self):
+        if self._eof:
+            return False
+
+        chunk = self._queue.get()
+        if chunk is None:
+            self._eof = True
+            if self._error is not None:
+                raise self._error
+            return False
+
+        self._buffer = chunk
+        self._position = 0
+        return True
+
+    def _take(self, size):
+        if self._position >= len(self._buffer):
+            if not self._fill():
+                return b""
+
+        data = self._buffer[self._position:self._position + size]
+        self._position += len(data)
+        return data
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = float("inf")
+
+        parts = []
+
+        while size > 0:
+            data = self._take(min(size, chunk_size))
+            if not data:
+                break
+
+            parts.append(data)
+            size -= len(data)
+
+        return b"".join(parts)
+
+    def read1(self, size=-1):
+        if size is None or size < 0:
+            size = chunk_size
+
+        return self._take(size)
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self.fp.close()
+        super().close()
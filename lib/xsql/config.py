@@ -5,6 +5,7 @@ import time
 
 from sqlalchemy import text
 
+from .compression import CompressionError, open_compressed, parse_level
 from .time import write_time
 
 
@@ -35,6 +36,11 @@ class Configuration:
         variables=None,
         translate_from=None,
         translate_to=None,
+        compression_level=None,
+        progress="auto",
+        format_processes=0,
+        completion_match="prefix",
+        completion_limit=500,
     ):
 
         if output is None:
@@ -77,6 +83,11 @@ class Configuration:
 
         self.translate_from = translate_from
         self.translate_to = translate_to
+        self.compression_level = compression_level
+        self.progress = progress
+        self.format_processes = format_processes
+        self.completion_match = completion_match
+        self.completion_limit = completion_limit
 
     def load(self, conn, filename=None):
 
@@ -101,17 +112,26 @@ class Configuration:
                         dialects.setdefault(section, [])
                         dialects[section].append((filename, line_number, line))
 
+            # statements are collected and sent together once everything else
+            # is set, so session setup is a single round trip where the
+            # driver allows it
+            statements = []
+
             dialects_to_process = ["default", conn.dialect.name]
             for dialect_to_process in dialects_to_process:
                 if dialect_to_process in dialects:
                     for filename, line_number, line in dialects[dialect_to_process]:
                         if line.strip():
-                            process_config_line(conn, filename, line_number, line)
+                            statement = process_config_line(conn, filename, line_number, line)
+                            if statement is not None:
+                                statements.append(statement)
+
+            run_statements(conn, statements)
 
     def run_sets(self, conn):
         for set_ in self.sets:
             conn.execute(text(set_))
-            conn.execute(text("commit;"))
+        conn.commit()
 
 
 def trim_quotes(value):
@@ -170,6 +190,20 @@ def set_set(variable, value):
         config.history_size = int(value)
     elif variable.lower() == "verbosity":
         config.verbosity = value
+    elif variable.lower() == "compression_level":
+        try:
+            config.compression_level = parse_level(value)
+        except CompressionError as cex:
+            sys.stderr.write("xsql: error: {}\n".format(cex))
+            sys.stderr.flush()
+    elif variable.lower() == "progress":
+        config.progress = value.lower()
+    elif variable.lower() == "format_processes":
+        config.format_processes = int(value)
+    elif variable.lower() == "completion_match":
+        config.completion_match = value.lower()
+    elif variable.lower() == "completion_limit":
+        config.completion_limit = int(value)
     else:
         config.variables[variable] = value
 
@@ -198,12 +232,20 @@ def set_null_display(value):
         sys.stdout.flush()
 
 
+def close_output():
+
+    # a compressed file is only complete once its background writer has
+    # been joined and the trailer written, which interpreter shutdown
+    # doesn't do in any reliable order
+    if config.output is not sys.stdout and config.output is not sys.stderr:
+        config.output.close()
+
+    config.output = sys.stdout
+
+
 def set_output(value):
     if not value:
-        if config.output is not sys.stdout and config.output is not sys.stderr:
-            config.output.close()
-
-        config.output = sys.stdout
+        close_output()
     else:
         if isinstance(value, str):
             value = os.path.expanduser(value)
@@ -211,11 +253,15 @@ def set_output(value):
         new_output = None
         if isinstance(value, str):
             try:
-                new_output = open(value, "wt")
+                new_output = open_compressed(value, "wt", level=config.compression_level)
             except OSError:
                 sys.stdout.write("{}: No such file or directory\n".format(value))
                 sys.stdout.flush()
                 return
+            except CompressionError as cex:
+                sys.stdout.write("{}: {}\n".format(value, cex))
+                sys.stdout.flush()
+                return
 
         if config.output is not sys.stdout and config.output is not sys.stderr:
             config.output.close()
@@ -390,23 +436,60 @@ def process_config_line(conn, filename, line_number, line):
         variable, value = process_command_with_variable("\\set", line)
         set_set(variable, value)
     else:
-        config.sets.append(line)
-        start_time = time.monotonic_ns()
-        conn.execute(text(line))
+        return line
+
 
-        if not config.quiet:
-            if re.search("^set", line, flags=re.I):
+def run_statements(conn, statements):
+
+    if not statements:
+        return
+
+    config.sets.extend(statements)
+
+    start_time = time.monotonic_ns()
+
+    if conn.dialect.name in ("postgresql", "redshift"):
+        # the simple query protocol takes several statements at once
+        conn.execute(text("\n".join([ensure_terminated(s) for s in statements])))
+    elif conn.dialect.name == "snowflake" and len(statements) > 1:
+        # snowflake only runs several statements in one request when told
+        # how many there are
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            cursor.execute(
+                "\n".join([ensure_terminated(s) for s in statements]),
+                num_statements=len(statements),
+            )
+        finally:
+            cursor.close()
+    else:
+        for statement in statements:
+            conn.execute(text(statement))
+
+    if not config.quiet:
+        for statement in statements:
+            if re.search("^set", statement, flags=re.I):
                 sys.stdout.write("SET\n")
-            elif re.search("^select", line, flags=re.I):
+            elif re.search("^select", statement, flags=re.I):
                 sys.stdout.write("SELECT\n")
-            elif re.search("^alter session", line, flags=re.I):
+            elif re.search("^alter session", statement, flags=re.I):
                 sys.stdout.write("ALTER SESSION\n")
 
-        total_time = time.monotonic_ns() - start_time
-        if config.timing:
-            write_time(total_time)
+    total_time = time.monotonic_ns() - start_time
+    if config.timing:
+        write_time(total_time)
 
-        sys.stdout.flush()
+    sys.stdout.flush()
+
+
+def ensure_terminated(statement):
+
+    # a trailing -- comment would swallow the separator, so it goes on a
+    # line of its own
+    if re.search(r";\s*$", statement):
+        return statement
+
+    return statement + "\n;"
 
 
 config = Configuration()
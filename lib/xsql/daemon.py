@@ -0,0 +1,452 @@
+import argparse
+import io
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+import sqlalchemy
+
+from .client import (
+    busy_channel,
+    connect_client,
+    exit_channel,
+    frame_header,
+    get_socket_path,
+    stderr_channel,
+    stdout_channel,
+)
+from .config import close_output, config
+from .db import connect, Reconnect, resolve_url
+from .exc import PGError, QuitException
+
+# how often the daemon wakes up while idle to close unused connections
+poll_interval = 5
+
+# how long a client has to send its request once connected
+request_timeout = 10
+
+default_idle_timeout = 600
+
+
+class ChannelWriter(io.RawIOBase):
+
+    def __init__(self, client, channel):
+        self.client = client
+        self.channel = channel
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self.client.sendall(frame_header.pack(self.channel, len(data)) + data)
+        return len(data)
+
+
+def open_channel(client, channel):
+    return io.TextIOWrapper(
+        io.BufferedWriter(ChannelWriter(client, channel), buffer_size=64 * 1024),
+        encoding="utf-8",
+    )
+
+
+def save_config():
+    state = dict(vars(config))
+    state["sets"] = list(config.sets)
+    state["variables"] = dict(config.variables)
+    return state
+
+
+def restore_config(state):
+    vars(config).update(state)
+    config.sets = list(state["sets"])
+    config.variables = dict(state["variables"])
+
+
+def cancel(conn):
+    try:
+        dbapi_connection = conn.connection.dbapi_connection
+        if hasattr(dbapi_connection, "cancel"):
+            dbapi_connection.cancel()
+    except Exception:
+        pass
+
+
+def is_idle(conn):
+
+    # a connection left inside a transaction (an unfinished begin, say) can't
+    # be handed to the next client
+    try:
+        dbapi_connection = conn.connection.dbapi_connection
+    except Exception:
+        return False
+
+    if hasattr(dbapi_connection, "get_transaction_status"):
+        return dbapi_connection.get_transaction_status() == 0
+
+    return True
+
+
+def is_alive(conn):
+    try:
+        conn.execute(sqlalchemy.text("select 1")).fetchall()
+
+        # it was idle when pooled, the check mustn't leave a transaction open
+        conn.rollback()
+    except Exception:
+        return False
+
+    return True
+
+
+class Pooled:
+
+    def __init__(self, conn, state):
+        self.conn = conn
+        self.state = state
+        self.last_used = time.monotonic()
+
+
+class Pool:
+
+    def __init__(self):
+        self.idle = {}
+
+    def acquire(self, target, load_xsqlrc, baseline):
+
+        key = (target, load_xsqlrc)
+
+        while self.idle.get(key):
+            pooled = self.idle[key].pop()
+
+            # the server (or something in between) may have closed it while
+            # it sat here, which only shows once it's used
+            if is_alive(pooled.conn):
+                return pooled
+
+            close(pooled.conn)
+
+        _, url = resolve_url(target)
+        if url is None:
+            raise LookupError(target)
+
+        conn = connect(url)
+
+        if load_xsqlrc:
+            config.load(conn)
+
+        # the settings from .xsqlrc belong to the connection, restored for
+        # every request that uses it
+        state = save_config()
+        state["quiet"] = baseline["quiet"]
+
+        return Pooled(conn, state)
+
+    def release(self, target, load_xsqlrc, pooled):
+        pooled.last_used = time.monotonic()
+        self.idle.setdefault((target, load_xsqlrc), []).append(pooled)
+
+    def close_idle(self, timeout):
+        now = time.monotonic()
+
+        for key, pooled_list in self.idle.items():
+            keep = []
+            for pooled in pooled_list:
+                if now - pooled.last_used > timeout:
+                    close(pooled.conn)
+                else:
+                    keep.append(pooled)
+
+            self.idle[key] = keep
+
+    def close_all(self):
+        for pooled_list in self.idle.values():
+            for pooled in pooled_list:
+                close(pooled.conn)
+
+        self.idle = {}
+
+
+def close(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def write_error(exc):
+    if hasattr(exc, "orig") and exc.orig is not None:
+        message = str(exc.orig.args[0])
+    else:
+        message = str(exc)
+
+    sys.stderr.write(message)
+    if not message.endswith("\n"):
+        sys.stderr.write("\n")
+
+
+def run_request(pool, request, baseline, current):
+    from .cli import apply_args, write_connect_error
+    from .run import run_command, run_file
+
+    args = argparse.Namespace(**request["args"])
+    load_xsqlrc = not args.no_xsqlrc
+
+    if args.quiet:
+        config.quiet = args.quiet
+
+    try:
+        pooled = pool.acquire(args.url, load_xsqlrc, baseline)
+    except LookupError:
+        sys.stdout.write(
+            'xsql: error: connection to server failed: FATAL:  alias "{}" does not exist\n'
+            .format(args.url)
+        )
+        return 2, None
+    except (sqlalchemy.exc.SQLAlchemyError, PGError) as exc:
+        write_connect_error(exc)
+        return 2, None
+
+    restore_config(pooled.state)
+
+    # output, the pager and quiet are per request, everything else comes
+    # from the connection's .xsqlrc
+    config.output = sys.stdout
+    config.pager = None
+    if args.quiet:
+        config.quiet = args.quiet
+
+    apply_args(args)
+
+    conn = pooled.conn
+    current["conn"] = conn
+
+    returncode = 0
+    try:
+        if args.single_transaction:
+            conn.execute(sqlalchemy.text("begin;"))
+
+        if request.get("command"):
+            run_command(conn, request["command"])
+        elif args.file:
+            run_file(conn, args.file)
+
+        if args.single_transaction:
+            conn.execute(sqlalchemy.text("commit;"))
+    except QuitException:
+        pass
+    except Reconnect:
+        sys.stderr.write("\\connect is not supported through the daemon\n")
+        returncode = 1
+    except (sqlalchemy.exc.SQLAlchemyError, PGError) as exc:
+        write_error(exc)
+        returncode = 1
+    except SystemExit as sex:
+        returncode = sex.code or 0
+        if not isinstance(returncode, int):
+            returncode = 1
+    except Exception:
+        traceback.print_exc()
+        returncode = 1
+
+    # a \o left open by the request
+    try:
+        close_output()
+    except Exception:
+        traceback.print_exc()
+        returncode = 1
+
+    if returncode != 0 or not is_idle(conn):
+        close(conn)
+        return returncode, None
+
+    return returncode, pooled
+
+
+def read_request(client):
+
+    client.settimeout(request_timeout)
+
+    try:
+        line = client.makefile("rb").readline()
+    except OSError:
+        return None
+    finally:
+        client.settimeout(None)
+
+    # a client that gave up waiting may already be gone
+    if not line:
+        return None
+
+    return json.loads(line)
+
+
+def handle_client(client, request, pool):
+
+    stdout = open_channel(client, stdout_channel)
+    stderr = open_channel(client, stderr_channel)
+
+    baseline = save_config()
+    saved_streams = (sys.stdout, sys.stderr)
+    saved_cwd = os.getcwd()
+
+    done = threading.Event()
+    current = {}
+
+    # anything from the client (or it going away) while a request runs means
+    # it was interrupted, so the running query is cancelled
+    def watch_client():
+        try:
+            client.recv(1)
+        except OSError:
+            pass
+
+        if not done.is_set() and "conn" in current:
+            cancel(current["conn"])
+
+    watcher = threading.Thread(target=watch_client, daemon=True)
+    watcher.start()
+
+    pooled = None
+    args = request["args"]
+
+    try:
+        sys.stdout, sys.stderr = stdout, stderr
+        os.chdir(request.get("cwd") or saved_cwd)
+
+        returncode, pooled = run_request(pool, request, baseline, current)
+
+        stdout.flush()
+        stderr.flush()
+
+        client.sendall(frame_header.pack(exit_channel, 1) + bytes([returncode & 0xff]))
+    except OSError:
+        # the client went away
+        if pooled is not None:
+            close(pooled.conn)
+            pooled = None
+    finally:
+        done.set()
+        sys.stdout, sys.stderr = saved_streams
+        os.chdir(saved_cwd)
+        restore_config(baseline)
+
+        try:
+            client.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        watcher.join()
+
+    if pooled is not None:
+        pool.release(args["url"], not args["no_xsqlrc"], pooled)
+
+
+def serve(idle_timeout=default_idle_timeout):
+
+    path = get_socket_path()
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    if os.path.exists(path):
+        if connect_client() is not None:
+            sys.stderr.write("xsql: error: a daemon is already listening on {}\n".format(path))
+            return 1
+
+        os.unlink(path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0o600)
+    server.listen()
+    server.settimeout(poll_interval)
+
+    running = [True]
+
+    def stop(*_):
+        running[0] = False
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    pool = Pool()
+    last_request = [time.monotonic()]
+    handler = None
+
+    def run_handler(client, request):
+        with client:
+            try:
+                handle_client(client, request, pool)
+            except Exception:
+                traceback.print_exc()
+
+        last_request[0] = time.monotonic()
+
+    def is_busy():
+        return handler is not None and handler.is_alive()
+
+    try:
+        while running[0]:
+            try:
+                client, _ = server.accept()
+            except socket.timeout:
+                if is_busy():
+                    continue
+
+                pool.close_idle(idle_timeout)
+
+                if time.monotonic() - last_request[0] > idle_timeout:
+                    break
+
+                continue
+            except InterruptedError:
+                continue
+
+            try:
+                request = read_request(client)
+            except ValueError:
+                request = None
+
+            if request is None:
+                client.close()
+                continue
+
+            if request.get("shutdown"):
+                with client:
+                    client.sendall(frame_header.pack(exit_channel, 1) + b"\0")
+                running[0] = False
+                continue
+
+            # a request runs on a thread of its own so others can be turned
+            # away meanwhile. only one at a time, as output and settings are
+            # process wide, so the client connects directly instead of
+            # waiting behind a long query
+            if is_busy():
+                with client:
+                    try:
+                        client.sendall(frame_header.pack(busy_channel, 0))
+                    except OSError:
+                        pass
+                continue
+
+            handler = threading.Thread(target=run_handler, args=(client, request), daemon=True)
+            handler.start()
+    finally:
+        if handler is not None:
+            handler.join()
+
+        pool.close_all()
+        server.close()
+
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    return 0
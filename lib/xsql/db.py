@@ -1,24 +1,45 @@
+import contextlib
+import re
 import sys
+import time
 
 from sqlalchemy import create_engine, event, text
 from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import NullPool
 
 from .alias import load_aliases
 from .aws import rds_auth, redshift_auth, resolve_arn
+from .cache import Entry, open_store
 from .config import config
 from .notice import Notice
 
 
+# versions that take a query to look up are kept per url, in memory and in
+# ~/.xsql/cache/versions, so the prompt doesn't wait on them at startup
+server_version_ttl = 24 * 60 * 60
+server_versions = {}
+
+# statements a server side cursor can be declared for, anything else (an
+# insert ... returning, say) is still read in one go
+streamable_pattern = re.compile(r"^\s*\(*\s*(select|with|values|table)\b", flags=re.I)
+
+
 class Reconnect(Exception):
 
     def __init__(self, target):
         self.target = target
 
 
-def make_engine(url):
+def make_engine(url, poolclass=None, connect_args=None):
 
     create_engine_args = {}
 
+    if poolclass is not None:
+        create_engine_args["poolclass"] = poolclass
+
+    if connect_args:
+        create_engine_args["connect_args"] = connect_args
+
     engine = create_engine(
         url,
         **create_engine_args,
@@ -28,7 +49,16 @@ def make_engine(url):
 
 
 def connect(url):
-    engine = make_engine(url)
+
+    connect_args = {}
+
+    # snowflake takes autocommit as a session parameter when logging in,
+    # rather than an ALTER SESSION round trip afterwards
+    is_snowflake = make_url(url).get_backend_name() == "snowflake"
+    if is_snowflake and config.isolation_level == "AUTOCOMMIT":
+        connect_args["session_parameters"] = {"AUTOCOMMIT": True}
+
+    engine = make_engine(url, connect_args=connect_args)
 
     @event.listens_for(engine, "connect")
     def connect(dbapi_connection, _):
@@ -36,15 +66,72 @@ def connect(url):
 
     conn = engine.connect()
 
-    if conn.dialect.name == "snowflake":
-        if config.isolation_level == "AUTOCOMMIT":
-            conn.execute(text("ALTER SESSION SET AUTOCOMMIT = TRUE"))
-    else:
+    if conn.dialect.name != "snowflake":
         conn = conn.execution_options(isolation_level=config.isolation_level)
 
     return conn
 
 
+def replay_sets(engine):
+
+    # other connections to the session's server start from the same settings
+    # (search_path and the like from .xsqlrc), once per connection
+    @event.listens_for(engine, "engine_connect")
+    def engine_connect(conn):
+        if conn.connection.info.get("sets"):
+            return
+
+        config.run_sets(conn)
+        conn.connection.info["sets"] = True
+
+
+def make_worker_engine(conn):
+
+    # connections for background work (parallel copies and the like) are not
+    # pooled, each one is opened for a single unit of work and then closed
+    engine = make_engine(conn.engine.url, poolclass=NullPool)
+    replay_sets(engine)
+
+    return engine
+
+
+@contextlib.contextmanager
+def stream_results(conn, query):
+
+    # rows are read from a server side cursor as they're needed, rather than
+    # all into memory up front. psycopg2 only opens those in a transaction,
+    # so an autocommit session gets one of its own for the query
+    execution_options = {}
+    begin = False
+
+    if streamable_pattern.match(query):
+        dbapi_connection = conn.connection.dbapi_connection
+
+        if conn.dialect.driver == "psycopg2" and dbapi_connection.autocommit:
+            # a transaction begun by hand can't be borrowed, so stays buffered
+            begin = dbapi_connection.get_transaction_status() == 0
+            if begin:
+                execution_options["stream_results"] = True
+        else:
+            execution_options["stream_results"] = True
+
+    if begin:
+        dbapi_connection.autocommit = False
+
+    try:
+        yield execution_options
+
+        if begin:
+            dbapi_connection.commit()
+    except BaseException:
+        if begin:
+            dbapi_connection.rollback()
+        raise
+    finally:
+        if begin:
+            dbapi_connection.autocommit = True
+
+
 def get_ssl_info(conn):
     if hasattr(conn.connection, "dbapi_connection"):
         if hasattr(conn.connection.dbapi_connection, "info"):
@@ -91,28 +178,58 @@ def get_server_name(conn):
     return conn.dialect.name
 
 
+def get_url_key(url):
+
+    # identifies a server and database without anything secret in it, unlike
+    # the url itself (iam credentials end up in the query string)
+    return "{}://{}@{}:{}/{}".format(
+        url.get_backend_name(),
+        url.username or "",
+        url.host or "",
+        url.port or "",
+        url.database or "",
+    )
+
+
+def as_version_str(version):
+    items = []
+    for v in version:
+        items.append(str(v))
+    return ".".join(items)
+
+
 def get_server_version(conn):
 
-    def as_str(version):
-        items = []
-        for v in version:
-            items.append(str(v))
-        return ".".join(items)
+    if conn.dialect.server_version_info:
+        return as_version_str(conn.dialect.server_version_info)
 
     if conn.dialect.name in ("postgresql", "redshift"):
-        if not conn.dialect.server_version_info:
-            version_info = conn.dialect._get_server_version_info()
+        return as_version_str(conn.dialect._get_server_version_info(conn))
+
+    if conn.dialect.name != "snowflake":
+        return None
+
+    key = get_url_key(conn.engine.url)
+
+    if key not in server_versions:
+
+        store = open_store("versions", encrypted=False)
+
+        entry = None
+        if store is not None:
+            entry = store.get(key)
+
+        if entry is not None and entry.expires_at > time.time():
+            server_versions[key] = entry.value
         else:
-            version_info = conn.dialect.server_version_info
+            res = conn.execute(text("select current_version()")).fetchone()
+            server_versions[key] = res[0]
 
-        return as_str(version_info)
+            if store is not None:
+                expires_at = time.time() + server_version_ttl
+                store.set(key, Entry(res[0], expires_at, expires_at))
 
-    elif conn.dialect.name == "snowflake":
-        res = conn.execute(text("select current_version()")).fetchone()
-        return res[0]
-    else:
-        if conn.dialect.server_version_info:
-            return as_str(conn.dialect.server_version_info)
+    return server_versions[key]
 
 
 def resolve_url(target):
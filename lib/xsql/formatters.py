@@ -1,3 +1,5 @@
+import csv
+import io
 import json
 import re
 from datetime import datetime
@@ -50,7 +52,7 @@ def as_str(v):
         return list_to_array(v)
     if isinstance(v, list):
         return list_to_array(v)
-    if isinstance(v, bytes):
+    if isinstance(v, (bytes, memoryview)):
         return v.hex()
     if isinstance(v, dict):
         return json.dumps(v)
@@ -114,12 +116,16 @@ class CopyWriter:
                         value = json.dumps(value)
                     else:
                         value = list_to_array(value)
+                elif isinstance(value, (bytes, memoryview)):
+                    # bytea's hex format, so it's loaded as binary rather
+                    # than as the text of its digits
+                    value = "\\x" + value.hex()
                 else:
                     value = as_str(value)
 
                 value = copy_data_escape(value)
 
-                values.append(value)
+            values.append(value)
 
         data = self.delimiter.join(values) + self.newline
         return data
@@ -127,3 +133,28 @@ class CopyWriter:
     def writerow(self, row):
         data = self.format(row)
         self.fp.write(data)
+
+
+def format_csv_rows(rows, delimiter=","):
+    buffer = io.StringIO()
+
+    writer = csv.writer(buffer, delimiter=delimiter)
+    for raw in rows:
+        writer.writerow([as_str(v) for v in raw])
+
+    return buffer.getvalue()
+
+
+def format_unaligned_rows(rows, field_separator, record_separator):
+    parts = []
+
+    for raw in rows:
+        parts.append(field_separator.join([as_str(v) for v in raw]))
+        parts.append(record_separator)
+
+    return "".join(parts)
+
+
+def format_copy_rows(rows, null="\\N", delimiter="\t"):
+    writer = CopyWriter(None, null=null, delimiter=delimiter)
+    return "".join([writer.format(raw) for raw in rows])
@@ -1,15 +1,249 @@
-import itertools
+import datetime
+import hashlib
 import os
+import sqlite3
+import sys
+import threading
+import time
 
-from prompt_toolkit.history import FileHistory as BaseFileHistory
+from prompt_toolkit.history import History
 
 from .config import config
 
+# sessions appending at the same time wait on each other for at most this long
+busy_timeout = 5
 
-class FileHistory(BaseFileHistory):
+
+class SQLiteHistory(History):
+
+    def __init__(self, filename, legacy_filename=None):
+        super().__init__()
+        self.filename = filename
+        self.legacy_filename = legacy_filename
+        self.db = None
+        self.indexed = False
+        self.lock = threading.Lock()
+
+    def get_db(self):
+
+        # opened on first use, so starting without history (or without
+        # touching it, for -c and -f) costs nothing
+        if self.db is None:
+
+            directory = os.path.dirname(self.filename)
+            if directory:
+                os.makedirs(directory, mode=0o700, exist_ok=True)
+
+            db = sqlite3.connect(
+                self.filename,
+                timeout=busy_timeout,
+                check_same_thread=False,
+                isolation_level=None,
+            )
+
+            # wal lets several sessions read and append concurrently
+            db.execute("pragma journal_mode = wal")
+
+            db.execute(
+                "create table if not exists history ("
+                "  id integer primary key,"
+                "  digest blob not null unique,"
+                "  text text not null,"
+                "  last_used real not null"
+                ")"
+            )
+            db.execute("create index if not exists history_last_used on history (last_used)")
+            db.execute("create table if not exists imported (filename text primary key)")
+
+            self.db = db
+            self.import_legacy()
+            self.create_search_index()
+
+        return self.db
+
+    def import_legacy(self):
+
+        if self.legacy_filename is None or not os.path.exists(self.legacy_filename):
+            return
+
+        # one transaction, both so the import is quick and so a concurrent
+        # session starting at the same time doesn't import it again
+        self.db.execute("begin immediate")
+
+        try:
+            imported = self.db.execute(
+                "insert into imported values (?) on conflict do nothing",
+                (self.legacy_filename,),
+            )
+
+            if imported.rowcount:
+                if not config.quiet:
+                    sys.stderr.write("Importing history from {}.\n".format(self.legacy_filename))
+                    sys.stderr.flush()
+
+                self.db.executemany(
+                    "insert into history (digest, text, last_used) values (?, ?, ?)"
+                    " on conflict (digest) do update set last_used = max(last_used, excluded.last_used)",
+                    (
+                        (get_digest(text), text, last_used)
+                        for text, last_used in read_legacy(self.legacy_filename)
+                    ),
+                )
+        except BaseException:
+            self.db.execute("rollback")
+            raise
+
+        self.db.execute("commit")
+
+    def create_search_index(self):
+
+        # a trigram index makes substring searches quick where sqlite has
+        # fts5, they scan the whole history otherwise. it's built in one go
+        # from what's there already and kept up to date by triggers after that
+        self.db.execute("begin immediate")
+
+        try:
+            exists = self.db.execute(
+                "select 1 from sqlite_master where name = 'history_search'"
+            ).fetchone()
+
+            if not exists:
+                self.db.execute(
+                    "create virtual table history_search using fts5 ("
+                    "  text, content='history', content_rowid='id', tokenize='trigram'"
+                    ")"
+                )
+                self.db.execute(
+                    "create trigger history_search_insert after insert on history begin"
+                    "  insert into history_search (rowid, text) values (new.id, new.text);"
+                    " end"
+                )
+                self.db.execute(
+                    "create trigger history_search_delete after delete on history begin"
+                    "  insert into history_search (history_search, rowid, text) values ('delete', old.id, old.text);"
+                    " end"
+                )
+                self.db.execute("insert into history_search (history_search) values ('rebuild')")
+        except sqlite3.OperationalError:
+            self.db.execute("rollback")
+            return
+
+        self.db.execute("commit")
+        self.indexed = True
 
     def load_history_strings(self):
-        return itertools.islice(super().load_history_strings(), config.history_size)
+
+        with self.lock:
+            rows = self.get_db().execute(
+                "select text from history order by last_used desc limit ?",
+                (config.history_size,),
+            ).fetchall()
+
+        for text, in rows:
+            yield text
+
+    def store_string(self, string):
+
+        # running something again moves it to the top instead of adding it
+        # twice
+        with self.lock:
+            self.get_db().execute(
+                "insert into history (digest, text, last_used) values (?, ?, ?)"
+                " on conflict (digest) do update set last_used = excluded.last_used",
+                (get_digest(string), string, time.time()),
+            )
+
+    def get_all_strings(self):
+
+        with self.lock:
+            rows = self.get_db().execute(
+                "select text from history order by last_used desc"
+            ).fetchall()
+
+        return [text for text, in rows]
+
+    def search(self, substring, limit=None):
+
+        # sqlite takes a negative limit as none at all
+        if limit is None:
+            limit = -1
+
+        with self.lock:
+            db = self.get_db()
+
+            # trigrams need at least three characters, and matching them is
+            # case insensitive, so the text is checked as well
+            if self.indexed and len(substring) >= 3:
+                rows = db.execute(
+                    "select history.text from history"
+                    " join history_search on history_search.rowid = history.id"
+                    " where history_search match ? and instr(history.text, ?) > 0"
+                    " order by history.last_used desc limit ?",
+                    ('"{}"'.format(substring.replace('"', '""')), substring, limit),
+                ).fetchall()
+            else:
+                rows = db.execute(
+                    "select text from history where instr(text, ?) > 0"
+                    " order by last_used desc limit ?",
+                    (substring, limit),
+                ).fetchall()
+
+        return [text for text, in rows]
+
+    def last_string(self, skip_prefix=None):
+
+        with self.lock:
+            cursor = self.get_db().execute("select text from history order by last_used desc")
+
+            try:
+                for text, in cursor:
+                    if skip_prefix and text.strip().startswith(skip_prefix):
+                        continue
+
+                    return text
+            finally:
+                cursor.close()
+
+        return None
+
+
+def get_digest(text):
+
+    # entries are deduplicated on a digest rather than the text itself, which
+    # keeps the unique index small for long generated statements
+    return hashlib.sha1(text.encode("utf-8")).digest()
+
+
+def read_legacy(filename):
+
+    # the format prompt_toolkit's FileHistory writes, a "# timestamp" line
+    # followed by the entry's lines, each prefixed with +
+    last_used = 0
+    lines = []
+
+    with open(filename, "rb") as fp:
+        for line_bytes in fp:
+            line = line_bytes.decode("utf-8", errors="replace")
+
+            if line.startswith("+"):
+                lines.append(line[1:])
+                continue
+
+            if lines:
+                yield "".join(lines)[:-1], last_used
+                lines = []
+
+            if line.startswith("# "):
+                try:
+                    last_used = datetime.datetime.fromisoformat(line[2:].strip()).timestamp()
+                except ValueError:
+                    pass
+
+    if lines:
+        yield "".join(lines)[:-1], last_used
 
 
-history = FileHistory(os.path.expanduser("~/.xsql_history"))
+history = SQLiteHistory(
+    os.path.expanduser("~/.xsql/history.db"),
+    legacy_filename=os.path.expanduser("~/.xsql_history"),
+)
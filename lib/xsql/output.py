@@ -1,4 +1,3 @@
-import csv
 import itertools
 import re
 import shlex
@@ -9,7 +8,9 @@ import time
 from decimal import Decimal
 
 from .config import config
-from .formatters import as_str
+from .formatters import as_str, format_copy_rows, format_csv_rows, format_unaligned_rows
+from .pipeline import Pipeline
+from .progress import Progress
 from .time import write_time
 
 
@@ -53,55 +54,58 @@ def write(records, title=None, show_rowcount=False, extra_content=None, total_ti
 
     pager, output = get_output()
 
+    # progress is only shown when the rows aren't landing on the terminal
+    progress = Progress(
+        "FETCH",
+        enabled=(pager is None and not output.isatty()),
+    )
+    progress.start()
+
     start_time = time.monotonic_ns()
     write_title = True
     write_header = not config.tuples_only
     total_rows = 0
-    for batch in itertools.batched(records, 10000):
-
-        total_time += time.monotonic_ns() - start_time
-        start_time = time.monotonic_ns()
-
-        if config.extended_display:
-            total_rows += write_extended(
-                output,
-                batch,
-                records,
-                total_rows,
-                title=title,
-                write_title=write_title,
-            )
-            write_title = False
-        elif config.format_ == "csv":
-            total_rows += write_csv(
-                output,
-                batch,
-                records,
-                write_header=write_header,
-            )
-            write_header = False
-        elif config.format_ == "unaligned":
-            total_rows += write_unaligned(
+    try:
+        if config.format_ in ("csv", "unaligned") and not config.extended_display:
+            total_rows, fetch_time = write_streamed(
                 output,
-                batch,
                 records,
                 title=title,
-                write_title=write_title,
                 write_header=write_header,
+                progress=progress,
             )
-            write_title = False
-            write_header = False
+            total_time += fetch_time
         else:
-            total_rows += write_aligned(
-                output,
-                batch,
-                records,
-                title=title,
-                write_title=write_title,
-                write_header=write_header,
-            )
-            write_title = False
-            write_header = False
+            for batch in itertools.batched(records, 10000):
+
+                total_time += time.monotonic_ns() - start_time
+                start_time = time.monotonic_ns()
+
+                if config.extended_display:
+                    total_rows += write_extended(
+                        output,
+                        batch,
+                        records,
+                        total_rows,
+                        title=title,
+                        write_title=write_title,
+                    )
+                    write_title = False
+                else:
+                    total_rows += write_aligned(
+                        output,
+                        batch,
+                        records,
+                        title=title,
+                        write_title=write_title,
+                        write_header=write_header,
+                    )
+                    write_title = False
+                    write_header = False
+
+                progress.add(rows=len(batch))
+    finally:
+        progress.finish()
 
     if extra_content is not None:
         shutil.copyfileobj(extra_content, output)
@@ -203,29 +207,36 @@ def write_aligned(output, records, result, title=None, write_title=True, write_h
     return row_count
 
 
-def write_unaligned(output, records, result, title=None, write_title=True, write_header=True):
-
-    fieldnames = list(result.keys())
-
-    if write_title and title is not None:
-        output.write(title)
-        output.write(config.record_separator)
-
-    if write_header:
-        output.write(config.field_separator.join(fieldnames))
-        output.write(config.record_separator)
+def write_streamed(output, results, title=None, write_header=True, progress=None):
 
-    row_count = 0
+    fieldnames = list(results.keys())
 
-    for raw in records:
+    # rows are fetched, formatted and written on separate stages so the
+    # network, formatting and output all overlap
+    if config.format_ == "csv":
+        if write_header:
+            output.write(format_csv_rows([fieldnames]))
 
-        row_count += 1
+        pipeline = Pipeline(results, format_csv_rows)
+    else:
+        if title is not None:
+            output.write(title)
+            output.write(config.record_separator)
+
+        if write_header:
+            output.write(config.field_separator.join(fieldnames))
+            output.write(config.record_separator)
+
+        pipeline = Pipeline(
+            results,
+            format_unaligned_rows,
+            config.field_separator,
+            config.record_separator,
+        )
 
-        values = [as_str(v) for v in raw]
-        output.write(config.field_separator.join(values))
-        output.write(config.record_separator)
+    total_rows = pipeline.run(output, progress=progress)
 
-    return row_count
+    return total_rows, pipeline.fetch_time
 
 
 def write_extended(output, records, result, total_rows, title=None, write_title=True):
@@ -294,19 +305,21 @@ def write_extended(output, records, result, total_rows, title=None, write_title=
     return row_count
 
 
-def write_csv(output, records, result, write_header=True, delimiter=","):
+def write_copy(output, results, options, progress=None):
 
-    fieldnames = list(result.keys())
-
-    writer = csv.writer(output, delimiter=delimiter)
-    if write_header:
-        writer.writerow(fieldnames)
-
-    row_count = 0
+    if options.format_ == "csv":
+        delimiter = options.delimiter or ","
 
-    for raw in records:
-        row_count += 1
+        if options.header:
+            output.write(format_csv_rows([list(results.keys())], delimiter))
 
-        writer.writerow([as_str(v) for v in raw])
+        pipeline = Pipeline(results, format_csv_rows, delimiter)
+    else:
+        pipeline = Pipeline(
+            results,
+            format_copy_rows,
+            options.null or "\\N",
+            options.delimiter or "\t",
+        )
 
-    return row_count
+    return pipeline.run(output, progress=progress)
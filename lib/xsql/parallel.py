@@ -0,0 +1,728 @@
+import concurrent.futures
+import copy
+import json
+import math
+import os
+import signal
+import sys
+import threading
+
+from sqlalchemy import text
+
+from .compression import (
+    CompressionError,
+    open_compressed,
+    open_mapped,
+    resolve_compression,
+    suffixes,
+)
+from .config import config
+from .db import make_worker_engine
+from .output import write_copy
+from .progress import CountingReader, CountingWriter, get_copy_progress
+
+format_suffixes = {
+    "csv": ".csv",
+    "text": ".txt",
+    "binary": ".bin",
+}
+
+# with single_transaction, how long (in seconds) a finished partition waits
+# on the others before giving up and rolling everything back
+barrier_timeout = 3600
+
+hash_expressions = {
+    "postgresql": "mod(pg_catalog.hashtext(({key})::text)::bigint + 2147483648, {count})",
+    "redshift": "mod(strtol(left(md5(({key})::varchar), 8), 16), {count})",
+    "snowflake": "mod(abs(hash({key})), {count})",
+}
+
+
+class ParallelCopyError(Exception):
+    pass
+
+
+class Partition:
+
+    def __init__(self, index, predicate, query):
+        self.index = index
+        self.predicate = predicate
+        self.query = query
+        self.filename = None
+        self.rows = None
+
+
+def get_partition_method(conn, options):
+
+    if options.partition_method is not None:
+        method = options.partition_method
+    elif options.partition_by is not None:
+        method = "range"
+    elif conn.dialect.name == "postgresql" and options.table is not None:
+        method = "ctid"
+    else:
+        raise ParallelCopyError("parallel copy requires partition_by")
+
+    if method not in ("ctid", "range", "hash"):
+        raise ParallelCopyError(
+            'unrecognized partition_method "{}", expected one of ctid, range, or hash'
+            .format(method)
+        )
+
+    if method == "ctid":
+        if conn.dialect.name != "postgresql":
+            raise ParallelCopyError("ctid partitioning is only available for postgresql")
+        if options.table is None:
+            raise ParallelCopyError("ctid partitioning requires a table, not a query")
+    elif options.partition_by is None:
+        raise ParallelCopyError("{} partitioning requires partition_by".format(method))
+
+    if method == "hash" and conn.dialect.name not in hash_expressions:
+        raise ParallelCopyError(
+            "hash partitioning is not implemented for {}"
+            .format(conn.dialect.name)
+        )
+
+    return method
+
+
+def get_ctid_predicates(conn, options, count):
+    from .parsers import table_target
+
+    blocks_query = """
+    select
+        pg_catalog.pg_relation_size(cast(:target as pg_catalog.regclass))
+        / pg_catalog.current_setting('block_size')::bigint
+    """
+
+    target = table_target(options.table)
+
+    blocks = conn.execute(text(blocks_query).bindparams(target=target)).scalar()
+
+    step = max(math.ceil(blocks / count), 1)
+
+    predicates = []
+    for index in range(count):
+        predicate = "ctid >= '({},0)'::tid".format(index * step)
+        if index < count - 1:
+            predicate += " and ctid < '({},0)'::tid".format((index + 1) * step)
+
+        predicates.append(predicate)
+
+    return predicates
+
+
+def get_range_predicates(conn, query, options, count):
+
+    key = options.partition_by
+
+    bounds_query = (
+        "select min(" + key + "), max(" + key + ") from ("
+        + query
+        + ") as xsql_partition"
+    )
+
+    low, high = conn.execute(text(bounds_query)).one()
+
+    if low is None:
+        return ["true"]
+
+    if not isinstance(low, int) or not isinstance(high, int):
+        raise ParallelCopyError(
+            "range partitioning requires an integer partition_by column, use partition_method 'hash'"
+        )
+
+    count = min(count, high - low + 1)
+    step = math.ceil((high - low + 1) / count)
+
+    predicates = []
+    for index in range(count):
+
+        lower = low + index * step
+        upper = lower + step
+
+        clauses = []
+
+        if index > 0:
+            clauses.append("{} >= {}".format(key, lower))
+        if index < count - 1:
+            clauses.append("{} < {}".format(key, upper))
+
+        if not clauses:
+            predicates.append("true")
+        elif index == 0:
+            predicates.append("(" + clauses[0] + " or " + key + " is null)")
+        else:
+            predicates.append(" and ".join(clauses))
+
+    return predicates
+
+
+def get_hash_predicates(conn, options, count):
+
+    key = options.partition_by
+
+    expression = hash_expressions[conn.dialect.name].format(key=key, count=count)
+
+    predicates = []
+    for index in range(count):
+        predicate = "{} = {}".format(expression, index)
+        if index == 0:
+            predicate = "(" + predicate + " or " + key + " is null)"
+
+        predicates.append(predicate)
+
+    return predicates
+
+
+def get_partitions(conn, query, options, method):
+    from .parsers import table_target
+
+    count = options.parallel
+
+    if method == "ctid":
+        predicates = get_ctid_predicates(conn, options, count)
+    elif method == "range":
+        predicates = get_range_predicates(conn, query, options, count)
+    else:
+        predicates = get_hash_predicates(conn, options, count)
+
+    partitions = []
+
+    for index, predicate in enumerate(predicates):
+
+        if method == "ctid":
+            columns = "*"
+            if options.table.columns:
+                columns = ", ".join(options.table.columns)
+
+            partition_query = (
+                "select " + columns
+                + " from " + table_target(options.table)
+                + " where " + predicate
+            )
+        else:
+            partition_query = (
+                "select * from ("
+                + query
+                + ") as xsql_partition where "
+                + predicate
+            )
+
+        partitions.append(Partition(index, predicate, partition_query))
+
+    return partitions
+
+
+def get_partition_filename(options, compression, index):
+
+    filename = "part-{:05d}".format(index)
+    filename += format_suffixes.get(options.format_, "")
+
+    if compression is not None:
+        filename += suffixes[compression]
+
+    return filename
+
+
+class Workers:
+
+    def __init__(self, conn):
+        self.engine = make_worker_engine(conn)
+        self.connections = []
+        self.lock = threading.Lock()
+        self.cancelled = False
+
+    def connect(self):
+        worker_conn = self.engine.connect()
+
+        with self.lock:
+            self.connections.append(worker_conn)
+
+            if self.cancelled:
+                raise ParallelCopyError("canceling statement due to user request")
+
+        return worker_conn
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+
+            for worker_conn in self.connections:
+                try:
+                    dbapi_connection = worker_conn.connection.dbapi_connection
+                    if hasattr(dbapi_connection, "cancel"):
+                        dbapi_connection.cancel()
+                except Exception:
+                    pass
+
+    def close(self):
+        for worker_conn in self.connections:
+            try:
+                worker_conn.close()
+            except Exception:
+                pass
+
+        self.engine.dispose()
+
+
+def begin_snapshot(worker_conn, snapshot):
+    worker_conn = worker_conn.execution_options(isolation_level="REPEATABLE READ")
+    worker_conn.execute(text("set transaction snapshot '" + snapshot + "'"))
+    return worker_conn
+
+
+def copy_partition_to(conn, workers, partition, options, path, compression, level, snapshot, progress):
+    from .run import build_native_copy, copy_buffer_size
+
+    worker_conn = workers.connect()
+
+    if conn.dialect.name == "postgresql":
+        mode = "wb"
+    else:
+        mode = "wt"
+
+    fp = open_compressed(path, mode, compression=compression, level=level)
+
+    try:
+        if conn.dialect.name == "postgresql":
+
+            if snapshot is not None:
+                worker_conn = begin_snapshot(worker_conn, snapshot)
+
+            statement = build_native_copy(partition.query, options)
+
+            writer = CountingWriter(fp, progress, count_rows=options.format_ != "binary")
+
+            with worker_conn.connection.dbapi_connection.cursor() as curs:
+                curs.copy_expert(statement, writer, size=copy_buffer_size)
+                partition.rows = curs.rowcount
+        else:
+            results = worker_conn.execute(
+                text(partition.query),
+                execution_options={"stream_results": True},
+            )
+            partition.rows = write_copy(
+                CountingWriter(fp, progress, count_rows=False),
+                results,
+                options,
+                progress=progress,
+            )
+    finally:
+        fp.close()
+
+    return partition.rows
+
+
+def write_manifest(directory, query, options, method, compression, snapshot, partitions):
+
+    manifest = {
+        "query": query,
+        "format": options.format_,
+        "compression": compression,
+        "partition_method": method,
+        "partition_by": options.partition_by,
+        "snapshot": snapshot,
+        "rows": sum(partition.rows for partition in partitions),
+        "partitions": [
+            {
+                "file": partition.filename,
+                "predicate": partition.predicate,
+                "rows": partition.rows,
+            }
+            for partition in partitions
+        ],
+    }
+
+    with open(os.path.join(directory, "manifest.json"), "wt") as fp:
+        json.dump(manifest, fp, indent=2)
+        fp.write("\n")
+
+
+def begin_partitions(conn, workers, query, options):
+
+    if options.parallel < 1:
+        raise ParallelCopyError("parallel must be at least 1")
+
+    method = get_partition_method(conn, options)
+
+    coordinator = workers.connect()
+
+    snapshot = None
+
+    # every partition imports the coordinator's snapshot so together they
+    # see one consistent view of the data
+    if conn.dialect.name == "postgresql":
+        coordinator = coordinator.execution_options(isolation_level="REPEATABLE READ")
+        snapshot = coordinator.execute(text("select pg_catalog.pg_export_snapshot()")).scalar()
+
+    partitions = get_partitions(coordinator, query, options, method)
+
+    return method, snapshot, partitions
+
+
+def run_in_workers(workers, function, partitions, *args):
+
+    # ctrl-c cancels every partition rather than the (idle) interactive
+    # connection the default handler knows about
+    def sigint_handler(*_):
+        workers.cancel()
+
+    previous_handler = None
+    if threading.current_thread() is threading.main_thread():
+        previous_handler = signal.signal(signal.SIGINT, sigint_handler)
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(partitions)) as executor:
+
+            futures = [
+                executor.submit(function, partition, *args)
+                for partition in partitions
+            ]
+
+            errors = []
+
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except Exception as ex:
+                    if not errors:
+                        workers.cancel()
+                    errors.append(ex)
+
+            # a broken barrier only means another partition failed, report
+            # that failure instead
+            for error in errors:
+                if not isinstance(error, threading.BrokenBarrierError):
+                    raise error
+
+            # only a timeout breaks the barrier without anything failing
+            if errors:
+                raise ParallelCopyError(
+                    "timed out after {} seconds waiting for the other partitions to finish"
+                    .format(barrier_timeout)
+                )
+    finally:
+        if previous_handler is not None:
+            signal.signal(signal.SIGINT, previous_handler)
+
+
+def run_parallel_copy_to(conn, query, options, progress):
+
+    if options.target_type != "file":
+        raise ParallelCopyError("parallel copy requires a directory target")
+
+    if conn.dialect.name != "postgresql" and options.format_ not in ("text", "csv"):
+        raise ParallelCopyError(
+            "copy format {} is not implemented for {}"
+            .format(options.format_, conn.dialect.name)
+        )
+
+    compression = resolve_compression("", options.compression)
+
+    level = options.compression_level
+    if level is None:
+        level = config.compression_level
+
+    directory = os.path.expanduser(options.target)
+
+    workers = Workers(conn)
+
+    try:
+        method, snapshot, partitions = begin_partitions(conn, workers, query, options)
+
+        os.makedirs(directory, exist_ok=True)
+
+        for partition in partitions:
+            partition.filename = get_partition_filename(options, compression, partition.index)
+
+        def copy_partition(partition):
+            return copy_partition_to(
+                conn,
+                workers,
+                partition,
+                options,
+                os.path.join(directory, partition.filename),
+                compression,
+                level,
+                snapshot,
+                progress,
+            )
+
+        run_in_workers(workers, copy_partition, partitions)
+
+        write_manifest(directory, query, options, method, compression, snapshot, partitions)
+    finally:
+        workers.close()
+
+    return sum(partition.rows for partition in partitions)
+
+
+# how much of the file is scanned at a time while looking for record
+# boundaries
+scan_size = 1024 * 1024
+
+
+def find_text_boundary(fp, offset):
+
+    # in text format a newline is only the end of a record if it is not
+    # escaped, i.e. not preceded by an odd number of backslashes
+    window_start = max(offset - 4096, 0)
+    fp.seek(window_start)
+
+    data = b""
+
+    while True:
+        block = fp.read(scan_size)
+        if not block:
+            return None
+
+        data += block
+
+        position = max(offset - window_start, 0)
+
+        while True:
+            position = data.find(b"\n", position)
+            if position < 0:
+                break
+
+            backslashes = 0
+            while position - backslashes > 0 and data[position - backslashes - 1] == ord("\\"):
+                backslashes += 1
+
+            if backslashes % 2 == 0:
+                return window_start + position + 1
+
+            position += 1
+
+
+def get_csv_boundaries(fp, offsets, quote):
+
+    # a newline ends a csv record only outside of quotes, the quote parity at
+    # any point is the number of quote characters seen so far (an escaped
+    # quote is a doubled quote, which keeps the parity)
+    boundaries = []
+
+    fp.seek(0)
+
+    block_start = 0
+    parity = 0
+
+    pending = list(offsets)
+
+    while pending:
+        block = fp.read(scan_size)
+        if not block:
+            break
+
+        block_end = block_start + len(block)
+
+        search_from = 0
+
+        while pending and pending[0] < block_end:
+
+            position = max(pending[0] - block_start, search_from)
+
+            while True:
+                position = block.find(b"\n", position)
+                if position < 0:
+                    break
+
+                if (parity + block.count(quote, 0, position)) % 2 == 0:
+                    break
+
+                position += 1
+
+            if position < 0:
+                # no boundary in this block, keep looking in the next one
+                break
+
+            boundaries.append(block_start + position + 1)
+            search_from = position + 1
+            pending.pop(0)
+
+            # skip any later offsets that fall inside the chunk just closed
+            while pending and pending[0] < block_start + search_from:
+                pending.pop(0)
+
+        parity = (parity + block.count(quote)) % 2
+        block_start = block_end
+
+    return boundaries
+
+
+def get_chunks(path, count, options):
+
+    size = os.path.getsize(path)
+
+    offsets = [math.ceil(size * index / count) for index in range(1, count)]
+
+    with open(path, "rb") as fp:
+        if options.format_ == "csv":
+            quote = (options.quote or '"').encode("utf-8")
+            boundaries = get_csv_boundaries(fp, offsets, quote)
+        else:
+            boundaries = []
+            for offset in offsets:
+                if boundaries and offset < boundaries[-1]:
+                    continue
+
+                boundary = find_text_boundary(fp, offset)
+                if boundary is None:
+                    break
+
+                boundaries.append(boundary)
+
+    starts = [0] + boundaries
+    ends = boundaries + [size]
+
+    return [
+        (start, end)
+        for start, end in zip(starts, ends)
+        if end > start
+    ]
+
+
+class FileRange:
+
+    def __init__(self, fp, start, end):
+        self.fp = fp
+        self.fp.seek(start)
+        self.remaining = end - start
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+
+        data = self.fp.read(size)
+        self.remaining -= len(data)
+
+        return data
+
+    def readline(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+
+        data = self.fp.readline(size)
+        self.remaining -= len(data)
+
+        return data
+
+
+def copy_chunk_from(workers, chunk, options, path, barrier, progress):
+    from .run import build_native_copy
+
+    index, start, end = chunk
+
+    chunk_options = options
+    if index > 0 and options.header:
+        # only the first chunk starts with the header line
+        chunk_options = copy.copy(options)
+        chunk_options.header = None
+
+    statement = build_native_copy(None, chunk_options)
+
+    transaction = None
+
+    try:
+        worker_conn = workers.connect()
+
+        transaction = worker_conn.begin()
+
+        with open_mapped(path) as fp:
+            with worker_conn.connection.dbapi_connection.cursor() as curs:
+                curs.copy_expert(
+                    statement,
+                    CountingReader(FileRange(fp, start, end), progress),
+                    size=scan_size,
+                )
+                rows = curs.rowcount
+
+        if barrier is not None:
+            barrier.wait()
+
+        transaction.commit()
+    except BaseException:
+        # failing to connect included, the other chunks would otherwise wait
+        # on this one until the timeout
+        if barrier is not None:
+            barrier.abort()
+
+        if transaction is not None:
+            transaction.rollback()
+        raise
+
+    return rows
+
+
+def run_parallel_copy_from(conn, query, options, progress):
+
+    if conn.dialect.name != "postgresql":
+        raise ParallelCopyError(
+            "parallel copy from is not implemented for {}"
+            .format(conn.dialect.name)
+        )
+
+    if options.target_type != "file":
+        raise ParallelCopyError("parallel copy from requires a file source")
+
+    if options.table is None:
+        raise ParallelCopyError("copy from requires a table")
+
+    if options.parallel < 1:
+        raise ParallelCopyError("parallel must be at least 1")
+
+    if resolve_compression(options.target, options.compression) is not None:
+        raise ParallelCopyError("parallel copy from requires an uncompressed file")
+
+    if options.format_ == "csv" and options.escape and options.escape != (options.quote or '"'):
+        raise ParallelCopyError("parallel copy from does not support an escape different from quote")
+
+    if options.format_ not in ("csv", "text"):
+        raise ParallelCopyError(
+            "parallel copy from does not support format {}"
+            .format(options.format_)
+        )
+
+    path = os.path.expanduser(options.target)
+
+    chunks = [
+        (index, start, end)
+        for index, (start, end) in enumerate(get_chunks(path, options.parallel, options))
+    ]
+
+    if not chunks:
+        return 0
+
+    # with single_transaction every chunk waits for the others to finish
+    # before committing, and any failure rolls all of them back
+    barrier = None
+    if options.single_transaction:
+        barrier = threading.Barrier(len(chunks), timeout=barrier_timeout)
+
+    workers = Workers(conn)
+
+    rows = {}
+
+    def copy_chunk(chunk):
+        rows[chunk[0]] = copy_chunk_from(workers, chunk, options, path, barrier, progress)
+
+    try:
+        run_in_workers(workers, copy_chunk, chunks)
+    finally:
+        workers.close()
+
+    return sum(rows.values())
+
+
+def run_parallel_copy(conn, query, options):
+    try:
+        with get_copy_progress(options) as progress:
+            if options.direction == "to":
+                return run_parallel_copy_to(conn, query, options, progress)
+            else:
+                return run_parallel_copy_from(conn, query, options, progress)
+    except (ParallelCopyError, CompressionError) as pex:
+        sys.stderr.write("ERROR:  {}\n".format(pex))
+        sys.stderr.flush()
+        return None
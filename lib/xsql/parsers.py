@@ -1,14 +1,18 @@
+import functools
 import re
 
 from lark import Lark, Transformer
 
-options_parser = Lark(r"""
+from .compression import parse_level, resolve_compression
+
+options_grammar = r"""
 	_STRING_INNER: /.*?/
 	_STRING_ESC_INNER: _STRING_INNER /(?<!\\)(\\\\)*?/
 
 	ESCAPED_STRING : "'" _STRING_ESC_INNER "'"
 
     STAR: "*"
+    TABLE_NAME: /[A-Za-z_"][A-Za-z0-9_$."]*/
     BOOLEAN: "true"i | "false"i
 
     filename: ESCAPED_STRING
@@ -17,8 +21,9 @@ options_parser = Lark(r"""
     stdout: "stdout"i
     pstdin: "pstdin"i
     pstdout: "pstdout"i
+    connection: "connection"i ESCAPED_STRING "table"i TABLE_NAME
 
-    to_target: filename | program | stdout | pstdout
+    to_target: filename | program | stdout | pstdout | connection
     from_target: filename | program | stdin | pstdin
 
     force_quote_column: QUOTED_IDENTIFIER | CNAME
@@ -39,6 +44,7 @@ options_parser = Lark(r"""
 
     csv: "csv"i
     format_: "format"i ("csv"i | "text"i)
+    format_binary: "format"i "binary"i
     freeze: "freeze"i BOOLEAN?
     delimiter: "delimiter"i ESCAPED_STRING
     null: "null"i ESCAPED_STRING
@@ -55,9 +61,15 @@ options_parser = Lark(r"""
     reject_limit: "reject_limit"i NUMBER
     encoding: "encoding"i ESCAPED_STRING
     log_verbosity: "log_verbosity"i log_verbosity_options
+    compression: "compression"i ESCAPED_STRING
+    compression_level: "compression_level"i NUMBER
+    parallel: "parallel"i NUMBER
+    partition_by: "partition_by"i ESCAPED_STRING
+    partition_method: "partition_method"i ESCAPED_STRING
+    single_transaction: "single_transaction"i BOOLEAN?
 
     with_: "with"i
-    option: csv | format_ | freeze | delimiter | null | default | header | quote | escape | force_quote | force_not_null | force_null | on_error | reject_limit | encoding | log_verbosity
+    option: csv | format_ | format_binary | freeze | delimiter | null | default | header | quote | escape | force_quote | force_not_null | force_null | on_error | reject_limit | encoding | log_verbosity | compression | compression_level | parallel | partition_by | partition_method | single_transaction
     options_parens: [option (", " option)*]
     options_bare: [option (option)*]
     with_options_parens: with_? "(" options_parens ")"
@@ -74,7 +86,14 @@ options_parser = Lark(r"""
     %import common.NUMBER
     %import common.WS
     %ignore WS
-""", start="direction")
+"""
+
+
+# the grammars are only compiled the first time they are used, which keeps
+# them out of startup for runs that never \copy
+@functools.cache
+def get_options_parser():
+    return Lark(options_grammar, start="direction")
 
 
 class Options:
@@ -99,6 +118,14 @@ class Options:
         reject_limit=None,
         encoding=None,
         log_verbosity=None,
+        compression=None,
+        compression_level=None,
+        parallel=None,
+        partition_by=None,
+        partition_method=None,
+        single_transaction=None,
+        table=None,
+        destination_table=None,
     ):
         self.direction = direction
         self.target_type = target_type
@@ -118,6 +145,14 @@ class Options:
         self.reject_limit = reject_limit
         self.encoding = encoding
         self.log_verbosity = log_verbosity
+        self.compression = compression
+        self.compression_level = compression_level
+        self.parallel = parallel
+        self.partition_by = partition_by
+        self.partition_method = partition_method
+        self.single_transaction = single_transaction
+        self.table = table
+        self.destination_table = destination_table
 
 
 class OptionsTransformer(Transformer):
@@ -139,7 +174,13 @@ class OptionsTransformer(Transformer):
     def program(self, s):
         (s,) = s
         self._options.target_type = "program"
-        self._options.target = s
+        self._options.target = s[1:-1]
+
+    def connection(self, s):
+        (alias, table) = s
+        self._options.target_type = "connection"
+        self._options.target = alias[1:-1]
+        self._options.destination_table = str(table)
 
     def stdin(self, s):
         self._options.target_type = "pipe"
@@ -167,6 +208,9 @@ class OptionsTransformer(Transformer):
         (s,) = s
         self._options.format_ = s
 
+    def format_binary(self, s):
+        self._options.format_ = "binary"
+
     def freeze(self, s):
         (s,) = s
         if s in ("true", "on"):
@@ -234,6 +278,34 @@ class OptionsTransformer(Transformer):
     def encoding(self, s):
         self._options.encoding = s[1:-1]
 
+    def compression(self, s):
+        (s,) = s
+        self._options.compression = s[1:-1]
+
+    def compression_level(self, s):
+        (s,) = s
+        self._options.compression_level = str(s)
+
+    def parallel(self, s):
+        (s,) = s
+        self._options.parallel = int(s)
+
+    def partition_by(self, s):
+        (s,) = s
+        self._options.partition_by = s[1:-1]
+
+    def partition_method(self, s):
+        (s,) = s
+        self._options.partition_method = s[1:-1].lower()
+
+    def single_transaction(self, s):
+        if not s:
+            self._options.single_transaction = True
+            return
+
+        (s,) = s
+        self._options.single_transaction = s.lower() == "true"
+
 
 def parse_options(options):
 
@@ -247,7 +319,7 @@ def parse_options(options):
     target = None
 
     # unquoted filename
-    if not re.search(r"^(to|from)\s+('|program\b|stdout\b|stdin\b)", options):
+    if not re.search(r"^(to|from)\s+('|program\b|stdout\b|stdin\b|connection\b)", options):
         res = re.split(r"\s+", options, maxsplit=2)
         direction = res[0]
         target = res[1]
@@ -267,14 +339,23 @@ def parse_options(options):
         options = re.sub(r"\b(format)?\s+csv,?", "", options)
 
     if options:
-        tree = options_parser.parse(options)
+        tree = get_options_parser().parse(options)
         transformer = OptionsTransformer(parsed)
         transformer.transform(tree)
 
+    # checked here rather than when the file is opened, which for a parallel
+    # copy is after the query has started
+    if parsed.compression_level is not None:
+        compression = None
+        if parsed.target_type == "file":
+            compression = resolve_compression(parsed.target, parsed.compression)
+
+        parsed.compression_level = parse_level(parsed.compression_level, compression)
+
     return parsed
 
 
-table_parser = Lark(r"""
+table_grammar = r"""
     schema: ESCAPED_STRING | CNAME
     table: ESCAPED_STRING | CNAME
     target: (schema ".")? table
@@ -288,7 +369,12 @@ table_parser = Lark(r"""
     %import common.CNAME
     %import common.WS
     %ignore WS
-""", start="directive")
+"""
+
+
+@functools.cache
+def get_table_parser():
+    return Lark(table_grammar, start="directive")
 
 
 class Table:
@@ -325,18 +411,30 @@ class TableTransformer(Transformer):
         self.result.columns.append(s)
 
 
-def query_from_table_directive(table):
+def parse_table_directive(table):
 
     result = Table()
 
-    tree = table_parser.parse(table)
+    tree = get_table_parser().parse(table)
     transformer = TableTransformer(result)
     transformer.transform(tree)
 
+    return result
+
+
+def table_target(result):
+
     target = result.table
     if result.schema:
         target = result.schema + "." + result.table
 
+    return target
+
+
+def query_from_table(result):
+
+    target = table_target(result)
+
     if result.columns:
         query = "select " + ", ".join(result.columns) + " from " + target
     else:
@@ -345,11 +443,17 @@ def query_from_table_directive(table):
     return query
 
 
+def query_from_table_directive(table):
+    return query_from_table(parse_table_directive(table))
+
+
 def parse_copy(command):
 
     # remove copy from front
     command = re.sub(r"^\s*copy\s*", "", command, flags=re.I)
 
+    table = None
+
     # it's a query
     if command.startswith("("):
 
@@ -362,11 +466,12 @@ def parse_copy(command):
     else:
         match = re.search(r"\s*(to|from)\s+.+?$", command)
 
-        table = command[:match.start()]
+        table = parse_table_directive(command[:match.start()])
         rest = command[match.start():]
 
-        query = query_from_table_directive(table)
+        query = query_from_table(table)
 
     options = parse_options(rest)
+    options.table = table
 
     return query, options
@@ -0,0 +1,126 @@
+import concurrent.futures
+import itertools
+import queue
+import threading
+import time
+
+from .config import config
+
+# rows pulled from the cursor at a time, each batch is formatted into a
+# single chunk of output
+fetch_size = 10000
+
+# formatted (or formatting) batches allowed ahead of the writer, once full
+# the fetch thread waits for the writer to catch up
+queue_size = 4
+
+
+def fetch_batches(results):
+
+    fetchmany = getattr(results, "fetchmany", None)
+
+    if fetchmany is None:
+        yield from itertools.batched(results, fetch_size)
+        return
+
+    while True:
+        batch = fetchmany(fetch_size)
+        if not batch:
+            return
+
+        yield batch
+
+
+def set_null(null):
+    config.null = null
+
+
+def get_executor():
+
+    # formatting is pure python, so with format_processes set it runs in a
+    # process pool rather than competing for the gil with fetching
+    if config.format_processes:
+        return concurrent.futures.ProcessPoolExecutor(
+            max_workers=config.format_processes,
+            initializer=set_null,
+            initargs=(config.null,),
+        )
+
+    return concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+
+class Pipeline:
+
+    def __init__(self, results, function, *args):
+        self.results = results
+        self.function = function
+        self.args = args
+        self.rows = 0
+        self.fetch_time = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._error = None
+
+    def _write(self, output, progress):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    return
+
+                if self._stop.is_set():
+                    continue
+
+                future, count = item
+
+                output.write(future.result())
+
+                self.rows += count
+                if progress is not None:
+                    progress.add(rows=count)
+        except Exception as ex:
+            self._error = ex
+            self._stop.set()
+
+            # keep draining so the fetching side never blocks on a full queue
+            while self._queue.get() is not None:
+                pass
+
+    def run(self, output, progress=None):
+
+        # fetching stays on the calling thread, some drivers don't allow a
+        # cursor to be used from any other, while formatting runs on the
+        # executor and a writer thread drains the formatted batches in order
+        with get_executor() as executor:
+
+            thread = threading.Thread(target=self._write, args=(output, progress), daemon=True)
+            thread.start()
+
+            try:
+                batches = fetch_batches(self.results)
+
+                while not self._stop.is_set():
+
+                    start_time = time.monotonic_ns()
+                    batch = next(batches, None)
+                    self.fetch_time += time.monotonic_ns() - start_time
+
+                    if batch is None:
+                        break
+
+                    if config.format_processes:
+                        batch = [tuple(row) for row in batch]
+
+                    future = executor.submit(self.function, batch, *self.args)
+                    self._queue.put((future, len(batch)))
+            except BaseException:
+                self._stop.set()
+                raise
+            finally:
+                self._queue.put(None)
+                thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+        return self.rows
@@ -0,0 +1,237 @@
+import json
+import os
+import sys
+import threading
+import time
+
+from .compression import CompressionError, resolve_compression
+from .config import config
+
+# an operation has to run this long before any progress is shown, so quick
+# commands stay quiet
+delay = 1.0
+
+tty_interval = 0.5
+json_interval = 5.0
+
+
+def get_progress_mode():
+
+    mode = config.progress
+
+    if mode in (None, "off") or config.quiet:
+        return None
+
+    # json lines are only written when asked for, scripts and logs capturing
+    # stderr don't expect them
+    if mode == "auto":
+        if sys.stderr.isatty():
+            return "tty"
+        return None
+
+    return mode
+
+
+def get_copy_progress(options):
+
+    total_bytes = None
+
+    if options.direction == "from" and options.target_type == "file":
+        path = os.path.expanduser(options.target)
+        try:
+            if resolve_compression(path, options.compression) is None:
+                total_bytes = os.path.getsize(path)
+        except (CompressionError, OSError):
+            pass
+
+    # copying to or from the terminal itself, don't draw over the data
+    enabled = True
+    if options.target_type == "pipe":
+        if options.target in ("stdout", "pstdout"):
+            enabled = not sys.stdout.isatty()
+        else:
+            enabled = not sys.stdin.isatty()
+
+    return Progress("COPY", total_bytes=total_bytes, enabled=enabled)
+
+
+def format_bytes(value):
+    for unit in ("B", "kB", "MB", "GB"):
+        if value < 1024:
+            return "{:.1f} {}".format(value, unit)
+        value /= 1024
+    return "{:.1f} TB".format(value)
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return "{:02d}:{:02d}:{:02d}".format(
+        seconds // 3600,
+        (seconds // 60) % 60,
+        seconds % 60,
+    )
+
+
+class Progress:
+
+    def __init__(self, label, total_bytes=None, enabled=True):
+        self.label = label
+        self.total_bytes = total_bytes
+        self.rows = 0
+        self.bytes = 0
+        self.mode = None
+        if enabled:
+            self.mode = get_progress_mode()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._shown = False
+        self._start_time = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.finish()
+
+    def start(self):
+        self._start_time = time.monotonic()
+
+        if self.mode is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def add(self, rows=0, bytes_=0):
+        with self._lock:
+            self.rows += rows
+            self.bytes += bytes_
+
+    def finish(self):
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+        if self._shown and self.mode == "tty":
+            sys.stderr.write("\r\x1b[K")
+            sys.stderr.flush()
+
+    def _run(self):
+        if self._stop.wait(delay):
+            return
+
+        if self.mode == "tty":
+            interval = tty_interval
+        else:
+            interval = json_interval
+
+        while True:
+            self._show()
+            if self._stop.wait(interval):
+                return
+
+    def get_status(self):
+
+        with self._lock:
+            rows = self.rows
+            bytes_ = self.bytes
+
+        elapsed = time.monotonic() - self._start_time
+
+        status = {
+            "operation": self.label,
+            "elapsed": round(elapsed, 3),
+            "rows": rows,
+            "bytes": bytes_,
+            "rows_per_second": round(rows / elapsed, 1),
+            "bytes_per_second": round(bytes_ / elapsed, 1),
+            "total_bytes": self.total_bytes,
+            "remaining": None,
+        }
+
+        if self.total_bytes and bytes_:
+            status["remaining"] = round(elapsed * (self.total_bytes - bytes_) / bytes_, 3)
+
+        return status
+
+    def _show(self):
+
+        status = self.get_status()
+
+        if self.mode == "json":
+            sys.stderr.write(json.dumps(status))
+            sys.stderr.write("\n")
+        else:
+            parts = []
+
+            if status["rows"]:
+                parts.append(
+                    "{:,} rows ({:,.0f} rows/s)"
+                    .format(status["rows"], status["rows_per_second"])
+                )
+
+            if status["bytes"]:
+                done = format_bytes(status["bytes"])
+                if status["total_bytes"]:
+                    done += " of " + format_bytes(status["total_bytes"])
+
+                parts.append(
+                    "{} ({}/s)"
+                    .format(done, format_bytes(status["bytes_per_second"]))
+                )
+
+            parts.append(format_duration(status["elapsed"]) + " elapsed")
+
+            if status["remaining"] is not None:
+                parts.append(format_duration(status["remaining"]) + " remaining")
+
+            sys.stderr.write("\r\x1b[K")
+            sys.stderr.write(self.label)
+            sys.stderr.write(": ")
+            sys.stderr.write(", ".join(parts))
+
+        sys.stderr.flush()
+
+        self._shown = True
+
+
+class CountingReader:
+
+    def __init__(self, fp, progress, count_rows=True):
+        self.fp = fp
+        self.progress = progress
+        self.count_rows = count_rows
+
+    def _count(self, data):
+        rows = 0
+        if self.count_rows:
+            if isinstance(data, str):
+                rows = data.count("\n")
+            else:
+                rows = data.count(b"\n")
+
+        self.progress.add(rows=rows, bytes_=len(data))
+
+    def read(self, size=-1):
+        data = self.fp.read(size)
+        self._count(data)
+        return data
+
+    def readline(self, size=-1):
+        data = self.fp.readline(size)
+        self._count(data)
+        return data
+
+
+class CountingWriter(CountingReader):
+
+    def write(self, data):
+        result = self.fp.write(data)
+        self._count(data)
+        return result
+
+    def flush(self):
+        self.fp.flush()
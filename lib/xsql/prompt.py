@@ -1,5 +1,28 @@
 import re
 import subprocess
+import threading
+import time
+
+from .time import format_time
+
+# %`command` output is kept this many seconds, then read again in the
+# background while the old output is still shown
+command_ttl = 1
+
+# prompt strings already broken into segments, by prompt string
+compiled_prompts = {}
+
+# how long the last statement took, for %D
+last_duration = None
+
+prompt_pattern = re.compile(r"%([nM/>xTD])|%(`.+?`)")
+
+# psycopg2's transaction statuses, as psql's %x shows them
+transaction_states = {
+    0: "",
+    2: "*",
+    3: "!",
+}
 
 
 def render_prompt(conn, prompt_string, wrap_count):
@@ -7,52 +30,175 @@ def render_prompt(conn, prompt_string, wrap_count):
     if wrap_count > 0:
         return ""
 
+    segments = compiled_prompts.get(prompt_string)
+    if segments is None:
+        segments = compile_prompt(prompt_string)
+        compiled_prompts[prompt_string] = segments
+
+    # a url without a user name, say, shows as nothing
+    return "".join(segment(conn) or "" for segment in segments)
+
+
+def compile_prompt(prompt_string):
+
+    segments = []
+
+    position = 0
+    for match in prompt_pattern.finditer(prompt_string):
+        if match.start() > position:
+            segments.append(TextSegment(prompt_string[position:match.start()]))
+
+        escape, command = match.groups()
+        if command is not None:
+            segments.append(CommandSegment(command[1:-1]))
+        else:
+            segments.append(escape_segments[escape])
+
+        position = match.end()
+
+    if position < len(prompt_string):
+        segments.append(TextSegment(prompt_string[position:]))
+
+    return segments
+
+
+def record_duration(total_time):
+    global last_duration
+    last_duration = total_time
+
+
+class TextSegment:
+
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, conn):
+        return self.value
+
+
+class CommandSegment:
+
+    # rendering only ever reads the last output. once it's older than
+    # command_ttl the command runs again on a thread, and the prompt is
+    # redrawn when it's done. only the very first run is waited on, so
+    # there's something to show
+
+    def __init__(self, command):
+        self.command = command
+        self.value = None
+        self.read_at = None
+        self.refreshing = False
+        self.lock = threading.Lock()
+
+    def __call__(self, conn):
+
+        if self.value is None:
+            self.value = self.run()
+            self.read_at = time.monotonic()
+            return self.value
+
+        with self.lock:
+            if not self.refreshing and time.monotonic() - self.read_at > command_ttl:
+                self.refreshing = True
+
+                thread = threading.Thread(target=self.refresh, daemon=True)
+                thread.start()
+
+        return self.value
+
+    def run(self):
+
+        result = subprocess.run(
+            self.command,
+            shell=True,
+            capture_output=True,
+        )
+
+        return result.stdout.decode("utf-8").strip()
+
+    def refresh(self):
+        from prompt_toolkit.application.current import get_app_or_none
+
+        try:
+            value = self.run()
+        except OSError:
+            value = self.value
+
+        changed = value != self.value
+
+        with self.lock:
+            self.value = value
+            self.read_at = time.monotonic()
+            self.refreshing = False
+
+        if changed:
+            app = get_app_or_none()
+            if app is not None:
+                app.invalidate()
+
+
+def get_user_name(conn):
+    return conn.engine.url.username
+
+
+def get_host_name(conn):
+    host = conn.engine.url.host
+
+    if not host:
+        return "[local]"
+
+    return host
+
+
+def get_port(conn):
     url = conn.engine.url
 
-    user_name = url.username
-    host = url.host
     if not url.port and conn.dialect.name in ("postgresql", "redshift"):
-        port = 5432
+        return "5432"
     elif not url.port and conn.dialect.name == "snowflake":
-        port = 443
-    else:
-        port = url.port
+        return "443"
+    elif url.port is not None:
+        return str(url.port)
 
-    if not host:
-        host_name = "[local]"
-    else:
-        host_name = host
-
-    if port is not None:
-        port = str(port)
-    else:
-        port = ""
-
-    database_name = url.database
-
-    def replacer(match):
-        if match.groups()[0] == "%n":
-            return user_name
-        elif match.groups()[0] == "%M":
-            return host_name
-        elif match.groups()[0] == "%>":
-            return port
-        elif match.groups()[0] == "%/":
-            return database_name
-        elif match.groups()[0].startswith("%`"):
-            command = match.groups()[0]
-            command = command[2:-1]
-
-            result = subprocess.run(
-                command,
-                shell=True,
-                capture_output=True,
-            )
-
-            value = result.stdout.decode("utf-8").strip()
-
-            return value
-
-    prompt = re.sub("(%([nM/>])|%(`.+?`))", replacer, prompt_string)
-
-    return prompt
+    return ""
+
+
+def get_database_name(conn):
+    return conn.engine.url.database
+
+
+def get_transaction_state(conn):
+
+    try:
+        dbapi_connection = conn.connection.dbapi_connection
+    except Exception:
+        return "?"
+
+    # only psycopg2 says, elsewhere nothing is shown
+    if hasattr(dbapi_connection, "get_transaction_status"):
+        return transaction_states.get(dbapi_connection.get_transaction_status(), "?")
+
+    return ""
+
+
+def get_time(conn):
+    return time.strftime("%H:%M:%S")
+
+
+def get_duration(conn):
+
+    if last_duration is None:
+        return ""
+
+    return format_time(last_duration)
+
+
+escape_segments = {
+    "n": get_user_name,
+    "M": get_host_name,
+    ">": get_port,
+    "/": get_database_name,
+    "x": get_transaction_state,
+    "T": get_time,
+    "D": get_duration,
+}
@@ -1,3 +1,6 @@
+import re
+
+
 def get_quote_positions(data, allow_dollar_quoting=True):
 
     idx = 0
@@ -85,6 +88,12 @@ def get_quote_positions(data, allow_dollar_quoting=True):
 
         idx += 1
 
+    # a quote still open at the end runs to the end, so nothing in it (a ; in
+    # a string being typed, say) is taken for syntax. a $ that never formed a
+    # tag, like a $1 parameter, isn't a quote
+    if in_regular_quote or (in_dollar_quote and re.search(r"^\$([^\W\d]\w*)?\$$", quote)):
+        quote_positions.append((quote_open_idx, len(chars)))
+
     return quote_positions
 
 
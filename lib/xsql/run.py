@@ -1,4 +1,5 @@
 import copy
+import errno
 import functools
 import io
 import itertools
@@ -9,11 +10,10 @@ import sys
 import tempfile
 import time
 
-import lark
-from prompt_toolkit.buffer import Buffer
-from sqlalchemy import text
+from sqlalchemy import bindparam, text
 
-from .completion import clear_completions, refresh_completions
+from .catalog import DescribeObject, DescribeRows, get_catalog_source
+from .compression import CompressionError, open_compressed
 from .config import (
     config,
     process_command_with_variable,
@@ -31,16 +31,21 @@ from .config import (
     set_translate,
     set_tuples_only,
 )
-from .db import display_ssl_info, Reconnect
+from .db import display_ssl_info, Reconnect, stream_results
 from .exc import QuitException
-from .formatters import CopyWriter
-from .history import history
-from .output import get_pager, should_use_pager, write, write_csv
-from .parsers import parse_copy
+from .output import get_pager, should_use_pager, write, write_copy
+from .parallel import run_parallel_copy
 from .postgres import get_command_status
+from .progress import CountingReader, CountingWriter, get_copy_progress
 from .split import split_command
 from .time import write_time
-from .translate import translate
+from .transfer import run_transfer
+from .translate import get_translation_counts, translate
+
+
+# size of the reads and writes copy_expert does against copy sources and
+# targets, rather than its default of 8kB
+copy_buffer_size = 1024 * 1024
 
 
 def get_metacommand(command):
@@ -137,6 +142,8 @@ def run_command(conn, command, title=None, show_rowcount=True, extra_content=Non
         if command is None:
             return
 
+        query = command
+        status = None
         if isinstance(command, str):
             status = get_maybe_status(command)
             command = text(command)
@@ -155,6 +162,7 @@ def run_command(conn, command, title=None, show_rowcount=True, extra_content=Non
             title=title,
             show_rowcount=show_rowcount,
             extra_content=extra_content,
+            query=query,
         )
 
 
@@ -179,7 +187,7 @@ def run_file(conn, file):
 
         total_time = time.monotonic_ns() - start_time
 
-        output_results(conn, results, total_time, status=status)
+        output_results(conn, results, total_time, status=status, query=query)
 
 
 def get_maybe_status(command):
@@ -200,7 +208,7 @@ def get_maybe_status(command):
     return status
 
 
-def output_results(conn, results, total_time, status=None, title=None, show_rowcount=True, extra_content=None):
+def output_results(conn, results, total_time, status=None, title=None, show_rowcount=True, extra_content=None, query=None):
 
     if results.returns_rows:
         try:
@@ -233,14 +241,36 @@ def output_results(conn, results, total_time, status=None, title=None, show_rowc
         write_time(total_time)
 
         if config.autocomplete:
-            if status and re.search(r"^\s*(create|drop|alter)", status.lower()):
-                refresh_completions(conn)
+            # the statement itself, there's no status derived for alter
+            ddl = status
+            if isinstance(query, str):
+                ddl = query
+
+            if ddl and re.search(r"^\s*(create|drop|alter)\b", ddl, flags=re.I):
+                from .completion import invalidate_completions
+                invalidate_completions(conn, query)
         else:
-            clear_completions()
+            # completion (and with it prompt_toolkit and sqlglot) is only
+            # imported once something needs it, until then there's nothing
+            # to clear
+            completion = sys.modules.get(__package__ + ".completion")
+            if completion is not None:
+                completion.clear_completions()
 
 
 def build_native_copy(query, options):
-    statement = "copy (" + query + ") " + options.direction
+    from .parsers import table_target
+
+    # copy from has to name the table itself, only copy to accepts a query
+    if options.direction == "from" and options.table is not None:
+        statement = "copy " + table_target(options.table)
+
+        if options.table.columns:
+            statement += " (" + ", ".join(options.table.columns) + ")"
+
+        statement += " from"
+    else:
+        statement = "copy (" + query + ") " + options.direction
 
     if options.direction == "to":
         statement += " stdout"
@@ -297,7 +327,118 @@ def build_native_copy(query, options):
     return statement
 
 
+def open_copy_file(options, binary=False):
+
+    if options.direction == "to":
+        mode = "w"
+    else:
+        mode = "r"
+
+    if binary:
+        mode += "b"
+    else:
+        mode += "t"
+
+    level = options.compression_level
+    if level is None:
+        level = config.compression_level
+
+    try:
+        return open_compressed(
+            os.path.expanduser(options.target),
+            mode,
+            compression=options.compression,
+            level=level,
+        )
+    except CompressionError as cex:
+        sys.stderr.write("ERROR:  {}\n".format(cex))
+        sys.stderr.flush()
+        return None
+
+
+def open_copy_program(options, binary=False):
+
+    # the program's end of the pipe is handed straight to copy_expert or the
+    # row writers, so data streams through without an intermediate file and
+    # a slow consumer blocks the copy once the pipe buffer is full
+    if options.direction == "to":
+        popen_args = {"stdin": subprocess.PIPE}
+    else:
+        popen_args = {"stdout": subprocess.PIPE}
+
+    try:
+        process = subprocess.Popen(
+            options.target,
+            shell=True,
+            text=not binary,
+            **popen_args,
+        )
+    except OSError as oex:
+        sys.stderr.write(
+            'could not execute command "{}": {}\n'
+            .format(
+                options.target,
+                oex.strerror,
+            )
+        )
+        sys.stderr.flush()
+        return None
+
+    return process
+
+
+def get_copy_program_stream(process, options):
+    if options.direction == "to":
+        return process.stdin
+    else:
+        return process.stdout
+
+
+def close_copy_program(process, options, broken_pipe=False):
+
+    stream = get_copy_program_stream(process, options)
+
+    try:
+        stream.close()
+    except BrokenPipeError:
+        broken_pipe = True
+
+    returncode = process.wait()
+
+    # the program stopped reading before everything was written to it (head,
+    # say), so not everything was copied
+    if broken_pipe:
+        sys.stderr.write("could not write COPY data: {}\n".format(os.strerror(errno.EPIPE)))
+        sys.stderr.flush()
+
+    if returncode:
+        sys.stderr.write(
+            '\\copy: program "{}" failed\n'
+            .format(options.target)
+        )
+
+        if returncode < 0:
+            sys.stderr.write(
+                "child process was terminated by signal {}\n"
+                .format(-returncode)
+            )
+        else:
+            sys.stderr.write(
+                "child process exited with exit code {}\n"
+                .format(returncode)
+            )
+
+        sys.stderr.flush()
+
+        return False
+
+    return not broken_pipe
+
+
 def run_copy(conn, command):
+    import lark
+
+    from .parsers import parse_copy
 
     command = "copy " + command
 
@@ -329,39 +470,89 @@ def run_copy(conn, command):
         sys.stderr.flush()
 
         return
+    except CompressionError as cex:
+        sys.stderr.write("ERROR:  {}\n".format(cex))
+        sys.stderr.flush()
+        return
 
     total_time = None
     total_rows = None
+    broken_pipe = False
+
+    if options.target_type == "connection":
+
+        start_time = time.monotonic_ns()
+        total_rows = run_transfer(conn, query, options)
+        if total_rows is None:
+            return
+        total_time = time.monotonic_ns() - start_time
+
+    elif options.parallel is not None:
+
+        start_time = time.monotonic_ns()
+        total_rows = run_parallel_copy(conn, query, options)
+        if total_rows is None:
+            return
+        total_time = time.monotonic_ns() - start_time
 
-    if conn.dialect.name == "postgresql":
+    elif conn.dialect.name == "postgresql":
 
         statement = build_native_copy(query, options)
 
         closable = None
+        process = None
 
         try:
 
+            # copy data is passed through as bytes, it is never decoded
             if options.target_type == "file":
-                closable = open(options.target, "wt")
+                closable = open_copy_file(options, binary=True)
+                if closable is None:
+                    return
+
                 fp = closable
             elif options.target_type == "pipe":
                 if options.target == "stdout":
-                    fp = sys.stdout
+                    sys.stdout.flush()
+                    fp = sys.stdout.buffer
                 else:
-                    fp = sys.stdin
+                    fp = sys.stdin.buffer
             elif options.target_type == "program":
-                sys.stderr.write("copy program is not implemented\n")
-                sys.stderr.flush()
-                return
+                process = open_copy_program(options, binary=True)
+                if process is None:
+                    return
+
+                fp = get_copy_program_stream(process, options)
+
+            # binary copy data has no line structure to count rows from
+            count_rows = options.format_ != "binary"
 
             start_time = time.monotonic_ns()
-            with conn._dbapi_connection.cursor() as curs:
-                curs.copy_expert(statement, fp)
-                total_rows = curs.rowcount
+            try:
+                with get_copy_progress(options) as progress:
+
+                    if options.direction == "to":
+                        fp = CountingWriter(fp, progress, count_rows=count_rows)
+                    else:
+                        fp = CountingReader(fp, progress, count_rows=count_rows)
+
+                    with conn._dbapi_connection.cursor() as curs:
+                        curs.copy_expert(statement, fp, size=copy_buffer_size)
+                        total_rows = curs.rowcount
+
+                if options.target_type == "pipe" and options.target == "stdout":
+                    sys.stdout.buffer.flush()
+            except BrokenPipeError:
+                if process is None:
+                    raise
+                broken_pipe = True
             total_time = time.monotonic_ns() - start_time
         finally:
             if closable is not None:
                 closable.close()
+            if process is not None:
+                if not close_copy_program(process, options, broken_pipe):
+                    total_time = None
 
     else:
 
@@ -373,10 +564,16 @@ def run_copy(conn, command):
             sys.stderr.flush()
             return
 
+        closable = None
+        process = None
+
         try:
 
             if options.target_type == "file":
-                closable = open(options.target, "wt")
+                closable = open_copy_file(options)
+                if closable is None:
+                    return
+
                 fp = closable
             elif options.target_type == "pipe":
                 if options.target == "pstdout":
@@ -399,40 +596,13 @@ def run_copy(conn, command):
                     return
 
             elif options.target_type == "program":
-                sys.stderr.write("copy program is not implemented\n")
-                sys.stderr.flush()
-                return
-
-            if options.format_ == "text":
-                writer = CopyWriter(
-                    fp,
-                    null=(options.null or "\\N"),
-                    delimiter=(options.delimiter or "\t"),
-                )
-
-                start_time = time.monotonic_ns()
-                results = conn.execute(text(query))
-
-                total_rows = 0
-                for result in results:
-                    total_rows += 1
-                    writer.writerow(result)
+                process = open_copy_program(options)
+                if process is None:
+                    return
 
-                total_time = time.monotonic_ns() - start_time
-            elif options.format_ == "csv":
-                start_time = time.monotonic_ns()
-                results = conn.execute(text(query))
+                fp = get_copy_program_stream(process, options)
 
-                total_rows = write_csv(
-                    fp,
-                    results,
-                    results,
-                    write_header=options.header,
-                    delimiter=(options.delimiter or ","),
-                )
-
-                total_time = time.monotonic_ns() - start_time
-            else:
+            if options.format_ not in ("text", "csv"):
                 sys.stderr.write(
                     "copy format {} is not implemented\n"
                     .format(options.format_)
@@ -440,9 +610,29 @@ def run_copy(conn, command):
                 sys.stderr.flush()
                 return
 
+            start_time = time.monotonic_ns()
+            with get_copy_progress(options) as progress, stream_results(conn, query) as execution_options:
+                results = conn.execute(text(query), execution_options=execution_options)
+
+                total_rows = write_copy(
+                    CountingWriter(fp, progress, count_rows=False),
+                    results,
+                    options,
+                    progress=progress,
+                )
+
+            total_time = time.monotonic_ns() - start_time
+
+        except BrokenPipeError:
+            if process is None:
+                raise
+            broken_pipe = True
         finally:
             if closable is not None:
                 closable.close()
+            if process is not None:
+                if not close_copy_program(process, options, broken_pipe):
+                    total_time = None
 
     if total_time is not None:
         if options.target_type != "pipe":
@@ -519,8 +709,12 @@ def run_metacommand(conn, metacommand, rest):
         run_command(conn, query)
     elif metacommand == "d":
         metacommand_describe(conn, strip(rest))
+    elif metacommand == "d!":
+        metacommand_describe(conn, strip(rest), live=True)
     elif metacommand == "dt":
         metacommand_describe_tables(conn, strip(rest))
+    elif metacommand == "dt!":
+        metacommand_describe_tables(conn, strip(rest), live=True)
     elif metacommand in ("c", "connect"):
         metacommand_connect(strip(rest))
     elif metacommand == "conninfo":
@@ -585,7 +779,8 @@ def run_metacommand(conn, metacommand, rest):
                 elif rest == "off":
                     value = None
                 elif rest == "refresh":
-                    refresh_completions(conn)
+                    from .completion import refresh_completions
+                    refresh_completions(conn, force=True)
                 else:
                     handle_invalid_command_value(
                         metacommand,
@@ -619,6 +814,10 @@ def run_metacommand(conn, metacommand, rest):
         metacommand_pset(rest)
     elif metacommand == "translate":
         metacommand_translate(rest)
+    elif metacommand == "s":
+        metacommand_history(strip(rest))
+    elif metacommand == "history":
+        metacommand_search_history(strip(rest))
     else:
         handle_invalid_command(metacommand)
 
@@ -674,6 +873,8 @@ def metacommand_help():
 
     output.write("Query Buffer\n")
     output.write("  \\e [FILE]              edit the query buffer (or file) with external editor\n")
+    output.write("  \\s [FILE]              display history or save it to file\n")
+    output.write("  \\history [PATTERN]     display all of history, or the entries containing PATTERN\n")
     output.write("  \\translate [FROM] [TO] invoke translation function with query\n")
     output.write("  \\syntax [on|off]       turn syntax highlighting on or off (currently {})\n".format(syntax_display))
     output.write("  \\color [on|off]        turn color on or off (currently {})\n".format(color_display))
@@ -690,6 +891,7 @@ def metacommand_help():
     output.write("Informational\n")
     output.write("  \\d                     list tables and views\n")
     output.write("  \\d      NAME           describe table or view\n")
+    output.write("  \\d! [NAME]             as \\d, always asking the server\n")
     output.write("\n")
 
     output.write("Formatting\n")
@@ -730,332 +932,316 @@ def metacommand_help_main():
     sys.stdout.flush()
 
 
-def metacommand_describe(conn, target):
+def get_describe_rows(conn, query, objects):
+
+    if query is None:
+        return {}
+
+    describe_query = text(query).bindparams(bindparam("object_oids", expanding=True))
+
+    describe_results = conn.execute(
+        describe_query,
+        {"object_oids": [o.object_oid for o in objects]},
+    )
+
+    rows = {}
+    for describe_result in describe_results:
+        rows.setdefault(describe_result.object_oid, [])
+        rows[describe_result.object_oid].append(describe_result)
+
+    return rows
+
+
+def get_snapshot_relations(conn, target):
+
+    # completion is only imported once autocomplete is on, until then
+    # there's no catalog to look in
+    completion = sys.modules.get(__package__ + ".completion")
+    if completion is None or not get_catalog_source(conn).snapshot_lookups:
+        return None
+
+    return completion.find_relations(conn, target)
+
+
+def metacommand_describe(conn, target, live=False):
     if not target:
-        metacommand_describe_tables(conn, target)
+        metacommand_describe_tables(conn, target, live=live)
     else:
 
         filter_target = glob_to_like(target)
 
-        objects = []
+        source = get_catalog_source(conn)
 
-        if conn.dialect.name == "sqlite":
+        relations = None
+        if not live:
+            relations = get_snapshot_relations(conn, filter_target)
 
-            object_query = """
-            select
-                't' as object_type,
-                null as object_schema,
-                sqlite_master.tbl_name as object_name
-            from
-                sqlite_master
-            where
-                sqlite_master.tbl_name like :filter_target
-            order by
-                sqlite_master.tbl_name
-            """
+        if relations is not None:
+            objects = [
+                DescribeObject("t", schema_name, table_name, oid)
+                for schema_name, table_name, _, _, oid in relations
+            ]
+        else:
+            objects = source.get_objects(conn, filter_target)
 
-            object_results = conn.execute(text(object_query).bindparams(filter_target=filter_target))
+        if not objects:
+            return
 
-            for object_result in object_results:
-                objects.append(object_result)
+        # every section is read for all the objects at once and keyed by
+        # object, so the number of round trips doesn't grow with the number
+        # of objects matched
 
-            table_query = """
-            select
-                info.name as "Column",
-                info."type" as "Type",
-                '' as "Collation",
-                case
-                    when info."notnull" is distinct from 0 then 'not null'
-                    else ''
-                end as "Nullable",
-                info.dflt_value as "Default"
-            from
-                sqlite_master,
-                pragma_table_info(sqlite_master.tbl_name) as info
-            where
-                null is not distinct from :object_schema
-                and sqlite_master.tbl_name = :object_name
-            order by
-                info.cid
-            """
+        if conn.dialect.name == "postgresql":
 
-            index_query = None
-        else:
+            conperiod = "false AS conperiod"
+            if conn.dialect.server_version_info[0] >= 18:
+                conperiod = "pg_catalog.pg_constraint.conperiod"
 
-            object_query = """
+            index_query = """
             select
-                't' as object_type,
-                information_schema.tables.table_schema as object_schema,
-                information_schema.tables.table_name as object_name
+                pg_catalog.pg_class.oid as object_oid,
+                pg_catalog.pg_namespace.nspname,
+                pg_catalog.pg_class.relname,
+                index_class.relname as index_name,
+                pg_catalog.pg_index.indisprimary,
+                pg_catalog.pg_index.indisunique,
+                pg_catalog.pg_index.indisclustered,
+                pg_catalog.pg_index.indisvalid,
+                pg_catalog.pg_get_indexdef(pg_catalog.pg_index.indexrelid, 0, true) as indexdef,
+                pg_catalog.pg_get_constraintdef(pg_catalog.pg_constraint.oid, true) as constraintdef,
+                pg_catalog.pg_index.indisreplident,
+                pg_catalog.pg_constraint.contype,
+                pg_catalog.pg_constraint.condeferrable,
+                pg_catalog.pg_constraint.condeferred,
+                {conperiod}
             from
-                information_schema.tables
+                pg_catalog.pg_class
+            join
+                pg_catalog.pg_namespace
+            on
+                pg_catalog.pg_class.relnamespace = pg_catalog.pg_namespace.oid
+            join
+                pg_catalog.pg_index
+            on
+                pg_catalog.pg_class.oid = pg_catalog.pg_index.indrelid
+            join
+                pg_catalog.pg_class as index_class
+            on
+                pg_catalog.pg_index.indexrelid = index_class.oid
+            left join
+                pg_catalog.pg_constraint
+            on
+                pg_catalog.pg_constraint.conrelid = pg_catalog.pg_index.indrelid
+                and pg_catalog.pg_constraint.conindid = pg_catalog.pg_index.indexrelid
+                and pg_catalog.pg_constraint.contype in ('p', 'u', 'x')
             where
-                :filter_target is null
-                or (information_schema.tables.table_schema || '.' || information_schema.tables.table_name) ilike :filter_target
-                or information_schema.tables.table_name ilike :filter_target
+                pg_catalog.pg_class.oid in :object_oids
             order by
-                information_schema.tables.table_schema,
-                information_schema.tables.table_name
-            """
-
-            object_results = conn.execute(text(object_query).bindparams(filter_target=filter_target))
-
-            for object_result in object_results:
-                objects.append(object_result)
+                pg_catalog.pg_index.indisprimary desc,
+                index_class.relname
+            """.format(conperiod=conperiod)
+        else:
+            index_query = None
 
-            table_query = """
+        if conn.dialect.name == "postgresql":
+            check_query = """
             select
-                information_schema.columns.column_name as "Column",
-                information_schema.columns.data_type as "Type",
-                coalesce(information_schema.columns.collation_name, '') as "Collation",
-                case
-                    when information_schema.columns.is_nullable = 'NO' then 'not null'
-                    else ''
-                end as "Nullable",
-                coalesce(information_schema.columns.column_default, '') as "Default"
+                pg_catalog.pg_constraint.conrelid as object_oid,
+                pg_catalog.pg_constraint.conname as constraint_name,
+                pg_catalog.pg_get_constraintdef(pg_catalog.pg_constraint.oid, true) as constraintdef
             from
-                information_schema.columns
+                pg_catalog.pg_constraint
             where
-                information_schema.columns.table_schema = :object_schema
-                and information_schema.columns.table_name = :object_name
+                pg_catalog.pg_constraint.conrelid in :object_oids
+                and pg_catalog.pg_constraint.contype = 'c'
             order by
-                information_schema.columns.ordinal_position
+                pg_catalog.pg_constraint.conname
             """
+        else:
+            check_query = None
 
-            if conn.dialect.name == "postgresql":
-
-                conperiod = "false AS conperiod"
-                if conn.dialect.server_version_info[0] >= 18:
-                    conperiod = "pg_catalog.pg_constraint.conperiod"
-
-                index_query = """
+        if conn.dialect.name == "postgresql":
+            if conn.dialect.server_version_info[0] >= 12:
+                references_query = """
                 select
-                    pg_catalog.pg_namespace.nspname,
-                    pg_catalog.pg_class.relname,
-                    index_class.relname as index_name,
-                    pg_catalog.pg_index.indisprimary,
-                    pg_catalog.pg_index.indisunique,
-                    pg_catalog.pg_index.indisclustered,
-                    pg_catalog.pg_index.indisvalid,
-                    pg_catalog.pg_get_indexdef(pg_catalog.pg_index.indexrelid, 0, true) as indexdef,
+                    objects.oid as object_oid,
+                    pg_catalog.pg_constraint.conrelid = objects.oid as sametable,
+                    pg_catalog.pg_constraint.conname as constraint_name,
                     pg_catalog.pg_get_constraintdef(pg_catalog.pg_constraint.oid, true) as constraintdef,
-                    pg_catalog.pg_index.indisreplident,
-                    pg_catalog.pg_constraint.contype,
-                    pg_catalog.pg_constraint.condeferrable,
-                    pg_catalog.pg_constraint.condeferred,
-                    {conperiod}
+                    pg_catalog.pg_constraint.conrelid::pg_catalog.regclass as ontable
                 from
-                    pg_catalog.pg_class
-                join
-                    pg_catalog.pg_namespace
-                on
-                    pg_catalog.pg_class.relnamespace = pg_catalog.pg_namespace.oid
-                join
-                    pg_catalog.pg_index
-                on
-                    pg_catalog.pg_class.oid = pg_catalog.pg_index.indrelid
+                    pg_catalog.pg_class as objects
                 join
-                    pg_catalog.pg_class as index_class
-                on
-                    pg_catalog.pg_index.indexrelid = index_class.oid
-                left join
                     pg_catalog.pg_constraint
                 on
-                    pg_catalog.pg_constraint.conrelid = pg_catalog.pg_index.indrelid
-                    and pg_catalog.pg_constraint.conindid = pg_catalog.pg_index.indexrelid
-                    and pg_catalog.pg_constraint.contype in ('p', 'u', 'x')
+                    pg_catalog.pg_constraint.conrelid in (
+                        select
+                            ancestors.relid
+                        from
+                            pg_catalog.pg_partition_ancestors(objects.oid) as ancestors
+                        union all
+                        select
+                            objects.oid
+                    )
                 where
-                    pg_catalog.pg_namespace.nspname = :object_schema
-                    and pg_catalog.pg_class.relname = :object_name
+                    objects.oid in :object_oids
+                    and pg_catalog.pg_constraint.contype = 'f'
+                    and pg_catalog.pg_constraint.conparentid = 0
                 order by
-                    pg_catalog.pg_index.indisprimary desc,
-                    index_class.relname
-                """.format(conperiod=conperiod)
+                    sametable desc,
+                    pg_catalog.pg_constraint.conname
+                """
             else:
-                index_query = None
+                references_query = """
+                select
+                    pg_catalog.pg_constraint.conrelid as object_oid,
+                    true as sametable,
+                    pg_catalog.pg_constraint.conname as constraint_name,
+                    pg_catalog.pg_get_constraintdef(pg_catalog.pg_constraint.oid, true) as constraintdef,
+                    pg_catalog.pg_constraint.conrelid::pg_catalog.regclass as ontable
+                from
+                    pg_catalog.pg_constraint
+                where
+                    pg_catalog.pg_constraint.contype = 'f'
+                    and pg_catalog.pg_constraint.conrelid in :object_oids
+                order by
+                    sametable desc,
+                    pg_catalog.pg_constraint.conname
+                """
+        else:
+            references_query = None
 
-            if conn.dialect.name == "postgresql":
-                check_query = """
+        if conn.dialect.name == "postgresql":
+            if conn.dialect.server_version_info[0] >= 12:
+                foreign_key_query = """
                 select
+                    objects.oid as object_oid,
                     pg_catalog.pg_constraint.conname as constraint_name,
+                    pg_catalog.pg_constraint.conrelid::pg_catalog.regclass as ontable,
                     pg_catalog.pg_get_constraintdef(pg_catalog.pg_constraint.oid, true) as constraintdef
                 from
-                    pg_catalog.pg_constraint
+                    pg_catalog.pg_class as objects
                 join
-                    pg_catalog.pg_class
-                on
-                    pg_catalog.pg_class.oid = pg_catalog.pg_constraint.conrelid
-                join
-                    pg_catalog.pg_namespace
+                    pg_catalog.pg_constraint
                 on
-                    pg_catalog.pg_class.relnamespace = pg_catalog.pg_namespace.oid
+                    pg_catalog.pg_constraint.confrelid in (
+                        select
+                            ancestors.relid
+                        from
+                            pg_catalog.pg_partition_ancestors(objects.oid) as ancestors
+                        union all
+                        select
+                            objects.oid
+                    )
                 where
-                    pg_catalog.pg_namespace.nspname = :object_schema
-                    and pg_catalog.pg_class.relname = :object_name
-                    and pg_catalog.pg_constraint.contype = 'c'
+                    objects.oid in :object_oids
+                    and pg_catalog.pg_constraint.contype = 'f'
+                    and pg_catalog.pg_constraint.conparentid = 0
                 order by
-                    1
+                    pg_catalog.pg_constraint.conname
                 """
             else:
-                check_query = None
+                foreign_key_query = """
+                select
+                    confrelid as object_oid,
+                    conname as constraint_name,
+                    conrelid::pg_catalog.regclass as ontable,
+                    pg_catalog.pg_get_constraintdef(oid, true) as constraintdef
+                from
+                    pg_catalog.pg_constraint
+                where
+                    pg_catalog.pg_constraint.confrelid in :object_oids
+                    and pg_catalog.pg_constraint.contype = 'f'
+                order by
+                    pg_catalog.pg_constraint.conname
+                """
+        else:
+            foreign_key_query = None
 
-            if conn.dialect.name == "postgresql":
-                if conn.dialect.server_version_info[0] >= 12:
-                    references_query = """
-                    select
-                        pg_catalog.pg_constraint.conrelid = (:object_schema || '.' || :object_name)::pg_catalog.regclass as sametable,
-                        pg_catalog.pg_constraint.conname as constraint_name,
-                        pg_catalog.pg_get_constraintdef(pg_catalog.pg_constraint.oid, true) as constraintdef,
-                        pg_catalog.pg_constraint.conrelid::pg_catalog.regclass as ontable
-                    from
-                        pg_catalog.pg_constraint
-                    left join (
-                        select
-                            *
-                        from
-                            pg_catalog.pg_partition_ancestors((:object_schema || '.' || :object_name)::pg_catalog.regclass)
-                    ) as ancestors
-                    on
-                        pg_catalog.pg_constraint.conrelid = ancestors.relid
-                    where
-                        pg_catalog.pg_constraint.contype = 'f'
-                        and pg_catalog.pg_constraint.conparentid = 0
-                        and (
-                            pg_catalog.pg_constraint.conrelid = (:object_schema || '.' || :object_name)::pg_catalog.regclass
-                            or ancestors.relid = pg_catalog.pg_constraint.conrelid
-                        )
-                    order by
-                        sametable desc,
-                        pg_catalog.pg_constraint.conname
-                    """
-                else:
-                    references_query = """
-                    select
-                        pg_catalog.pg_constraint.conrelid = (:object_schema || '.' || :object_name)::pg_catalog.regclass as sametable,
-                        pg_catalog.pg_constraint.conname as constraint_name,
-                        pg_catalog.pg_get_constraintdef(pg_catalog.pg_constraint.oid, true) as constraintdef,
-                        pg_catalog.pg_constraint.conrelid::pg_catalog.regclass as ontable
-                    from
-                        pg_catalog.pg_constraint
-                    where
-                        pg_catalog.pg_constraint.contype = 'f'
-                        and pg_catalog.pg_constraint.conrelid = (:object_schema || '.' || :object_name)::pg_catalog.regclass
-                    order by
-                        sametable desc,
-                        pg_catalog.pg_constraint.conname
-                    """
-            else:
-                references_query = None
+        if conn.dialect.name == "postgresql":
 
-            if conn.dialect.name == "postgresql":
-                if conn.dialect.server_version_info[0] >= 12:
-                    foreign_key_query = """
-                    select
-                        pg_catalog.pg_constraint.conname as constraint_name,
-                        pg_catalog.pg_constraint.conrelid::pg_catalog.regclass as ontable,
-                        pg_catalog.pg_get_constraintdef(oid, true) as constraintdef
-                    from
-                        pg_catalog.pg_constraint
-                    where
-                        pg_catalog.pg_constraint.confrelid in (
-                            select
-                                pg_catalog.pg_partition_ancestors((:object_schema || '.' || :object_name)::pg_catalog.regclass)
-                            union all
-                            values
-                                ((:object_schema || '.' || :object_name)::pg_catalog.regclass)
-                        )
-                        and pg_catalog.pg_constraint.contype = 'f'
-                        and pg_catalog.pg_constraint.conparentid = 0
-                    order by
-                        pg_catalog.pg_constraint.conname
-                    """
-                else:
-                    foreign_key_query = """
+            trigger_parent = "null as parent"
+            if conn.dialect.server_version_info[0] >= 13:
+                trigger_parent = """
+                case when pg_catalog.pg_trigger.tgparentid != 0 then (
                     select
-                        conname as constraint_name,
-                        conrelid::pg_catalog.regclass as ontable,
-                        pg_catalog.pg_get_constraintdef(oid, true) as constraintdef
+                        pg_catalog.pg_trigger.tgrelid::pg_catalog.regclass
                     from
-                        pg_catalog.pg_constraint
+                        pg_catalog.pg_trigger,
+                        pg_catalog.pg_partition_ancestors(pg_catalog.pg_trigger.tgrelid) with ordinality as ancestors (relid, depth)
                     where
-                        pg_catalog.pg_constraint.confrelid = (:object_schema || '.' || :object_name)::pg_catalog.regclass
-                        and pg_catalog.pg_constraint.contype = 'f'
+                        pg_catalog.pg_trigger.tgname = pg_catalog.pg_trigger.tgname
+                        and pg_catalog.pg_trigger.tgrelid = ancestors.relid
+                        and pg_catalog.pg_trigger.tgparentid = 0
                     order by
-                        pg_catalog.pg_constraint.conname
-                    """
-            else:
-                foreign_key_query = None
+                        ancestors.depth
+                    limit
+                        1
+                ) end as parent
+                """
 
-            if conn.dialect.name == "postgresql":
+            trigger_query = """
+            select
+                pg_catalog.pg_trigger.tgrelid as object_oid,
+                pg_catalog.pg_trigger.tgname as trigger_name,
+                pg_catalog.pg_get_triggerdef(pg_catalog.pg_trigger.oid, true) as triggerdef,
+                pg_catalog.pg_trigger.tgenabled,
+                pg_catalog.pg_trigger.tgisinternal,
+                {trigger_parent}
+            from
+                pg_catalog.pg_trigger
+            where
+                pg_catalog.pg_trigger.tgrelid in :object_oids
+            """.format(trigger_parent=trigger_parent)
 
-                trigger_parent = "null as parent"
-                if conn.dialect.server_version_info[0] >= 13:
-                    trigger_parent = """
-                    case when pg_catalog.pg_trigger.tgparentid != 0 then (
+            if conn.dialect.server_version_info[0] >= 11 and conn.dialect.server_version_info[0] < 15:
+                trigger_query += """
+                and (
+                    not pg_catalog.pg_trigger.tgisinternal
+                    or (
+                        pg_catalog.pg_trigger.tgisinternal
+                        and pg_catalog.pg_trigger.tgenabled = 'D'
+                    )
+                    or exists (
                         select
-                            pg_catalog.pg_trigger.tgrelid::pg_catalog.regclass
+                            1
                         from
-                            pg_catalog.pg_trigger,
-                            pg_catalog.pg_partition_ancestors(pg_catalog.pg_trigger.tgrelid) with ordinality as ancestors (relid, depth)
+                            pg_catalog.pg_depend
                         where
-                            pg_catalog.pg_trigger.tgname = pg_catalog.pg_trigger.tgname
-                            and pg_catalog.pg_trigger.tgrelid = ancestors.relid
-                            and pg_catalog.pg_trigger.tgparentid = 0
-                        order by
-                            ancestors.depth
-                        limit
-                            1
-                    ) end as parent
-                    """
-
-                trigger_query = """
-                select
-                    pg_catalog.pg_trigger.tgname as trigger_name,
-                    pg_catalog.pg_get_triggerdef(pg_catalog.pg_trigger.oid, true) as triggerdef,
-                    pg_catalog.pg_trigger.tgenabled,
-                    pg_catalog.pg_trigger.tgisinternal,
-                    {trigger_parent}
-                from
-                    pg_catalog.pg_trigger
-                where
-                    pg_catalog.pg_trigger.tgrelid = (:object_schema || '.' || :object_name)::pg_catalog.regclass
-                """.format(trigger_parent=trigger_parent)
-
-                if conn.dialect.server_version_info[0] >= 11 and conn.dialect.server_version_info[0] < 15:
-                    trigger_query += """
-                    and (
-                        not pg_catalog.pg_trigger.tgisinternal
-                        or (
-                            pg_catalog.pg_trigger.tgisinternal
-                            and pg_catalog.pg_trigger.tgenabled = 'D'
-                        )
-                        or exists (
-                            select
-                                1
-                            from
-                                pg_catalog.pg_depend
-                            where
-                                pg_catalog.pg_depend.objid = pg_catalog.pg_trigger.oid
-                                and pg_catalog.pg_depend.refclassid = 'pg_catalog.pg_trigger'::pg_catalog.regclass
-                        )
-                    )
-                    """
-                else:
-                    trigger_query += """
-                    and (
-                        not pg_catalog.pg_trigger.tgisinternal
-                        or (
-                            pg_catalog.pg_trigger.tgisinternal
-                            and pg_catalog.pg_trigger.tgenabled = 'D'
-                        )
+                            pg_catalog.pg_depend.objid = pg_catalog.pg_trigger.oid
+                            and pg_catalog.pg_depend.refclassid = 'pg_catalog.pg_trigger'::pg_catalog.regclass
                     )
-                    """
-
-                trigger_query += """
-                order by 1;
+                )
                 """
             else:
-                trigger_query = None
+                trigger_query += """
+                and (
+                    not pg_catalog.pg_trigger.tgisinternal
+                    or (
+                        pg_catalog.pg_trigger.tgisinternal
+                        and pg_catalog.pg_trigger.tgenabled = 'D'
+                    )
+                )
+                """
+
+            trigger_query += """
+            order by
+                pg_catalog.pg_trigger.tgname
+            """
+        else:
+            trigger_query = None
+
+        start_time = time.monotonic_ns()
+
+        keys, columns = source.get_describe_columns(conn, objects)
+
+        index_rows = get_describe_rows(conn, index_query, objects)
+        check_rows = get_describe_rows(conn, check_query, objects)
+        references_rows = get_describe_rows(conn, references_query, objects)
+        foreign_key_rows = get_describe_rows(conn, foreign_key_query, objects)
+        trigger_rows = get_describe_rows(conn, trigger_query, objects)
+
+        total_time = time.monotonic_ns() - start_time
 
         for object_result in objects:
 
@@ -1070,12 +1256,6 @@ def metacommand_describe(conn, target):
                         object_result.object_name,
                     )
 
-            params = {
-                "object_schema": object_result.object_schema,
-                "object_name": object_result.object_name,
-            }
-            query = text(table_query).bindparams(**params)
-
             extra_content = None
 
             if object_result.object_type == "t":
@@ -1084,7 +1264,7 @@ def metacommand_describe(conn, target):
                     if extra_content is None:
                         extra_content = io.StringIO()
 
-                    index_results = conn.execute(text(index_query).bindparams(**params))
+                    index_results = index_rows.get(object_result.object_oid, [])
 
                     write_index_header = True
 
@@ -1133,7 +1313,7 @@ def metacommand_describe(conn, target):
                     if extra_content is None:
                         extra_content = io.StringIO()
 
-                    check_results = conn.execute(text(check_query).bindparams(**params))
+                    check_results = check_rows.get(object_result.object_oid, [])
 
                     write_check_header = True
 
@@ -1152,7 +1332,7 @@ def metacommand_describe(conn, target):
                     if extra_content is None:
                         extra_content = io.StringIO()
 
-                    references_results = conn.execute(text(references_query).bindparams(**params))
+                    references_results = references_rows.get(object_result.object_oid, [])
 
                     write_references_header = True
 
@@ -1177,7 +1357,7 @@ def metacommand_describe(conn, target):
                     if extra_content is None:
                         extra_content = io.StringIO()
 
-                    foreign_key_results = conn.execute(text(foreign_key_query).bindparams(**params))
+                    foreign_key_results = foreign_key_rows.get(object_result.object_oid, [])
 
                     write_foreign_key_header = True
 
@@ -1199,7 +1379,7 @@ def metacommand_describe(conn, target):
                     if extra_content is None:
                         extra_content = io.StringIO()
 
-                    trigger_results = conn.execute(text(trigger_query).bindparams(**params))
+                    trigger_results = trigger_rows.get(object_result.object_oid, [])
 
                     sections = {
                         "triggers": "Triggers",
@@ -1250,61 +1430,57 @@ def metacommand_describe(conn, target):
             if extra_content is not None:
                 extra_content.seek(0)
 
-            run_command(
-                conn,
-                query,
-                title=title,
-                show_rowcount=False,
-                extra_content=extra_content,
+            describe_rows = DescribeRows(
+                keys,
+                columns.get(source.get_object_key(object_result), []),
             )
 
+            try:
+                write(
+                    describe_rows,
+                    title=title,
+                    show_rowcount=False,
+                    extra_content=extra_content,
+                    total_time=total_time,
+                )
+            except BrokenPipeError:
+                pass
+
+            # the time spent reading is shown once, with the first object
+            total_time = 0
 
-def metacommand_describe_tables(conn, target):
+
+def metacommand_describe_tables(conn, target, live=False):
 
     if not target:
         target = None
 
     target = glob_to_like(target)
 
-    if conn.dialect.name == "sqlite":
-        query = """
-        select
-            'sqlite' as "Schema",
-            tbl_name as "Name",
-            "type" as "Type",
-            null as "Owner"
-        from
-            sqlite_master
-        where
-            :target is null
-            or ('sqlite.' || tbl_name) like :target
-            or tbl_name like :target
-        order by
-            tbl_name
-        """
-    else:
-        query = """
-        select
-            information_schema.tables.table_schema as "Schema",
-            information_schema.tables.table_name as "Name",
-            case
-                when information_schema.tables.table_type = 'BASE TABLE' then 'table'
-                when information_schema.tables.table_type = 'VIEW' then 'view'
-                else 'other'
-            end as "Type",
-            null::text as "Owner"
-        from
-            information_schema.tables
-        where
-            :target is null
-            or (information_schema.tables.table_schema || '.' || information_schema.tables.table_name) ilike :target
-            or information_schema.tables.table_name ilike :target
-        order by
-            information_schema.tables.table_schema,
-            information_schema.tables.table_name
-        """
-
-    query = text(query).bindparams(target=target)
+    if not live:
+        start_time = time.monotonic_ns()
+
+        relations = get_snapshot_relations(conn, target)
+
+        if relations is not None:
+            relation_rows = DescribeRows(
+                ["Schema", "Name", "Type", "Owner"],
+                [relation[:4] for relation in relations],
+            )
+
+            try:
+                write(
+                    relation_rows,
+                    title="List of relations",
+                    show_rowcount=True,
+                    total_time=time.monotonic_ns() - start_time,
+                )
+            except BrokenPipeError:
+                pass
+
+            return
+
+    query = get_catalog_source(conn).get_relations_query(conn, target)
 
     run_command(conn, query, title="List of relations")
 
@@ -1317,6 +1493,11 @@ def metacommand_set(target):
         values["prompt2"] = config.prompt2
         values["histsize"] = config.history_size
         values["verbosity"] = config.verbosity
+        values["compression_level"] = config.compression_level
+        values["progress"] = config.progress
+        values["format_processes"] = config.format_processes
+        values["completion_match"] = config.completion_match
+        values["completion_limit"] = config.completion_limit
         names = sorted(list(values.keys()))
 
         for name in names:
@@ -1375,24 +1556,83 @@ def metacommand_translate(target):
                     config.translate_to,
                 )
             )
+
+            hits, misses = get_translation_counts()
+            sys.stdout.write("Translation cache: {} hits, {} misses.\n".format(hits, misses))
         sys.stdout.flush()
     else:
         from_, to = process_command_with_variable(None, target)
         set_translate(from_, to)
 
 
+def metacommand_history(filename):
+    from .history import history
+
+    # the entries loaded into the prompt, as psql shows its readline history
+    entries = list(history.load_history_strings())
+
+    if not filename:
+        write_history(entries)
+        return
+
+    try:
+        with open(os.path.expanduser(filename), "wt") as fp:
+            for entry in reversed(entries):
+                fp.write(entry)
+                fp.write("\n")
+    except OSError as ex:
+        sys.stderr.write('could not save history to file "{}": {}\n'.format(filename, ex.strerror))
+        sys.stderr.flush()
+        return
+
+    if not config.quiet:
+        sys.stdout.write('Wrote history to file "{}".\n'.format(filename))
+        sys.stdout.flush()
+
+
+def metacommand_search_history(pattern):
+    from .history import history
+
+    # unlike \s (and ctrl-r), goes back past the histsize entries the prompt
+    # loads
+    if pattern:
+        entries = history.search(pattern)
+    else:
+        entries = history.get_all_strings()
+
+    write_history(entries)
+
+
+def write_history(entries):
+
+    pager = None
+    if should_use_pager():
+        pager, output = get_pager()
+    else:
+        output = sys.stdout
+
+    # oldest first, like psql, so the most recent entry is nearest the prompt
+    for entry in reversed(entries):
+        output.write(entry)
+        output.write("\n")
+
+    output.flush()
+
+    if pager is not None:
+        pager.communicate()
+
+
 def run_editor(text):
+    from prompt_toolkit.buffer import Buffer
+
+    from .history import history
+
     filename = None
     add_to_history = False
 
     if not text:
         add_to_history = True
-        for entry in history.load_history_strings():
-            if entry.strip().startswith("\\e"):
-                continue
-
-            text = entry
-            break
+        text = history.last_string(skip_prefix="\\e") or ""
     else:
         filename = text
 
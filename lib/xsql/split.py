@@ -47,3 +47,26 @@ def split_command(data, dialect):
         parts.append(buffer)
 
     return parts
+
+
+def get_statement_start(data, dialect):
+
+    allow_dollar_quoting = False
+    if dialect in ("postgresql", "redshift"):
+        allow_dollar_quoting = True
+
+    quote_positions = get_quote_positions(
+        data,
+        allow_dollar_quoting=allow_dollar_quoting,
+    )
+
+    # just past the last ; outside a quote, where whatever is being typed
+    # at the end of data starts
+    idx = data.rfind(";")
+    while idx >= 0:
+        if not is_in_quote(quote_positions, idx):
+            return idx + 1
+
+        idx = data.rfind(";", 0, idx)
+
+    return 0
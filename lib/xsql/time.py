@@ -2,7 +2,7 @@ import sys
 from decimal import Decimal
 
 
-def write_time(total_time):
+def format_time(total_time):
     formatted_ms = "{:.3f}".format(Decimal(total_time) / Decimal("1000000"))
 
     if "." in formatted_ms:
@@ -16,4 +16,8 @@ def write_time(total_time):
 
     formatted_ms = left + "." + right
 
-    sys.stdout.write("Time: {} ms\n".format(formatted_ms))
+    return "{} ms".format(formatted_ms)
+
+
+def write_time(total_time):
+    sys.stdout.write("Time: {}\n".format(format_time(total_time)))
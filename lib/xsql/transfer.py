@@ -0,0 +1,289 @@
+import queue
+import sys
+import threading
+
+from sqlalchemy import text
+from sqlalchemy.pool import NullPool
+
+from .db import make_engine, resolve_url, stream_results
+from .formatters import format_copy_rows
+from .parallel import (
+    barrier_timeout,
+    begin_partitions,
+    begin_snapshot,
+    ParallelCopyError,
+    run_in_workers,
+    Workers,
+)
+from .pipeline import fetch_batches
+from .progress import Progress
+
+# row batches allowed in flight between the source and the destination, once
+# full fetching waits for the destination to catch up
+queue_size = 4
+
+# put on the queue instead of the end marker when the source failed, so the
+# destination rolls back rather than committing a partial copy
+aborted = object()
+
+
+class TransferError(Exception):
+    pass
+
+
+def make_destination_engine(alias):
+
+    _, url = resolve_url(alias)
+
+    if url is None:
+        raise TransferError('connection "{}" not found'.format(alias))
+
+    return make_engine(url, poolclass=NullPool)
+
+
+def quote_columns(destination, columns):
+    quote = destination.dialect.identifier_preparer.quote
+    return ", ".join(quote(column) for column in columns)
+
+
+class BatchReader:
+
+    def __init__(self, get_batch, progress):
+        self.get_batch = get_batch
+        self.progress = progress
+        self._buffer = b""
+        self._position = 0
+        self._eof = False
+
+    def _fill(self):
+        batch = self.get_batch()
+        if batch is None:
+            self._eof = True
+            return False
+
+        self._buffer = format_copy_rows(batch).encode("utf-8")
+        self._position = 0
+
+        self.progress.add(rows=len(batch), bytes_=len(self._buffer))
+
+        return True
+
+    def read(self, size=-1):
+        while self._position >= len(self._buffer):
+            if self._eof or not self._fill():
+                return b""
+
+        if size is None or size < 0:
+            size = len(self._buffer)
+
+        data = self._buffer[self._position:self._position + size]
+        self._position += len(data)
+
+        return data
+
+
+class Transfer:
+
+    def __init__(self, engine, table, columns, progress, barrier=None):
+        self.engine = engine
+        self.table = table
+        self.columns = columns
+        self.progress = progress
+        self.barrier = barrier
+        self.rows = None
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._finished = False
+        self._error = None
+
+    def _get(self):
+        item = self._queue.get()
+
+        if item is None:
+            self._finished = True
+        elif item is aborted:
+            self._finished = True
+            raise TransferError("copy aborted, the source query failed")
+
+        return item
+
+    def _copy(self, destination):
+        from .run import copy_buffer_size
+
+        statement = "copy {} ({}) from stdin".format(
+            self.table,
+            quote_columns(destination, self.columns),
+        )
+
+        with destination.connection.dbapi_connection.cursor() as curs:
+            curs.copy_expert(statement, BatchReader(self._get, self.progress), size=copy_buffer_size)
+            return curs.rowcount
+
+    def _insert(self, destination):
+
+        statement = text(
+            "insert into {} ({}) values ({})"
+            .format(
+                self.table,
+                quote_columns(destination, self.columns),
+                ", ".join(":p{}".format(index) for index in range(len(self.columns))),
+            )
+        )
+
+        keys = ["p{}".format(index) for index in range(len(self.columns))]
+
+        rows = 0
+
+        while True:
+            batch = self._get()
+            if batch is None:
+                return rows
+
+            destination.execute(statement, [dict(zip(keys, row)) for row in batch])
+
+            rows += len(batch)
+            self.progress.add(rows=len(batch))
+
+    def _load(self):
+        try:
+            # the destination connection is opened on this thread, some
+            # drivers don't allow a connection to be used from any other
+            destination = self.engine.connect()
+
+            try:
+                transaction = destination.begin()
+
+                try:
+                    if destination.dialect.name == "postgresql":
+                        self.rows = self._copy(destination)
+                    else:
+                        self.rows = self._insert(destination)
+
+                    if self.barrier is not None:
+                        self.barrier.wait()
+
+                    transaction.commit()
+                except BaseException:
+                    if self.barrier is not None:
+                        self.barrier.abort()
+
+                    transaction.rollback()
+                    raise
+            finally:
+                destination.close()
+        except Exception as ex:
+            # connecting and beginning included, the other partitions would
+            # otherwise wait on this one until the timeout
+            if self.barrier is not None:
+                self.barrier.abort()
+
+            self._error = ex
+            self._stop.set()
+
+            # keep draining so the fetching side never blocks on a full queue
+            while not self._finished:
+                item = self._queue.get()
+                if item is None or item is aborted:
+                    self._finished = True
+
+    def run(self, results):
+
+        thread = threading.Thread(target=self._load, daemon=True)
+        thread.start()
+
+        end = aborted
+
+        try:
+            for batch in fetch_batches(results):
+                if self._stop.is_set():
+                    break
+
+                self._queue.put(batch)
+
+            end = None
+        finally:
+            self._queue.put(end)
+            thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+        return self.rows
+
+
+def run_transfer_partitions(conn, engine, query, options, progress):
+
+    workers = Workers(conn)
+
+    try:
+        _, snapshot, partitions = begin_partitions(conn, workers, query, options)
+
+        # with single_transaction every partition waits for the others to
+        # finish before committing, and any failure rolls all of them back
+        barrier = None
+        if options.single_transaction:
+            barrier = threading.Barrier(len(partitions), timeout=barrier_timeout)
+
+        def transfer_partition(partition):
+            try:
+                worker_conn = workers.connect()
+
+                if snapshot is not None:
+                    worker_conn = begin_snapshot(worker_conn, snapshot)
+
+                results = worker_conn.execute(
+                    text(partition.query),
+                    execution_options={"stream_results": True},
+                )
+            except BaseException:
+                # the other partitions would otherwise wait on this one
+                # forever before committing
+                if barrier is not None:
+                    barrier.abort()
+                raise
+
+            transfer = Transfer(
+                engine,
+                options.destination_table,
+                list(results.keys()),
+                progress,
+                barrier=barrier,
+            )
+
+            partition.rows = transfer.run(results)
+
+        run_in_workers(workers, transfer_partition, partitions)
+    finally:
+        workers.close()
+
+    return sum(partition.rows for partition in partitions)
+
+
+def run_transfer(conn, query, options):
+
+    try:
+        engine = make_destination_engine(options.target)
+
+        try:
+            with Progress("COPY") as progress:
+
+                if options.parallel is not None:
+                    return run_transfer_partitions(conn, engine, query, options, progress)
+
+                with stream_results(conn, query) as execution_options:
+                    results = conn.execute(text(query), execution_options=execution_options)
+
+                    transfer = Transfer(
+                        engine,
+                        options.destination_table,
+                        list(results.keys()),
+                        progress,
+                    )
+
+                    return transfer.run(results)
+        finally:
+            engine.dispose()
+    except (TransferError, ParallelCopyError) as tex:
+        sys.stderr.write("ERROR:  {}\n".format(tex))
+        sys.stderr.flush()
+        return None
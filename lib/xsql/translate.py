@@ -1,3 +1,4 @@
+import collections
 import importlib
 import os
 import subprocess
@@ -5,6 +6,18 @@ import sys
 
 from .config import config
 
+# the translate.py module, imported again only once the file changes, and
+# the file (translate.py or the translate script) with its mtime at the time
+translator = None
+translator_key = None
+
+# translations by (from, to, options, query), least recently used first.
+# emptied whenever the translator changes
+translation_cache = collections.OrderedDict()
+translation_cache_size = 1000
+translation_hits = 0
+translation_misses = 0
+
 
 def translate(conn, query, from_=None, to=None):
 
@@ -31,86 +44,155 @@ def translate(conn, query, from_=None, to=None):
     translate_py = os.path.join(translate_dir, "translate.py")
     translate_script = os.path.join(translate_dir, "translate")
 
-    if os.path.exists(translate_py):
-        if translate_dir not in sys.path:
-            sys.path.append(translate_dir)
+    options = config.variables.get("translate_options")
 
+    if os.path.exists(translate_py):
         try:
-            try:
-                sys.path.insert(0, translate_dir)
-                mod = importlib.import_module("translate")
-            finally:
-                sys.path.remove(translate_dir)
+            mod = load_translator(translate_dir, translate_py)
         except ImportError:
             sys.stdout.write("xsql: error: unable to import translator, but translation requested\n")
             sys.stdout.flush()
             return None
 
-        importlib.reload(mod)
-
-        return mod.translate(
-            from_,
-            to,
-            conn,
-            query,
-            config.variables.get("translate_options"),
+        return get_translation(
+            (from_, to, options, query),
+            lambda: mod.translate(from_, to, conn, query, options),
         )
     elif os.path.exists(translate_script) and os.access(translate_script, os.X_OK):
 
-        translate_args = [
-            translate_script,
-        ]
+        check_translator(translate_script)
 
-        if config.variables.get("translate_options"):
-            translate_args.extend(
-                [
-                    "--options",
-                    config.variables.get("translate_options"),
-                ],
-            )
+        return get_translation(
+            (from_, to, options, query),
+            lambda: run_translate_script(translate_script, from_, to, query, options),
+        )
+
+
+def load_translator(translate_dir, translate_py):
+    global translator, translator_key
+
+    changed = check_translator(translate_py)
+    if translator is not None and not changed:
+        return translator
+
+    if translate_dir not in sys.path:
+        sys.path.append(translate_dir)
+
+    try:
+        sys.path.insert(0, translate_dir)
+        if translator is None:
+            translator = importlib.import_module("translate")
+        else:
+            translator = importlib.reload(translator)
+    except Exception:
+        # tried again on the next statement, rather than taken as loaded
+        translator_key = None
+        raise
+    finally:
+        sys.path.remove(translate_dir)
+
+    return translator
+
+
+def check_translator(path):
+    global translator_key
+
+    key = (path, os.stat(path).st_mtime_ns)
+    if key == translator_key:
+        return False
+
+    # what it translated before may come out differently now
+    translator_key = key
+    translation_cache.clear()
+
+    return True
+
+
+def get_translation(key, translate_function):
+    global translation_hits, translation_misses
 
+    # only query text is remembered, not statements already built
+    if not isinstance(key[-1], str):
+        return translate_function()
+
+    if key in translation_cache:
+        translation_cache.move_to_end(key)
+        translation_hits += 1
+        return translation_cache[key]
+
+    translation_misses += 1
+
+    translated = translate_function()
+
+    # a failure is reported again every time
+    if translated is not None:
+        translation_cache[key] = translated
+        if len(translation_cache) > translation_cache_size:
+            translation_cache.popitem(last=False)
+
+    return translated
+
+
+def get_translation_counts():
+    return translation_hits, translation_misses
+
+
+def run_translate_script(translate_script, from_, to, query, options):
+
+    translate_args = [
+        translate_script,
+    ]
+
+    if options:
         translate_args.extend(
             [
-                from_,
-                to,
+                "--options",
+                options,
             ],
         )
 
-        try:
-            translate_process = subprocess.Popen(
-                translate_args,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE,
-            )
-        except OSError as oex:
-            sys.stdout.write(
-                "xsql: error: error running {}: {} {}\n"
-                .format(
-                    translate_script,
-                    oex.args[0],
-                    oex.args[1],
-                )
+    translate_args.extend(
+        [
+            from_,
+            to,
+        ],
+    )
+
+    try:
+        translate_process = subprocess.Popen(
+            translate_args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+    except OSError as oex:
+        sys.stdout.write(
+            "xsql: error: error running {}: {} {}\n"
+            .format(
+                translate_script,
+                oex.args[0],
+                oex.args[1],
             )
-            sys.stdout.flush()
-            return None
+        )
+        sys.stdout.flush()
+        return None
 
-        query, stderr = translate_process.communicate(query.encode("utf-8"))
+    query, stderr = translate_process.communicate(query.encode("utf-8"))
 
-        if translate_process.returncode:
-            sys.stdout.write(
-                "xsql: error: error running {}: {}\n"
-                .format(
-                    translate_script,
-                    translate_process.returncode,
-                )
+    if translate_process.returncode:
+        sys.stdout.write(
+            "xsql: error: error running {}: {}\n"
+            .format(
+                translate_script,
+                translate_process.returncode,
             )
+        )
 
-            if stderr:
-                stderr = stderr.decode("utf-8")
-                sys.stdout.write(stderr)
-                if not stderr.endswith("\n"):
-                    sys.stdout.write("\n")
-                sys.stdout.flush()
-                return None
+        if stderr:
+            stderr = stderr.decode("utf-8")
+            sys.stdout.write(stderr)
+            if not stderr.endswith("\n"):
+                sys.stdout.write("\n")
+            sys.stdout.flush()
+            return None
 
-        return query.decode("utf-8")
+    return query.decode("utf-8")